@@ -0,0 +1,235 @@
+"""Build a group's lichendb reference FASTA as one indexed, BGZF-compressed file.
+
+Replaces cat_genomes.sh. Each genome (plain or gzipped, in the group directory or
+still under ncbi_dataset/) is streamed record by record into
+<directory>/concatenated_genomes.fa.gz. Headers are prefixed with the genome's
+accession (`>GCA_000000000.1|contig`) so contig names cannot collide across
+genomes, and sequences are rewrapped at 80 bases.
+
+The same pass writes the samtools indexes (.fai and .gzi, so `samtools faidx`
+and other htslib tools can fetch contigs without decompressing the file) and
+contigs.tsv, which maps every contig to its accession, taxon (from the group's
+*_genome_accessions.txt lists) and source file. No uncompressed copy is made
+and the source genomes are left in place.
+
+With --append, genomes whose accessions are not yet in contigs.tsv are added to
+the end of the existing database; BGZF blocks can be appended, so nothing
+already written is recompressed.
+
+Usage: python build_lichen_db.py Ascomycota/Leotiomycetes [...] [--append] [--threads N]
+"""
+import os
+import zlib
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from genomes import DB_PREFIX, accession, genome_files, read_fasta
+
+DB_NAME = f"{DB_PREFIX}fa.gz"
+LINE_WIDTH = 80
+
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per block, as in htslib
+BGZF_BATCH = 64           # blocks compressed in parallel at a time
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def compress_block(data, level=6):
+    """One BGZF block: a gzip member with the BC extra field giving its compressed size."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    if len(cdata) > 0x10000 - 26:
+        # Incompressible data: store it, which always fits in a block
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord("B"), ord("C"), 2, len(cdata) + 25)
+    return header + cdata + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter:
+    """Writes BGZF blocks, compressing them in a thread pool, and records the .gzi block offsets.
+
+    Starts at the given compressed/uncompressed offsets so an existing file can be appended to.
+    """
+
+    def __init__(self, handle, threads=4, level=6, compressed_offset=0, uncompressed_offset=0, blocks=None):
+        self.handle = handle
+        self.compress = partial(compress_block, level=level)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.compressed = compressed_offset
+        self.uncompressed = uncompressed_offset
+        self.position = uncompressed_offset  # uncompressed offset of the next byte written
+        self.blocks = blocks if blocks is not None else []  # (compressed, uncompressed) start of each block after the first
+        self.buffer = bytearray()
+        self.pending = []
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self.pending.append(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+            if len(self.pending) >= BGZF_BATCH:
+                self._flush_pending()
+
+    def _flush_pending(self):
+        for raw, block in zip(self.pending, self.executor.map(self.compress, self.pending)):
+            if self.compressed:
+                self.blocks.append((self.compressed, self.uncompressed))
+            self.handle.write(block)
+            self.compressed += len(block)
+            self.uncompressed += len(raw)
+        self.pending = []
+
+    def close(self):
+        if self.buffer:
+            self.pending.append(bytes(self.buffer))
+            self.buffer = bytearray()
+        self._flush_pending()
+        self.handle.write(BGZF_EOF)
+        self.executor.shutdown()
+
+
+def write_gzi(path, blocks):
+    with open(path, "wb") as out:
+        out.write(struct.pack("<Q", len(blocks)))
+        for compressed, uncompressed in blocks:
+            out.write(struct.pack("<QQ", compressed, uncompressed))
+
+
+def read_gzi(path):
+    with open(path, "rb") as f:
+        (count,) = struct.unpack("<Q", f.read(8))
+        return [struct.unpack("<QQ", f.read(16)) for _ in range(count)]
+
+
+def taxa_by_accession(directory):
+    """Map accessions to the taxon of the accession list they appear in (group families before the combined list)."""
+    directory = Path(directory)
+    taxa = {}
+    lists = sorted(directory.glob("*_genome_accessions.txt"),
+                   key=lambda path: path.name == f"{directory.name}_genome_accessions.txt")
+    for path in lists:
+        taxon = path.name[:-len("_genome_accessions.txt")]
+        taxon = taxon[len("Reduced_"):] if taxon.startswith("Reduced_") else taxon
+        for line in path.read_text().splitlines():
+            if line.strip():
+                taxa.setdefault(line.strip(), taxon)
+    return taxa
+
+
+def write_genome(writer, genome_file, genome_accession, taxon, fai, contigs):
+    """Stream one genome's records into the database, adding their .fai and contigs.tsv lines to the lists."""
+    for number, (header, sequence) in enumerate(read_fasta(genome_file), 1):
+        if not sequence:
+            continue
+        contig = header.split()[0].decode() if header.split() else str(number)
+        name = f"{genome_accession}|{contig}"
+        writer.write(f">{name}\n".encode())
+        offset = writer.position
+        lines = [sequence[i:i + LINE_WIDTH] for i in range(0, len(sequence), LINE_WIDTH)]
+        writer.write(b"\n".join(lines) + b"\n")
+        fai.append(f"{name}\t{len(sequence)}\t{offset}\t{LINE_WIDTH}\t{LINE_WIDTH + 1}\n")
+        contigs.append(f"{name}\t{genome_accession}\t{taxon}\t{len(sequence)}\t{genome_file.name}\n")
+
+
+def _fai_end(fai_path):
+    """Uncompressed size of the database, from its last .fai entry."""
+    last = None
+    with open(fai_path) as f:
+        for line in f:
+            last = line
+    if last is None:
+        return 0
+    _, length, offset, line_bases, _ = last.split("\t")
+    length, line_bases = int(length), int(line_bases)
+    return int(offset) + length + -(-length // line_bases)  # sequence plus one newline per line
+
+
+def build(directory, threads=4, append=False, level=6):
+    """Build or extend a group's database. Returns (genomes added, contigs added)."""
+    directory = Path(directory)
+    db = directory / DB_NAME
+    fai_path, gzi_path = Path(f"{db}.fai"), Path(f"{db}.gzi")
+    contigs_path = directory / "contigs.tsv"
+    taxa = taxa_by_accession(directory)
+
+    appending = append and db.exists()
+    existing = set()
+    if appending:
+        with open(contigs_path) as f:
+            next(f)
+            existing = {line.split("\t")[1] for line in f}
+    genomes = [genome for genome in genome_files(directory) if accession(genome) not in existing]
+    if appending and not genomes:
+        return 0, 0
+
+    if appending:
+        size = db.stat().st_size
+        with open(db, "rb") as f:
+            f.seek(size - len(BGZF_EOF))
+            if f.read() != BGZF_EOF:
+                raise ValueError(f"{db} does not end with a BGZF EOF block; rebuild it without --append")
+        handle = open(db, "r+b")
+        handle.truncate(size - len(BGZF_EOF))
+        handle.seek(0, os.SEEK_END)
+        writer = BgzfWriter(handle, threads, level, compressed_offset=size - len(BGZF_EOF),
+                            uncompressed_offset=_fai_end(fai_path), blocks=read_gzi(gzi_path))
+    else:
+        # Full builds are written to temporary files and renamed into place at the end
+        handle = open(f"{db}.tmp", "wb")
+        writer = BgzfWriter(handle, threads, level)
+
+    fai, contigs = [], []
+    try:
+        for genome in genomes:
+            genome_accession = accession(genome)
+            write_genome(writer, genome, genome_accession, taxa.get(genome_accession, directory.name), fai, contigs)
+        writer.close()
+    except BaseException:
+        if appending:
+            # Leave the appended-to database as it was
+            handle.truncate(size - len(BGZF_EOF))
+            handle.seek(0, os.SEEK_END)
+            handle.write(BGZF_EOF)
+        raise
+    finally:
+        writer.executor.shutdown()
+        handle.close()
+
+    # The indexes are only updated once the data is written
+    if appending:
+        with open(fai_path, "a") as f:
+            f.writelines(fai)
+        with open(contigs_path, "a") as f:
+            f.writelines(contigs)
+        write_gzi(gzi_path, writer.blocks)
+    else:
+        with open(f"{fai_path}.tmp", "w") as f:
+            f.writelines(fai)
+        with open(f"{contigs_path}.tmp", "w") as f:
+            f.write("contig\taccession\ttaxon\tlength\tsource\n")
+            f.writelines(contigs)
+        write_gzi(f"{gzi_path}.tmp", writer.blocks)
+        for path in (fai_path, contigs_path, gzi_path, db):
+            os.replace(f"{path}.tmp", path)
+    return len(genomes), len(contigs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build indexed BGZF reference FASTA files for lichendb groups.")
+    parser.add_argument("directories", nargs="+", help="Group directories holding the downloaded genome FASTA files.")
+    parser.add_argument("--append", action="store_true", help="Add genomes not yet in the database to its end.")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Compression threads.")
+    parser.add_argument("--level", type=int, default=6, help="Compression level (1-9).")
+    args = parser.parse_args(argv)
+
+    for directory in args.directories:
+        genomes, contigs = build(directory, threads=args.threads, append=args.append, level=args.level)
+        print(f"{directory}: added {genomes} genomes ({contigs} contigs) to {Path(directory) / DB_NAME}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Finding and reading the downloaded genome FASTA files in a lichendb group directory."""
+import re
+import gzip
+from pathlib import Path
+
+GENOME_PATTERNS = ["*.fna", "*.fna.gz", "*.fa", "*.fa.gz", "*.fasta", "*.fasta.gz"]
+# The group's combined database (build_lichen_db.py), not a downloaded genome
+DB_PREFIX = "concatenated_genomes."
+
+
+def accession(genome_file):
+    """NCBI accession (GCA_/GCF_) from a genome file name, else the name without its FASTA suffixes."""
+    name = Path(genome_file).name
+    match = re.match(r"(GC[AF]_\d+\.\d+)", name)
+    return match.group(1) if match else re.sub(r"\.(fna|fa|fasta)(\.gz)?$", "", name)
+
+
+def genome_files(directory):
+    """Genome files in the directory itself or still in an extracted NCBI datasets download."""
+    directory = Path(directory)
+    locations = [directory, *directory.glob("ncbi_dataset/data/*/")]
+    return sorted({path for location in locations for pattern in GENOME_PATTERNS
+                   for path in location.glob(pattern) if path.is_file() and not path.name.startswith(DB_PREFIX)})
+
+
+def read_fasta(fasta_file):
+    """Yield (header, sequence) bytes for each record, without the '>' and line breaks."""
+    opener = gzip.open if str(fasta_file).endswith(".gz") else open
+    with opener(fasta_file, "rb") as f:
+        header, lines = None, []
+        for line in f:
+            if line.startswith(b">"):
+                if header is not None:
+                    yield header, b"".join(lines)
+                header, lines = line[1:].rstrip(), []
+            else:
+                lines.append(line.rstrip())
+        if header is not None:
+            yield header, b"".join(lines)
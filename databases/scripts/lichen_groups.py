@@ -1,53 +1,87 @@
+"""Split the scaffold reference genome table into the lichendb reference groups.
+
+Merges the GenBank assembly table with the taxonkit lineages, then writes one
+CSV per group taxon (<directory>/<taxon>.csv). Groups are defined in
+databases/ref/lichen_groups.yaml.
+
+Each distinct lineage is split into its taxa once and every taxon is looked up
+in a taxon -> group dictionary, so all group CSVs are written from a single
+groupby over the matched rows instead of one substring search per taxon.
+
+Usage: python lichen_groups.py [--groups ../ref/lichen_groups.yaml]
+"""
+import argparse
+from pathlib import Path
+
 import pandas as pd
-import os
-
-# Merge dataframes (Genbank accession table download + taxIDs from taxonkit with reformatted lineage)
-df1 = pd.read_csv('scaffold_reference_genomes.txt', sep='\t')
-df2 = pd.read_csv('scaffold_ref_genomes_lineages_reformat.txt', sep='\t', names=["Organism Taxonomic ID", "Lineage", "Rfmt_Lineage"])
-
-df2[["Family_only"]] = df2["Rfmt_Lineage"].str.split(";", expand=True)[[4]].astype(object)
-
-
-# Merge dataframes
-merged_df = pd.merge(df1, df2, on='Organism Taxonomic ID')
-merged_df.to_csv("scaffold_reference_genomes_lineages.csv", sep=",", index=False) 
-
-class_list = ["Coniocybomycetes", "Dothideomycetes", "Eurotiomycetes", "Lecanoromycetes", "Leotiomycetes", "Lichinomycetes", "Sordariomycetes", "Thelocarpaceae"]
-
-for x in class_list:
-    # Assuming you want to filter rows where the 'Lineage' column contains the class name
-    subset_df = merged_df[merged_df['Lineage'].str.contains(x, na=False)]
-    
-    # Define the output file path
-    file_path = f"Ascomycota/{x}/{x}.csv"
-    
-    # Write the subset dataframe to a CSV file
-    subset_df.to_csv(file_path, sep=',', header=True, index=False)
-
-
-class_list2 = ["Hygrophoraceae", "Tricholomataceae", "Atheliaceae", "Coniophoraceae", "Jaapiaceae", "Tremellaceae"]
-
-for y in class_list2:
-    # Assuming you want to filter rows where the 'Lineage' column contains the class name
-    subset_df2 = merged_df[merged_df['Lineage'].str.contains(y, na=False)]
-    
-    # Define the output file path
-    file_path2 = f"Basidiomycota/Basidiomycetes/{y}.csv"
-    
-    # Write the subset dataframe to a CSV file
-    subset_df2.to_csv(file_path2, sep=',', header=True, index=False)
-
-#check - not run:
-#print(merged_df[merged_df['Lineage'].str.contains('Tremellaceae', case=False, na=False)])
-
-class_list3 = ["Chionosphaeraceae", "Pucciniaceae"]
-
-for z in class_list3:
-    # Assuming you want to filter rows where the 'Lineage' column contains the class name
-    subset_df3 = merged_df[merged_df['Lineage'].str.contains(z, na=False)]
-    
-    # Define the output file path
-    file_path3 = f"Basidiomycota/Urediniomycetes/{z}.csv"
-    
-    # Write the subset dataframe to a CSV file
-    subset_df3.to_csv(file_path3, sep=',', header=True, index=False)
+import yaml
+
+DEFAULT_GROUPS = Path(__file__).resolve().parent.parent / "ref" / "lichen_groups.yaml"
+
+
+def load_groups(groups_file=DEFAULT_GROUPS):
+    """Return {taxon: output CSV path} from the group definitions file."""
+    with open(groups_file) as f:
+        groups = yaml.safe_load(f)["groups"]
+    return {taxon: Path(directory) / f"{taxon}.csv" for directory, taxa in groups.items() for taxon in taxa}
+
+
+def merge_lineages(genomes_file, lineages_file):
+    """Merge the GenBank accession table with the taxonkit lineages on the taxonomic ID."""
+    genomes = pd.read_csv(genomes_file, sep='\t')
+    lineages = pd.read_csv(lineages_file, sep='\t', names=["Organism Taxonomic ID", "Lineage", "Rfmt_Lineage"])
+    # Family is the fifth rank of the reformatted lineage (k;p;c;o;f;g;s)
+    lineages["Family_only"] = lineages["Rfmt_Lineage"].str.split(";").str[4].astype(object)
+    return pd.merge(genomes, lineages, on='Organism Taxonomic ID')
+
+
+def match_taxa(lineage, taxa):
+    """Return a Series mapping row labels to the group taxa in their lineage (one entry per match).
+
+    Lineages are tokenised once per distinct value rather than once per row.
+    """
+    codes, distinct = pd.factorize(lineage.fillna(""))
+    tokens = pd.Series(distinct, dtype=object).str.split(";").explode()
+    matched = tokens[tokens.isin(taxa)]
+    # Expand the per-lineage matches back to the rows that share each lineage
+    rows = pd.DataFrame({"code": codes, "row": lineage.index})
+    per_lineage = pd.DataFrame({"code": matched.index, "taxon": matched.values})
+    hits = rows.merge(per_lineage, on="code").sort_values("row", kind="stable")
+    return pd.Series(hits["taxon"].values, index=hits["row"].values)
+
+
+def write_groups(merged_df, outputs):
+    """Write each group's rows to its CSV in one groupby pass. Returns {taxon: row count}."""
+    hits = match_taxa(merged_df["Lineage"], set(outputs))
+    counts = {}
+    for taxon, rows in merged_df.loc[hits.index].groupby(hits.values, sort=False):
+        outputs[taxon].parent.mkdir(parents=True, exist_ok=True)
+        rows.to_csv(outputs[taxon], sep=',', header=True, index=False)
+        counts[taxon] = len(rows)
+    # Groups with no assemblies still get a CSV with just the header
+    for taxon in outputs.keys() - counts.keys():
+        outputs[taxon].parent.mkdir(parents=True, exist_ok=True)
+        merged_df.iloc[:0].to_csv(outputs[taxon], sep=',', header=True, index=False)
+        counts[taxon] = 0
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split the scaffold reference genomes into lichendb groups.")
+    parser.add_argument("--genomes", default="scaffold_reference_genomes.txt", help="GenBank assembly table (TSV).")
+    parser.add_argument("--lineages", default="scaffold_ref_genomes_lineages_reformat.txt",
+                        help="taxonkit lineage + reformat output (TSV).")
+    parser.add_argument("--groups", default=DEFAULT_GROUPS, help="Group definitions (YAML).")
+    parser.add_argument("--merged", default="scaffold_reference_genomes_lineages.csv", help="Merged table output.")
+    args = parser.parse_args(argv)
+
+    merged_df = merge_lineages(args.genomes, args.lineages)
+    merged_df.to_csv(args.merged, sep=",", index=False)
+
+    outputs = load_groups(args.groups)
+    for taxon, count in write_groups(merged_df, outputs).items():
+        print(f"{count} assemblies written to {outputs[taxon]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Split the lichendb group databases into size-balanced shards, each with its own bwa index.
+
+Each group directory's concatenated_genomes.fa.gz (from build_lichen_db.py) is
+split into ceil(bases / target) shards, with whole genomes assigned largest
+first to the lightest shard. Shards never mix groups, so adding a new class
+list only builds that group's shards, and a group is only re-sharded when its
+accessions change. Shards are written in one pass over the group database and
+indexed in parallel.
+
+<out>/manifest.json describes the shard set for the mapping stage
+(workflow/scripts/map_lichendb.py): each shard's bwa index prefix (relative to
+the manifest), size, and the accession -> taxon lookup of its genomes.
+
+Usage: python shard_lichen_db.py Ascomycota/*/ Basidiomycota/*/ [--out shards] [--target-gb 2] [--workers N]
+"""
+import os
+import json
+import heapq
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from build_lichen_db import DB_NAME, BgzfWriter
+from genomes import read_fasta
+
+MANIFEST = "manifest.json"
+
+
+def genome_sizes(directory):
+    """{accession: [bases, taxon]} from a group's contigs.tsv, in database order."""
+    sizes = {}
+    with open(Path(directory) / "contigs.tsv") as f:
+        next(f)
+        for line in f:
+            _, accession, taxon, length, _ = line.rstrip("\n").split("\t")
+            sizes.setdefault(accession, [0, taxon])[0] += int(length)
+    return sizes
+
+
+def partition(sizes, target_bases):
+    """Assign genomes to ceil(total / target) shards, largest first to the lightest shard."""
+    count = max(1, -(-sum(bases for bases, _ in sizes.values()) // target_bases))
+    loads = [(0, index) for index in range(count)]
+    shards = [[] for _ in range(count)]
+    for accession in sorted(sizes, key=lambda a: -sizes[a][0]):
+        load, index = heapq.heappop(loads)
+        shards[index].append(accession)
+        heapq.heappush(loads, (load + sizes[accession][0], index))
+    return [shard for shard in shards if shard]
+
+
+def write_shards(db, shards, fasta_paths, threads=2):
+    """Write each shard's genomes from the group database to its FASTA in a single pass."""
+    shard_of = {accession: index for index, shard in enumerate(shards) for accession in shard}
+    handles = [open(path, "wb") for path in fasta_paths]
+    writers = [BgzfWriter(handle, threads) for handle in handles]
+    try:
+        for header, sequence in read_fasta(db):
+            writer = writers[shard_of[header.split(b"|", 1)[0].decode()]]
+            writer.write(b">" + header + b"\n")
+            writer.write(b"\n".join(sequence[i:i + 80] for i in range(0, len(sequence), 80)) + b"\n")
+        for writer in writers:
+            writer.close()
+    finally:
+        for writer, handle in zip(writers, handles):
+            writer.executor.shutdown()
+            handle.close()
+
+
+def index_shard(fasta, prefix):
+    with open(f"{prefix}.index.log", "w") as log:
+        subprocess.run(["bwa", "index", "-p", str(prefix), str(fasta)], stdout=log, stderr=log, check=True)
+
+
+def build_group(directory, out_dir, target_bases, sizes):
+    """Shard and index one group. Returns its manifest entries."""
+    directory = Path(directory)
+    shards = partition(sizes, target_bases)
+    names = [f"{directory.name}_{index}" for index in range(len(shards))]
+    fasta_paths = [out_dir / f"{name}.fa.gz" for name in names]
+    write_shards(directory / DB_NAME, shards, fasta_paths)
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        for future in [executor.submit(index_shard, fasta, out_dir / name) for fasta, name in zip(fasta_paths, names)]:
+            future.result()
+    return [{
+        "name": name,
+        "group": str(directory),
+        "prefix": name,
+        "bases": sum(sizes[accession][0] for accession in shard),
+        "accessions": {accession: sizes[accession][1] for accession in shard},
+    } for name, shard in zip(names, shards)]
+
+
+def remove_shard(out_dir, shard):
+    for path in out_dir.glob(f"{shard['prefix']}.*"):
+        path.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build size-balanced, separately indexed shards of lichendb.")
+    parser.add_argument("directories", nargs="+", help="Group directories with concatenated_genomes.fa.gz and contigs.tsv.")
+    parser.add_argument("--out", default="shards", help="Shard directory, holding manifest.json.")
+    parser.add_argument("--target-gb", type=float, default=2.0, help="Target shard size in gigabases.")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Groups built in parallel.")
+    args = parser.parse_args(argv)
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.is_file() else {"shards": []}
+    target_bases = int(args.target_gb * 1e9)
+
+    current = {}
+    for shard in manifest["shards"]:
+        current.setdefault(shard["group"], []).append(shard)
+    todo = {}
+    for directory in args.directories:
+        group = str(Path(directory))
+        sizes = genome_sizes(directory)
+        built = current.get(group, [])
+        if built and {a for shard in built for a in shard["accessions"]} == set(sizes) \
+                and manifest.get("target_bases") == target_bases:
+            print(f"{group}: {len(built)} shards up to date")
+            continue
+        todo[group] = sizes
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {group: executor.submit(build_group, group, out_dir, target_bases, sizes)
+                   for group, sizes in todo.items()}
+        for group, future in futures.items():
+            shards = future.result()
+            for shard in current.get(group, []):
+                if shard["name"] not in {new["name"] for new in shards}:
+                    remove_shard(out_dir, shard)
+            current[group] = shards
+            print(f"{group}: built {len(shards)} shards")
+
+    manifest = {"target_bases": target_bases, "shards": [shard for shards in current.values() for shard in shards]}
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, manifest_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Prune near-identical genomes from the lichendb group directories using FracMinHash sketches.
+
+Each genome FASTA (plain or gzipped) is sketched in parallel: canonical k-mers
+are encoded and hashed with NumPy, and the hashes below 2^64 / scaled are kept.
+Sketches are cached on disk (`dereplicate: cache_dir`) keyed by the file's path,
+size and modification time, so reruns only sketch new genomes.
+
+Within each directory, genomes are clustered greedily, largest sketch first: a
+genome joins its closest kept representative if their estimated ANI is at
+least `ani_threshold`, otherwise it becomes a representative itself. ANI is
+estimated from the containment of the smaller sketch in the larger, C^(1/k), so
+a draft assembly of a genome that is already kept counts as redundant.
+
+Each directory gets clusters.tsv (genome, accession, representative, ANI). With
+--prune, redundant genome files are moved to <directory>/redundant/ so they are
+left out of the concatenated database.
+
+Usage: python sketch_genomes.py Ascomycota/Leotiomycetes [...] [--prune] [--workers N]
+"""
+import os
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from genomes import accession, genome_files, read_fasta
+from lichen_groups import DEFAULT_GROUPS
+
+DEREPLICATE_DEFAULTS = {
+    "ani_threshold": 0.99,
+    "k": 21,
+    "scaled": 1000,
+    "cache_dir": ".sketches",
+}
+
+CHUNK = 1 << 22  # bases hashed at a time, to bound memory on long chromosomes
+
+# A, C, G, T (either case) -> 0-3; anything else -> 4, which breaks k-mers
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _CODES[_base] = _CODES[_base + 32] = _code
+
+
+def load_dereplicate_settings(groups_file=DEFAULT_GROUPS):
+    with open(groups_file) as f:
+        return {**DEREPLICATE_DEFAULTS, **(yaml.safe_load(f).get("dereplicate") or {})}
+
+
+def _splitmix64(x):
+    """Vectorised 64-bit mixing hash (the splitmix64 finaliser)."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def kmer_hashes(codes, k):
+    """Hashes of the canonical k-mers in an array of base codes, skipping k-mers that contain N."""
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = (invalid[k:] - invalid[:-k]) == 0
+
+    bases = (codes & 3).astype(np.uint64)
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    two = np.uint64(2)
+    for j in range(k):
+        window = bases[j:j + n]
+        forward = (forward << two) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * j)
+    with np.errstate(over="ignore"):
+        return _splitmix64(np.minimum(forward, reverse)[valid])
+
+
+def sketch_genome(genome_file, k, scaled):
+    """FracMinHash sketch of a genome: the sorted distinct k-mer hashes below 2^64 / scaled."""
+    max_hash = np.uint64((1 << 64) // scaled)
+    kept = []
+    for _, sequence in read_fasta(genome_file):
+        codes = _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+        # Chunks overlap by k - 1 bases so no k-mer is lost at a boundary
+        for start in range(0, max(len(codes) - k + 1, 1), CHUNK):
+            hashes = kmer_hashes(codes[start:start + CHUNK + k - 1], k)
+            kept.append(hashes[hashes < max_hash])
+    return np.unique(np.concatenate(kept)) if kept else np.empty(0, dtype=np.uint64)
+
+
+def cached_sketch(genome_file, k, scaled, cache_dir):
+    """Return the genome's sketch, computing and caching it unless the file is unchanged since last time."""
+    stat = os.stat(genome_file)
+    key = f"{Path(genome_file).resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{k}|{scaled}"
+    cache_file = Path(cache_dir) / f"{hashlib.sha1(key.encode()).hexdigest()}.npy"
+    if cache_file.is_file():
+        return np.load(cache_file)
+    sketch = sketch_genome(genome_file, k, scaled)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_file, sketch)
+    os.replace(tmp_file, cache_file)
+    return sketch
+
+
+def containment_ani(a, b, k):
+    """ANI estimated from how much of the smaller sketch is contained in the larger."""
+    smaller = min(len(a), len(b))
+    if smaller == 0:
+        return 0.0
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    return (shared / smaller) ** (1 / k)
+
+
+def cluster(sketches, k, threshold):
+    """Greedy clustering, largest sketch first. Returns {genome: (representative, ANI)}."""
+    assignments = {}
+    representatives = []
+    for genome in sorted(sketches, key=lambda g: (-len(sketches[g]), str(g))):
+        best, best_ani = None, 0.0
+        for representative in representatives:
+            ani = containment_ani(sketches[genome], sketches[representative], k)
+            if ani > best_ani:
+                best, best_ani = representative, ani
+        if best is not None and best_ani >= threshold:
+            assignments[genome] = (best, best_ani)
+        else:
+            representatives.append(genome)
+            assignments[genome] = (genome, 1.0)
+    return assignments
+
+
+def dereplicate(directory, sketches, settings, prune=False):
+    """Cluster one directory's genomes and write clusters.tsv; optionally set the redundant ones aside."""
+    directory = Path(directory)
+    assignments = cluster(sketches, settings["k"], settings["ani_threshold"])
+    with open(directory / "clusters.tsv", "w") as out:
+        out.write("genome\taccession\trepresentative\tani\n")
+        for genome, (representative, ani) in sorted(assignments.items()):
+            out.write(f"{genome.name}\t{accession(genome)}\t{accession(representative)}\t{ani:.4f}\n")
+
+    redundant = [genome for genome, (representative, _) in assignments.items() if genome != representative]
+    if prune and redundant:
+        (directory / "redundant").mkdir(exist_ok=True)
+        for genome in redundant:
+            shutil.move(str(genome), str(directory / "redundant" / genome.name))
+    return len(assignments) - len(redundant), len(redundant)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster lichendb genomes by estimated ANI and prune redundant ones.")
+    parser.add_argument("directories", nargs="+", help="Group directories holding the downloaded genome FASTA files.")
+    parser.add_argument("--groups", default=DEFAULT_GROUPS, help="Group definitions (YAML) with a `dereplicate` section.")
+    parser.add_argument("--prune", action="store_true", help="Move redundant genomes to <directory>/redundant/.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Genomes sketched in parallel.")
+    args = parser.parse_args(argv)
+
+    settings = load_dereplicate_settings(args.groups)
+    files = {directory: genome_files(directory) for directory in args.directories}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {genome: executor.submit(cached_sketch, genome, settings["k"], settings["scaled"],
+                                           settings["cache_dir"])
+                   for genomes in files.values() for genome in genomes}
+        sketches = {genome: future.result() for genome, future in futures.items()}
+
+    for directory, genomes in files.items():
+        kept, redundant = dereplicate(directory, {genome: sketches[genome] for genome in genomes},
+                                      settings, prune=args.prune)
+        action = "set aside" if args.prune else "redundant"
+        print(f"{directory}: {kept} representatives, {redundant} genomes {action} "
+              f"(ANI >= {settings['ani_threshold']})")
+
+
+if __name__ == "__main__":
+    main()
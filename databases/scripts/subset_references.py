@@ -1,76 +1,111 @@
-import pandas as pd
+"""Reduce the lichendb group tables to their best assemblies per family and write accession lists.
+
+For the groups listed under `subset: reduce` in databases/ref/lichen_groups.yaml,
+each table is sorted once by family, assembly-level priority (Complete Genome >
+Chromosome > Scaffold > Contig) and the tie-break columns (N50, then total
+length), and the top `top_k` assemblies per family are taken in one groupby.
+With `best_level_only`, only the best level available for each family is kept.
+
+Every group then gets <table>_genome_accessions.txt (replacing get_accessions.sh),
+and directories holding several groups also get <directory>_genome_accessions.txt
+combining them. Tables are processed in parallel.
+
+Usage: python subset_references.py [--groups ../ref/lichen_groups.yaml] [--workers N]
+"""
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import yaml
+
+from lichen_groups import DEFAULT_GROUPS, load_groups
+
+SUBSET_DEFAULTS = {
+    "reduce": [],
+    "level_priority": ["Complete Genome", "Chromosome", "Scaffold", "Contig"],
+    "best_level_only": True,
+    "top_k": 10,
+    "tie_break": [],
+}
+
+
+def load_subset_settings(groups_file=DEFAULT_GROUPS):
+    with open(groups_file) as f:
+        return {**SUBSET_DEFAULTS, **(yaml.safe_load(f).get("subset") or {})}
+
+
+def rank_assemblies(df, settings):
+    """Return the top assemblies per family, best first, and the number of families with more candidates."""
+    levels = {level: rank for rank, level in enumerate(settings["level_priority"])}
+    tie_break = [column for column in settings["tie_break"] if column in df.columns]
 
-# Define the list of CSV files
-list_csvs = [
-    "Ascomycota/Dothideomycetes/Dothideomycetes.csv",
-    "Ascomycota/Eurotiomycetes/Eurotiomycetes.csv",
-    "Ascomycota/Lecanoromycetes/Lecanoromycetes.csv",
-    "Ascomycota/Leotiomycetes/Leotiomycetes.csv",
-    "Ascomycota/Sordariomycetes/Sordariomycetes.csv",
-    "Basidiomycota/Basidiomycetes/Tricholomataceae.csv"
-]
-
-# Loop through each CSV file
-for x in list_csvs:
-    df = pd.read_csv(x, sep=',')
-
-    # Extract unique families
-    unique_families = df['Family_only'].unique()
-    print(f"{unique_families} in {x}")
-
-    dfs = []
-
-    for y in unique_families:
-        dfsub = df[df['Family_only'] == y]
-        print(y)
-
-        # Case 1: Only one entry for this family
-        if dfsub.shape[0] == 1:
-            dfs.append(dfsub)
-            print(f"There is only one available reference genome for {y}")
-
-        # Case 2: Multiple entries for this family
-        else:
-            # Subset where 'Assembly Level' is 'Complete Genome' or 'Chromosome'
-            dfsub2 = dfsub[(dfsub['Assembly Level'] == 'Complete Genome') | (dfsub['Assembly Level'] == 'Chromosome')]
-
-            # If we have 'Chromosome' entries, prefer them
-            if (dfsub2['Assembly Level'] == 'Complete Genome').any():
-                dfs.append(dfsub2[dfsub2['Assembly Level'] == 'Complete Genome'])
-                print(f"Appending 'Complete Genome' assembly level for {y}")
-
-            # If no 'Chromosome' entries but we have 'Complete Genome', append them
-            elif dfsub2.shape[0] > 0:
-                dfsub3 = dfsub2[dfsub2['Assembly Level'] == 'Chromosome']
-                dfs.append(dfsub3)
-                print(f"Appending 'Chromosome' assembly level for {y}")
-                
-            # If no high-level assemblies, append whatever we have for this family
-            else:
-                dfs.append(dfsub)
-                print(f"No high-level assemblies; appending all data for {y}")
-
-            # Check if there are more than 10 entries for a family
-            if dfsub2.shape[0] > 10:
-                print(f"Lots of genome hits; manually curate {y} in {x}")
-
-    # Concatenate all dataframes only if there are entries in dfs
-    if len(dfs) > 0:
-        final = pd.concat(dfs, ignore_index=True)
-
-        # Extract unique families from the concatenated DataFrame
-        unique_families_new = final['Family_only'].unique()
-
-        if len(unique_families) == len(unique_families_new):
-            print(f"All good here for {x}")
-        else:
-            print(f"Warning: Number of families differ after processing {x}")
-
-        filename = os.path.basename(x)
-        filepath = os.path.dirname(x)
-        file_path = os.path.join(filepath, "Reduced_" + filename)
-        final.to_csv(file_path, sep=',', index=False)
-        print(f"Saved reduced file to: {file_path}")
+    ranked = df.assign(_level=df["Assembly Level"].map(levels).fillna(len(levels)))
+    ranked = ranked.sort_values(["Family_only", "_level", *tie_break],
+                                ascending=[True, True, *[False] * len(tie_break)],
+                                kind="stable", na_position="last")
+    if settings["best_level_only"]:
+        ranked = ranked[ranked["_level"] == ranked.groupby("Family_only")["_level"].transform("min")]
+
+    families = ranked.groupby("Family_only", sort=False)
+    crowded = int((families.size() > settings["top_k"]).sum())
+    return families.head(settings["top_k"]).drop(columns="_level"), crowded
+
+
+def accession_list(csv_path):
+    return csv_path.with_name(f"{csv_path.stem}_genome_accessions.txt")
+
+
+def subset_group(taxon, csv_path, settings):
+    """Reduce one group table if configured, and write its accession list. Returns (accession list, message)."""
+    df = pd.read_csv(csv_path, sep=',')
+    if taxon in settings["reduce"]:
+        unassigned = int(df["Family_only"].isna().sum())
+        reduced, crowded = rank_assemblies(df, settings)
+        csv_path = csv_path.with_name(f"Reduced_{csv_path.name}")
+        reduced.to_csv(csv_path, sep=',', index=False)
+        message = (f"{taxon}: kept {len(reduced)} of {len(df)} assemblies across "
+                   f"{reduced['Family_only'].nunique()} families")
+        if crowded:
+            message += f"; {crowded} families had more than {settings['top_k']} candidates"
+        if unassigned:
+            message += f"; {unassigned} assemblies without a family were dropped"
+        df = reduced
     else:
-        print(f"No data to save for {x}")
+        message = f"{taxon}: kept all {len(df)} assemblies"
+
+    # The accession is the first column of the GenBank assembly table
+    accessions = accession_list(csv_path)
+    accessions.write_text("".join(f"{accession}\n" for accession in df.iloc[:, 0]))
+    return accessions, message
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reduce lichendb groups and write genome accession lists.")
+    parser.add_argument("--groups", default=DEFAULT_GROUPS, help="Group definitions (YAML).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Tables processed in parallel.")
+    args = parser.parse_args(argv)
+
+    outputs = load_groups(args.groups)
+    settings = load_subset_settings(args.groups)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {taxon: executor.submit(subset_group, taxon, csv_path, settings)
+                   for taxon, csv_path in outputs.items()}
+        lists = {}
+        for taxon, future in futures.items():
+            lists[taxon], message = future.result()
+            print(message)
+
+    # Directories with several groups (e.g. Basidiomycetes families) also get one combined list
+    by_directory = {}
+    for taxon, csv_path in outputs.items():
+        by_directory.setdefault(csv_path.parent, []).append(lists[taxon])
+    for directory, files in by_directory.items():
+        if len(files) > 1:
+            combined = directory / f"{directory.name}_genome_accessions.txt"
+            combined.write_text("".join(path.read_text() for path in files))
+            print(f"Combined {len(files)} accession lists into {combined}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import gzip
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import decontam_bbduk_bwa
+import human_prefilter
+
+GENOME = "GCF_000001405.40_GRCh38.p14_genomic.fna"
+
+
+def fastq(name, sequence):
+    return b"@%s\n%s\n+\n%s\n" % (name, sequence, b"F" * len(sequence))
+
+
+def read_names(path):
+    with open(path, "rb") as f:
+        return [line[1:].rstrip() for i, line in enumerate(f) if i % 4 == 0]
+
+
+def test_prefilter_with_registry_reference_layout(tmp_path):
+    rng = random.Random(1)
+    human = bytes(rng.choices(b"ACGT", k=20000))
+    other = bytes(rng.choices(b"ACGT", k=20000))
+
+    # reference_registry.link() provides the gzipped FASTA and a bwa index under the .fna prefix
+    ref_dir = tmp_path / "ref"
+    ref_dir.mkdir()
+    with gzip.open(ref_dir / f"{GENOME}.gz", "wb") as f:
+        f.write(b">chr1\n" + human + b"\n")
+    for suffix in (".amb", ".ann", ".bwt", ".pac", ".sa"):
+        (ref_dir / f"{GENOME}{suffix}").write_bytes(b"")
+
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"references:\n  human: {ref_dir / GENOME}\n"
+                           "human_prefilter:\n  workers: 1\n  k: 21\n  window: 11\n")
+    reads = tmp_path / "reads.fq"
+    reads.write_bytes(fastq(b"human", human[5000:5150]) + fastq(b"other", other[5000:5150])
+                      + fastq(b"short", other[:20]))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+
+    candidates, cleared = decontam_bbduk_bwa.run_prefilter("S1", str(reads), str(output_dir), str(tmp_path),
+                                                           str(config_file))
+
+    assert read_names(candidates) == [b"human", b"short"]
+    assert read_names(cleared) == [b"other"]
+    # The filter is cached next to the FASTA that exists, keyed on that file
+    assert (ref_dir / f"{GENOME}.gz.bloom_k21_w11.npy").is_file()
+    assert (output_dir / "S1_human_prefilter.tsv").read_text() == "reads\tto_bwa\tcleared\n3\t2\t1\n"
+
+
+def test_missing_reference_names_both_paths(tmp_path):
+    with pytest.raises(FileNotFoundError, match=r"\.fna \(or .*\.fna\.gz\)"):
+        human_prefilter.resolve_reference(str(tmp_path / GENOME))
@@ -0,0 +1,91 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import lichens
+
+
+def write_config(tmp_path, text):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(text)
+    return str(config_file)
+
+
+def test_run_task_records_failed_stage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    (tmp_path / "samples.csv").write_text("ID,forward,reverse\nS1,r1.fq,r2.fq\n")
+    config_file = write_config(tmp_path, f"paths:\n  samples_csv: {tmp_path / 'samples.csv'}\n"
+                                         f"  fastp_dir: {tmp_path / 'fastp'}\n"
+                                         "tools:\n  fastp: 'false'\n")
+    result_dir = tmp_path / "results"
+    result_dir.mkdir()
+
+    with pytest.raises(Exception):
+        lichens.run_task("fastp", "S1", config_file, result_dir)
+    result = json.loads((result_dir / "S1.json").read_text())
+    assert result["status"] == "failed"
+    assert result["error"]
+
+
+def test_assemble_tasks_find_decontaminated_reads(tmp_path):
+    decontam_dir = tmp_path / "decontaminated_reads"
+    decontam_dir.mkdir()
+    (decontam_dir / "S1_decontaminated_reads.fastq.gz").write_bytes(b"")
+    config_file = write_config(tmp_path, f"paths:\n  decontam_dir: {decontam_dir}\n")
+    paths = lichens.get_section("paths", lichens.PATH_DEFAULTS, config_file)
+
+    tasks = lichens.STAGE_TASKS["assemble"](paths, config_file)
+    assert list(tasks) == ["S1"]
+    assert tasks["S1"].args[1] == str(decontam_dir / "S1_decontaminated_reads.fastq.gz")
+
+
+# Stages whose modules need numpy at import time
+NUMPY_STAGES = {"screen", "partition", "unassembled", "lichendb", "classify"}
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+@pytest.mark.parametrize("stage", ["decontam", "screen", "assemble", "partition", "unassembled", "lichendb",
+                                   "classify"])
+def test_stage_finds_previous_stage_output(tmp_path, monkeypatch, stage, compressed):
+    """Each per-sample stage picks up the files the stage before it writes (fastp -> decontam -> the rest)."""
+    if stage in NUMPY_STAGES:
+        pytest.importorskip("numpy")
+    monkeypatch.chdir(tmp_path)
+    fastp_dir = tmp_path / "fastp"
+    decontam_dir = tmp_path / "decontaminated_reads"
+    fastp_dir.mkdir()
+    decontam_dir.mkdir()
+    (tmp_path / "manifest.json").write_text('{"shards": []}')
+    config_file = write_config(tmp_path, f"paths:\n  fastp_dir: {fastp_dir}\n  decontam_dir: {decontam_dir}\n"
+                                         f"  assembly_dir: {tmp_path / 'assemblies'}\n"
+                                         f"compression:\n  intermediates: {str(compressed).lower()}\n"
+                                         f"lichendb:\n  manifest: {tmp_path / 'manifest.json'}\n")
+
+    # Name the outputs with the producing stages' own code rather than hard-coded file names
+    suffix = lichens._stage_module("compression").fq_suffix(config_file)
+    (fastp_dir / f"S1_processed{suffix}").write_bytes(b"")
+    lichens._stage_module("concatenate_unmerged").concatenate_files("S1", str(fastp_dir), config_file)
+    if stage != "decontam":
+        decontam = lichens._stage_module("decontam_bbduk_bwa")
+        Path(decontam.decontaminated_fastq("S1", str(decontam_dir), config_file)).write_bytes(b"")
+
+    paths = lichens.get_section("paths", lichens.PATH_DEFAULTS, config_file)
+    assert list(lichens.STAGE_TASKS[stage](paths, config_file)) == ["S1"]
+
+
+def test_local_submit_reports_missing_contigs_as_failed(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.chdir(tmp_path)
+    decontam_dir = tmp_path / "decontaminated_reads"
+    decontam_dir.mkdir()
+    (decontam_dir / "S1_decontaminated_reads.fastq").write_text("@r1\nACGT\n+\nFFFF\n")
+    config_file = write_config(tmp_path, f"paths:\n  decontam_dir: {decontam_dir}\n"
+                                         f"  assembly_dir: {tmp_path / 'assemblies'}\n")
+
+    summary = lichens.submit_stage("unassembled", config_file, job_dir=str(tmp_path / "job"), local=True)
+    assert summary["failed"] == ["S1"]
+    assert summary["done"] == []
+    # With no assembly the reads are still written out as FASTA
+    assert (tmp_path / "assemblies" / "S1_megahit" / "unassembled.fa").read_text() == ">r1\nACGT\n"
@@ -0,0 +1,66 @@
+import sqlite3
+import subprocess
+from contextlib import closing
+
+import pytest
+
+import concatenate_unmerged
+import fastp_raw
+from work_queue import WorkQueue
+
+
+def claim_row(queue, id):
+    with closing(sqlite3.connect(str(queue.db_path))) as con:
+        return con.execute("SELECT status, attempts FROM claims WHERE stage = ? AND id = ?",
+                           (queue.stage, id)).fetchone()
+
+
+def test_failed_task_is_marked_failed_then_retried(tmp_path):
+    queue = WorkQueue("fastp", tmp_path / "claims.sqlite", max_attempts=2)
+    calls = []
+
+    def flaky(id):
+        calls.append(id)
+        if len(calls) == 1:
+            raise subprocess.CalledProcessError(1, "fastp")
+        return "ok"
+
+    with pytest.raises(subprocess.CalledProcessError):
+        queue.run("S1", flaky, "S1")
+    assert claim_row(queue, "S1") == ("failed", 1)
+
+    assert queue.run("S1", flaky, "S1") == "ok"
+    assert claim_row(queue, "S1") == ("done", 2)
+
+    # Done samples are not run again
+    assert queue.run("S1", flaky, "S1") is None
+    assert calls == ["S1", "S1"]
+
+
+def test_failing_tool_marks_sample_failed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("tools:\n  fastp: 'false'\n")
+    queue = WorkQueue("fastp", tmp_path / "claims.sqlite")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        queue.run("S1", fastp_raw.run_fastp, "S1", "r1.fq", "r2.fq", str(tmp_path / "fastp"), str(config_file))
+    assert claim_row(queue, "S1") == ("failed", 1)
+
+
+def test_missing_inputs_mark_sample_failed(tmp_path):
+    queue = WorkQueue("concatenate", tmp_path / "claims.sqlite")
+
+    with pytest.raises(FileNotFoundError):
+        queue.run("S1", concatenate_unmerged.concatenate_files, "S1", tmp_path, str(tmp_path / "config.yaml"))
+    assert claim_row(queue, "S1") == ("failed", 1)
+
+
+def test_stale_claim_without_attempts_left_is_marked_failed(tmp_path):
+    # The first worker claims S1 and dies without a heartbeat
+    WorkQueue("decontam", tmp_path / "claims.sqlite", max_attempts=1).claim("S1")
+    queue = WorkQueue("decontam", tmp_path / "claims.sqlite", stale_after=0, max_attempts=1)
+
+    assert queue.claim("S1") is False
+    assert claim_row(queue, "S1") == ("failed", 1)
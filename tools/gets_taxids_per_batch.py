@@ -5,7 +5,13 @@ from pathlib import Path
 import pathlib
 import logging
 import csv
-import subprocess
+
+from taxonomy_index import open_index
+
+# NCBI taxonomy dump (names.dmp/nodes.dmp); the lookup index is built here once
+taxonkit_db = "../../../../users/marik2/apps/bin/taxonkit_db/"
+# Index file; None uses $TAXONOMY_INDEX, else taxonkit_db if writable, else ~/.cache/taxonomy_index/
+taxonomy_index_file = None
 
 # Ensure the logs directory exists
 log_dir = os.path.dirname("./logs/get_taxids.log")
@@ -63,21 +69,31 @@ def merge_df(df):
 
 def get_taxids(df, column_name, file_path):
     ids = [str(item) for item in df[column_name]]
-    with open('ids.txt', 'w') as f:
-        f.write("\n".join(ids))
-    
+
     filename = os.path.basename(file_path)
     filename = filename.replace(".xlsx", "")  # Remove the `.xlsx` extension
     filepath = os.path.dirname(file_path)
     taxoutfile = os.path.join(filepath, f"{filename}_taxids_only.out")
 
-    command = f"cat ids.txt | ../../../../users/marik2/apps/bin/taxonkit name2taxid --data-dir ../../../../users/marik2/apps/bin/taxonkit_db/ > {taxoutfile}"
-    
-    # Execute the shell command
-    subprocess.run(command, shell=True, check=True)
-    
-    # Read the generated taxids.out file
-    taxids_df = pd.read_csv(taxoutfile, header=None, delimiter="\t", names=["Taxonomic_name", "TaxID"])
+    # Look up all names in one batch against the local taxonomy index
+    with open_index(taxonkit_db, taxonomy_index_file) as index:
+        matches = index.name2taxids(ids)
+
+    # Homonyms keep the lowest TaxID here and are listed with all their TaxIDs for checking
+    taxids_df = pd.DataFrame({
+        "Taxonomic_name": ids,
+        "TaxID": pd.array([matches[name][0] if matches[name] else None for name in ids], dtype="Int64"),
+    })
+    ambiguous = {name: taxids for name, taxids in matches.items() if len(taxids) > 1}
+    if ambiguous:
+        logger.warning(f"{len(ambiguous)} names match several TaxIDs")
+        ambiguous_outfile = os.path.join(filepath, f"{filename}_ambiguous_taxids.csv")
+        pd.DataFrame({
+            "Taxonomic_name": list(ambiguous),
+            "TaxIDs": [";".join(map(str, taxids)) for taxids in ambiguous.values()],
+        }).to_csv(ambiguous_outfile, sep=',', index=False)
+    taxids_df.to_csv(taxoutfile, sep="\t", header=False, index=False)
+
     null_mask = taxids_df.isnull().any(axis=1)
     null_rows = taxids_df[null_mask]
     null_outfile = os.path.join(filepath, f"{filename}_null_taxids.csv")
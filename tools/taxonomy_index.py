@@ -0,0 +1,226 @@
+import os
+import re
+import sqlite3
+import hashlib
+import argparse
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "taxonomy_index.sqlite"
+# Overrides the index location (the taxonkit data directory is often a shared, read-only install)
+INDEX_ENV = "TAXONOMY_INDEX"
+
+# Name classes searched by lookups, in order of preference when a name is ambiguous
+NAME_CLASSES = ["scientific name", "equivalent name", "synonym", "genbank synonym",
+                "includes", "common name", "genbank common name"]
+
+# SQLite caps the number of bound parameters per statement
+BATCH_SIZE = 900
+
+
+def normalise_name(name):
+    """Case-fold a taxonomic name and collapse quotes and whitespace."""
+    name = str(name).replace('"', "").replace("'", "")
+    return re.sub(r"\s+", " ", name).strip().casefold()
+
+
+def _read_dmp(file_path):
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\t|\n").split("\t|\t")
+
+
+def _is_current(index_file, taxdump_dir):
+    dumps = [taxdump_dir / "names.dmp", taxdump_dir / "nodes.dmp"]
+    return index_file.is_file() and all(d.stat().st_mtime <= index_file.stat().st_mtime for d in dumps)
+
+
+def default_index_file(taxdump_dir):
+    """Where the index of a taxdump directory lives.
+
+    $TAXONOMY_INDEX if set; otherwise next to the dump if an up-to-date index is
+    already there or the directory is writable, else in the user's cache directory
+    (one index per taxdump directory).
+    """
+    if os.environ.get(INDEX_ENV):
+        return Path(os.environ[INDEX_ENV])
+    taxdump_dir = Path(taxdump_dir)
+    shared = taxdump_dir / INDEX_NAME
+    if _is_current(shared, taxdump_dir) or os.access(taxdump_dir, os.W_OK):
+        return shared
+    digest = hashlib.sha1(str(taxdump_dir.resolve()).encode()).hexdigest()[:12]
+    cache_dir = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "taxonomy_index"
+    return cache_dir / f"{digest}_{INDEX_NAME}"
+
+
+def build_index(taxdump_dir, index_file=None):
+    """Build the name/lineage index from names.dmp and nodes.dmp.
+
+    The index is written to a temporary file and renamed into place, so readers
+    never see a half-built database.
+    """
+    taxdump_dir = Path(taxdump_dir)
+    index_file = Path(index_file or default_index_file(taxdump_dir))
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = index_file.with_suffix(".tmp")
+    if tmp_file.exists():
+        tmp_file.unlink()
+
+    priority = {name_class: rank for rank, name_class in enumerate(NAME_CLASSES)}
+
+    logger.info(f"Building taxonomy index {index_file} from {taxdump_dir}")
+    con = sqlite3.connect(tmp_file)
+    con.executescript("""
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE nodes (taxid INTEGER PRIMARY KEY, parent INTEGER, rank TEXT, name TEXT);
+        CREATE TABLE names (name TEXT, taxid INTEGER, priority INTEGER,
+                            PRIMARY KEY (name, priority, taxid)) WITHOUT ROWID;
+    """)
+
+    con.executemany(
+        "INSERT INTO nodes (taxid, parent, rank) VALUES (?, ?, ?)",
+        ((int(fields[0]), int(fields[1]), fields[2]) for fields in _read_dmp(taxdump_dir / "nodes.dmp"))
+    )
+
+    scientific = []
+    rows = set()
+    for fields in _read_dmp(taxdump_dir / "names.dmp"):
+        taxid, name, name_class = int(fields[0]), fields[1], fields[3]
+        if name_class not in priority:
+            continue
+        if name_class == "scientific name":
+            scientific.append((name, taxid))
+        rows.add((normalise_name(name), taxid, priority[name_class]))
+
+    con.executemany("UPDATE nodes SET name = ? WHERE taxid = ?", scientific)
+    con.executemany("INSERT OR IGNORE INTO names VALUES (?, ?, ?)", rows)
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+
+    os.replace(tmp_file, index_file)
+    logger.info(f"Indexed {len(rows)} names for {len(scientific)} taxa")
+    return index_file
+
+
+class TaxonomyIndex:
+    """Read-only, memory-mapped view of an index built by build_index()."""
+
+    def __init__(self, index_file, mmap_size=2 ** 30):
+        self.con = sqlite3.connect(f"file:{index_file}?mode=ro", uri=True, check_same_thread=False)
+        self.con.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def name2taxids(self, names):
+        """Map each name to all TaxIDs of its best-matching name class ([] if not found)."""
+        keys = {name: normalise_name(name) for name in names}
+        unique_keys = list(set(keys.values()))
+        found = {}
+
+        for start in range(0, len(unique_keys), BATCH_SIZE):
+            batch = unique_keys[start:start + BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            query = (f"SELECT name, taxid, priority FROM names WHERE name IN ({placeholders}) "
+                     "ORDER BY name, priority, taxid")
+            for key, taxid, priority in self.con.execute(query, batch):
+                best = found.setdefault(key, (priority, []))
+                if priority == best[0]:
+                    best[1].append(taxid)
+
+        return {name: found[key][1] if key in found else [] for name, key in keys.items()}
+
+    def name2taxid(self, names):
+        """Map each name to its best-matching TaxID (None if not found).
+
+        Names matching several TaxIDs (homonyms) get the lowest one and are logged;
+        use name2taxids() to get all of them.
+        """
+        matches = self.name2taxids(names)
+        ambiguous = {name: taxids for name, taxids in matches.items() if len(taxids) > 1}
+        for name, taxids in ambiguous.items():
+            logger.warning(f"'{name}' matches {len(taxids)} TaxIDs ({', '.join(map(str, taxids))}); using {taxids[0]}")
+        return {name: taxids[0] if taxids else None for name, taxids in matches.items()}
+
+    def lineage(self, taxid):
+        """Return the lineage of a TaxID from the root down as (taxid, rank, name) tuples."""
+        query = """
+            WITH RECURSIVE up(taxid, parent, rank, name, depth) AS (
+                SELECT taxid, parent, rank, name, 0 FROM nodes WHERE taxid = ?
+                UNION ALL
+                SELECT n.taxid, n.parent, n.rank, n.name, up.depth + 1
+                FROM nodes n JOIN up ON n.taxid = up.parent
+                WHERE up.taxid != up.parent
+            )
+            SELECT taxid, rank, name FROM up ORDER BY depth DESC
+        """
+        return [row for row in self.con.execute(query, (int(taxid),)) if row[0] != 1]
+
+    def lineages(self, taxids):
+        """Return {taxid: ";"-joined lineage names} for a batch of TaxIDs."""
+        return {taxid: ";".join(name for _, _, name in self.lineage(taxid))
+                for taxid in taxids if taxid is not None}
+
+
+def open_index(taxdump_dir, index_file=None):
+    """Open the index for a taxdump directory, building it first if it is missing or stale."""
+    taxdump_dir = Path(taxdump_dir)
+    index_file = Path(index_file or default_index_file(taxdump_dir))
+
+    if not _is_current(index_file, taxdump_dir):
+        build_index(taxdump_dir, index_file)
+
+    return TaxonomyIndex(index_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline NCBI name-to-TaxID and lineage lookups.")
+    parser.add_argument("-d", "--data-dir", required=True, help="Directory containing names.dmp and nodes.dmp.")
+    parser.add_argument("-i", "--index", help=f"Index file (default: ${INDEX_ENV}, else next to the dump if "
+                                              "writable, else ~/.cache/taxonomy_index/).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="(Re)build the index.")
+    name2taxid = subparsers.add_parser("name2taxid", help="Look up TaxIDs for names (one per line).")
+    name2taxid.add_argument("names_file")
+    lineage = subparsers.add_parser("lineage", help="Print lineages for TaxIDs (one per line).")
+    lineage.add_argument("taxids_file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.data_dir, args.index)
+        return
+
+    with open_index(args.data_dir, args.index) as index:
+        if args.command == "name2taxid":
+            with open(args.names_file) as f:
+                names = [line.strip() for line in f if line.strip()]
+            # One line per TaxID, as `taxonkit name2taxid` prints homonyms
+            taxids = index.name2taxids(names)
+            for name in names:
+                for taxid in taxids[name] or [""]:
+                    print(f"{name}\t{taxid}")
+        else:
+            with open(args.taxids_file) as f:
+                taxids = [int(line) for line in f if line.strip()]
+            for taxid, lineage_str in index.lineages(taxids).items():
+                print(f"{taxid}\t{lineage_str}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
+
+
+# Example usage:
+# python taxonomy_index.py -d ./taxonkit_db build
+# python taxonomy_index.py -d ./taxonkit_db name2taxid names.txt
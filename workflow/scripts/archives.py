@@ -0,0 +1,133 @@
+"""Extract only the archive members we need, while downloading (tar) or in parallel (zip).
+
+Members are chosen by a route function that maps a member name to its
+destination path, or None to skip it. Kept members are written as they are
+(compressed FASTQ/FASTA stay compressed) straight to their final location, and
+hashed on the way so they can be checked against an MD5.txt without reading
+them back.
+"""
+import os
+import time
+import tarfile
+import zipfile
+import fnmatch
+import logging
+import urllib.error
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from checksums import HashingReader, copy_and_hash
+from downloads import DOWNLOAD_DEFAULTS, CHUNK_SIZE, open_url
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+FASTQ_PATTERNS = ["*.fq.gz", "*.fastq.gz", "*.fq", "*.fastq"]
+FASTA_PATTERNS = ["*.fna", "*.fna.gz", "*.fa", "*.fa.gz", "*.fasta", "*.fasta.gz"]
+
+
+def flat_route(dest_dir, patterns):
+    """Route members whose file name matches a pattern to dest_dir/<file name>, dropping directories."""
+    dest_dir = Path(dest_dir)
+
+    def route(name):
+        base = Path(name).name
+        if any(fnmatch.fnmatch(base, pattern) for pattern in patterns):
+            return dest_dir / base
+        return None
+    return route
+
+
+def tree_route(dest_dir, patterns):
+    """Route members whose file name matches a pattern to dest_dir/<member path>, keeping directories."""
+    dest_dir = Path(dest_dir)
+
+    def route(name):
+        path = Path(name)
+        if path.is_absolute() or ".." in path.parts:
+            return None
+        if any(fnmatch.fnmatch(path.name, pattern) for pattern in patterns):
+            return dest_dir / path
+        return None
+    return route
+
+
+def _write_member(source, dest):
+    """Write one member to dest via a temporary file; returns its MD5."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest.with_name(dest.name + ".part")
+    md5 = copy_and_hash(source, tmp_path, block_size=CHUNK_SIZE)
+    os.replace(tmp_path, dest)
+    return md5
+
+
+def extract_tar_stream(stream, route):
+    """Extract routed regular-file members from a tar stream as it is read. Returns {dest: md5}."""
+    members = {}
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or (dest := route(member.name)) is None:
+                continue
+            members[dest] = _write_member(tar.extractfile(member), dest)
+            logger.info(f"Extracted {member.name} to {dest}")
+    return members
+
+
+def stream_extract_tar(url, route, settings=None):
+    """Download a tar and extract the routed members from the stream without storing the archive.
+
+    Returns (archive_md5, {dest: md5}). A cached copy in the download cache is
+    read instead of the URL. A dropped connection is resumed from the current byte
+    offset; only if that fails (or the server ignores Range requests) is the archive
+    restarted from the beginning, with exponential backoff between attempts.
+    """
+    settings = settings or get_section("downloads", DOWNLOAD_DEFAULTS)
+    delay = settings["backoff"]
+    for attempt in range(1, settings["retries"] + 1):
+        try:
+            with open_url(url, settings) as source:
+                reader = HashingReader(source)
+                members = extract_tar_stream(reader, route)
+                # Hash the end-of-archive padding too, so the MD5 matches the whole file
+                while reader.read(CHUNK_SIZE):
+                    pass
+            return reader.hexdigest(), members
+        except FileNotFoundError:
+            raise
+        except (urllib.error.URLError, OSError, tarfile.TarError) as e:
+            if attempt == settings["retries"]:
+                raise
+            logger.warning(f"Streaming {url} failed (attempt {attempt}): {e}. Retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+
+
+def extract_zip(zip_path, dest_dir, patterns, keep_paths=False):
+    """Extract the members of one zip whose file names match patterns into dest_dir. Returns {dest: md5}."""
+    route = (tree_route if keep_paths else flat_route)(dest_dir, patterns)
+    members = {}
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or (dest := route(info.filename)) is None:
+                continue
+            with archive.open(info) as source:
+                members[dest] = _write_member(source, dest)
+    logger.info(f"Extracted {len(members)} files from {zip_path}")
+    return members
+
+
+def extract_zips(zip_paths, dest_dir, patterns, max_workers=None, keep_paths=False):
+    """Extract several zips in parallel processes. Returns {zip_path: {dest: md5}} (or the exception)."""
+    zip_paths = [str(p) for p in zip_paths]
+    results = {}
+    if not zip_paths:
+        return results
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(zip_paths), os.cpu_count() or 1)) as executor:
+        futures = {zip_path: executor.submit(extract_zip, zip_path, str(dest_dir), patterns, keep_paths) for zip_path in zip_paths}
+        for zip_path, future in futures.items():
+            try:
+                results[zip_path] = future.result()
+            except Exception as e:
+                logger.error(f"Extraction failed for {zip_path}: {e}")
+                results[zip_path] = e
+    return results
@@ -0,0 +1,267 @@
+import os
+import csv
+import heapq
+import hashlib
+import importlib
+import logging
+import pathlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from compression import fq_suffix, open_input
+from pipeline_config import get_section, setup_logging
+from work_queue import file_lock, get_work_queue
+
+logger = logging.getLogger(__name__)
+
+assembly_dir = "./assemblies"
+choices_file = "assembler_choices.tsv"
+
+# Defaults for the `assembler_routing` section of config/config.yaml
+ROUTING_DEFAULTS = {
+    "assembler": "auto",               # auto, megahit, metaspades or idba_ud
+    "idba_ud_max_bases": 2_000_000_000,
+    "metaspades_max_bases": 20_000_000_000,
+    "metaspades_bytes_per_kmer": 64,   # rough metaSPAdes graph cost per distinct k-mer
+    "memory_headroom": 0.8,            # fraction of free memory an assembly may use
+    "kmer_size": 31,
+    "sketch_size": 10000,
+    "sketch_reads": 20000,
+    "screen_summary": "./screen/screen_summary.tsv",  # from sketch_screen.py, if it was run
+    "off_target_assembler": "megahit",  # for samples the screen flags as off-target ("" to ignore the flag)
+}
+
+ASSEMBLERS = ["megahit", "metaspades", "idba_ud"]
+
+_RC = bytes.maketrans(b"ACGTN", b"TGCAN")
+
+
+def _hash_kmer(kmer):
+    return int.from_bytes(hashlib.blake2b(kmer, digest_size=8).digest(), "little")
+
+
+def measure_reads(file_path, kmer_size=31, sketch_size=10000, sketch_reads=20000):
+    """Count reads and bases, and estimate distinct k-mers with a bottom-k sketch.
+
+    Every read is counted, but only the first `sketch_reads` reads are hashed.
+    The distinct k-mer estimate from that subsample is scaled up linearly to the
+    full read set, which is an upper bound dominated by sequencing errors.
+    """
+    reads = 0
+    bases = 0
+    heap = []     # max-heap (negated) of the smallest hashes seen
+    kept = set()
+
+    with open_input(file_path) as f:
+        for line_no, line in enumerate(f):
+            if line_no % 4 != 1:
+                continue
+            seq = line.rstrip().upper()
+            reads += 1
+            bases += len(seq)
+
+            if reads > sketch_reads:
+                continue
+
+            rc_seq = seq.translate(_RC)[::-1]
+            length = len(seq)
+            for i in range(length - kmer_size + 1):
+                kmer = seq[i:i + kmer_size]
+                if b"N" in kmer:
+                    continue
+                rc_kmer = rc_seq[length - i - kmer_size:length - i]
+                h = _hash_kmer(min(kmer, rc_kmer))
+                if h in kept:
+                    continue
+                if len(heap) < sketch_size:
+                    heapq.heappush(heap, -h)
+                    kept.add(h)
+                elif h < -heap[0]:
+                    kept.discard(-heapq.heappushpop(heap, -h))
+                    kept.add(h)
+
+    if len(heap) < sketch_size:
+        sampled_kmers = len(heap)
+    else:
+        sampled_kmers = (sketch_size - 1) / (-heap[0] / 2 ** 64)
+
+    sampled = min(reads, sketch_reads)
+    distinct_kmers = int(sampled_kmers * reads / sampled) if sampled else 0
+
+    return {"reads": reads, "bases": bases, "distinct_kmers": distinct_kmers}
+
+
+def free_memory_bytes():
+    """Return the memory currently available on this node."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def choose_assembler(metrics, settings, free_memory, has_pairs=True):
+    """Pick an assembler for one sample from its read metrics and free memory."""
+    if settings["assembler"] != "auto":
+        return settings["assembler"]
+
+    memory_budget = free_memory * settings["memory_headroom"]
+    metaspades_memory = metrics["distinct_kmers"] * settings["metaspades_bytes_per_kmer"]
+
+    if metrics["bases"] <= settings["idba_ud_max_bases"]:
+        return "idba_ud"
+    if (has_pairs
+            and metrics["bases"] <= settings["metaspades_max_bases"]
+            and metaspades_memory <= memory_budget):
+        return "metaspades"
+    return "megahit"
+
+
+def load_assembler_choices(assembly_dir=assembly_dir):
+    """Return {ID: assembler} for every sample routed so far."""
+    table = pathlib.Path(assembly_dir) / choices_file
+    if not table.is_file():
+        return {}
+    with table.open(newline="") as f:
+        return {row["ID"]: row["assembler"] for row in csv.DictReader(f, delimiter="\t")}
+
+
+def record_assembler_choices(rows, assembly_dir=assembly_dir):
+    """Merge per-sample routing decisions into the choices table."""
+    table = pathlib.Path(assembly_dir) / choices_file
+    table.parent.mkdir(parents=True, exist_ok=True)
+
+    # Workers on other nodes may be recording their own samples at the same time
+    with file_lock(table.with_suffix(".lock")):
+        records = {}
+        if table.is_file():
+            with table.open(newline="") as f:
+                records = {row["ID"]: row for row in csv.DictReader(f, delimiter="\t")}
+        records.update({row["ID"]: row for row in rows})
+
+        header = ["ID", "assembler", "reads", "bases", "distinct_kmers", "free_memory"]
+        tmp_table = table.with_suffix(".tmp")
+        with tmp_table.open("w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=header, delimiter="\t", extrasaction="ignore")
+            writer.writeheader()
+            for row in records.values():
+                writer.writerow(row)
+        os.replace(tmp_table, table)
+    logger.info(f"Recorded assembler choices in {table}")
+
+
+def load_off_target(summary_file):
+    """Return the IDs that sketch_screen.py flagged as mostly off-target."""
+    table = pathlib.Path(summary_file)
+    if not table.is_file():
+        return set()
+    with table.open(newline="") as f:
+        return {row["ID"] for row in csv.DictReader(f, delimiter="\t") if row["off_target"] == "True"}
+
+
+def get_ids_and_files(seq_dir):
+    dir_path = pathlib.Path(seq_dir)
+    if not dir_path.is_dir():
+        logger.error(f"Directory {seq_dir} does not exist.")
+        return {}
+
+    logger.info(f"Scanning directory: {dir_path}")
+    results = {match.group(1): str(file) for file in sorted(dir_path.glob("*_decontaminated_reads.f*q*"))
+               if (match := re.match(r'(.+?)_decontaminated_reads', file.name))}
+
+    if not results:
+        logger.warning("No IDs found.")
+    else:
+        logger.info(f"Found IDs: {', '.join(results)}")
+
+    return results
+
+
+def route_sample(id, reads_file, unmerged_dir, settings, config_file="config/config.yaml"):
+    """Measure one sample and decide which assembler should run it."""
+    has_pairs = all(pathlib.Path(f"{unmerged_dir}/{id}_unmerged_{n}{fq_suffix(config_file)}").exists() for n in (1, 2))
+    metrics = measure_reads(reads_file, settings["kmer_size"],
+                            settings["sketch_size"], settings["sketch_reads"])
+    free_memory = free_memory_bytes()
+    assembler = choose_assembler(metrics, settings, free_memory, has_pairs)
+    if settings["off_target_assembler"] and id in load_off_target(settings["screen_summary"]):
+        logger.info(f"{id}: flagged off-target by the composition screen")
+        assembler = settings["off_target_assembler"]
+
+    logger.info(f"{id}: {metrics['reads']} reads, {metrics['bases']} bases, "
+                f"~{metrics['distinct_kmers']} distinct k-mers -> {assembler}")
+    return {"ID": id, "assembler": assembler, "free_memory": free_memory, **metrics}
+
+
+def run_assembler(id, assembler, reads_file, seq_dir, unmerged_dir, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    """Dispatch one sample to the assembly script for its chosen assembler."""
+    if assembler == "megahit":
+        importlib.import_module("megahit_assembly").run_megahit(id, reads_file, None, assembly_dir, config_file)
+    elif assembler == "metaspades":
+        importlib.import_module("metaspades_assembly").run_metaspades(id, seq_dir, unmerged_dir, assembly_dir,
+                                                                      config_file, reads_file)
+    elif assembler == "idba_ud":
+        idba_ud = importlib.import_module("idba-ud_assembly")
+        fasta_file = f"{seq_dir}/{id}_decontaminated_reads.fas"
+        if not os.path.exists(fasta_file):
+            fasta_file = idba_ud.run_fq2fa(id, seq_dir, config_file, reads_file, fasta_file)
+        idba_ud.run_idba_ud(id, fasta_file, assembly_dir, config_file)
+    else:
+        logger.error(f"Unknown assembler {assembler} for {id}. Valid assemblers are: {', '.join(ASSEMBLERS)}")
+        raise ValueError(f"Unknown assembler {assembler} for {id}")
+
+
+def route_and_assemble(id, reads_file, seq_dir, unmerged_dir, settings, assembly_dir=assembly_dir,
+                       config_file="config/config.yaml"):
+    """Route and assemble one sample on the node that claimed it from the work queue."""
+    route = route_sample(id, reads_file, unmerged_dir, settings, config_file)
+    record_assembler_choices([route], assembly_dir)
+    run_assembler(id, route["assembler"], reads_file, seq_dir, unmerged_dir, assembly_dir, config_file)
+
+
+def main(seq_dir, unmerged_dir, max_workers=2, config_file="config/config.yaml", assembly_dir=assembly_dir):
+    settings = get_section("assembler_routing", ROUTING_DEFAULTS, config_file)
+    id_to_file = get_ids_and_files(seq_dir)
+    if not id_to_file:
+        logger.error("No IDs found. Exiting.")
+        return
+
+    # Samples the composition screen flagged as off-target are assembled last
+    off_target = load_off_target(settings["screen_summary"])
+    id_to_file = dict(sorted(id_to_file.items(), key=lambda item: item[0] in off_target))
+
+    queue = get_work_queue("assemble", config_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if queue.enabled:
+            # Each node routes the samples it claims against its own free memory
+            futures = {executor.submit(queue.run, id, route_and_assemble, id, reads_file,
+                                       seq_dir, unmerged_dir, settings, assembly_dir, config_file): id
+                       for id, reads_file in id_to_file.items()}
+        else:
+            # Routing is done up front so every decision sees the same free memory
+            routes = [route_sample(id, reads_file, unmerged_dir, settings, config_file)
+                      for id, reads_file in id_to_file.items()]
+            record_assembler_choices(routes, assembly_dir)
+            futures = {executor.submit(run_assembler, route["ID"], route["assembler"],
+                                       id_to_file[route["ID"]], seq_dir, unmerged_dir, assembly_dir,
+                                       config_file): route["ID"]
+                       for route in routes}
+
+        for future in as_completed(futures):
+            id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Assembly failed for {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("assembler_router.log")
+
+    seq_dir = './decontaminated_reads'
+    unmerged_dir = './fastp_processed'
+
+    main(seq_dir, unmerged_dir, max_workers=2)
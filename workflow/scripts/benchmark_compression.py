@@ -0,0 +1,88 @@
+import os
+import time
+import tempfile
+import argparse
+
+import yaml
+
+import compression
+import concatenate_unmerged
+import decontam_bbduk_bwa
+import fastp_raw
+from pipeline_config import CONFIG_FILE, load_config, log_dir
+
+STEPS = ("fastp", "concatenate", "bbduk", "decontam")
+
+
+def bytes_written():
+    """Bytes this process and its finished child processes have caused to be written to storage (Linux).
+
+    Unlike the growth of the output directory this includes scratch and
+    temporary files that are deleted again; writes to tmpfs (e.g. /dev/shm) are
+    not storage writes and are not counted.
+    """
+    with open("/proc/self/io") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("write_bytes:"))
+
+
+def write_config(base_config, compressed, config_file):
+    """Copy the pipeline config with only the compression section changed, so tools and references match."""
+    config = load_config(base_config)
+    config["compression"] = {**(config.get("compression") or {}), "intermediates": compressed}
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def run(compressed, id, r1_path, r2_path, steps, base_config, base_dir=None):
+    """Run the pipeline steps on one read pair, returning {step: (seconds, bytes written)}."""
+    results = {}
+    with tempfile.TemporaryDirectory(dir=base_dir) as work_dir:
+        config_file = os.path.join(work_dir, "config.yaml")
+        write_config(base_config, compressed, config_file)
+        fastp_dir = os.path.join(work_dir, "fastp_processed")
+        decontam_dir = os.path.join(work_dir, "decontaminated_reads")
+        os.makedirs(decontam_dir)
+        suffix = compression.fq_suffix(config_file)
+        reads_file = os.path.join(fastp_dir, f"{id}_all_processed_reads{suffix}")
+
+        for step in steps:
+            before = bytes_written()
+            start = time.perf_counter()
+            if step == "fastp":
+                fastp_raw.run_fastp(id, r1_path, r2_path, fastp_dir, config_file)
+            elif step == "concatenate":
+                concatenate_unmerged.concatenate_files(id, fastp_dir, config_file)
+            elif step == "bbduk":
+                decontam_bbduk_bwa.run_bbduk(id, reads_file, decontam_dir, decontam_dir, config_file)
+            elif step == "decontam":
+                # BBDuk, the human prefilter and bwa, in scratch as `lichens decontam` runs them
+                decontam_bbduk_bwa.decontaminate_sample(id, reads_file, decontam_dir,
+                                                        os.path.join(decontam_dir, "temp_dir"), config_file)
+            results[step] = (time.perf_counter() - start, bytes_written() - before)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Wall time and bytes written per pipeline step with and without compressed intermediates.")
+    parser.add_argument("r1", help="Raw forward reads of one sample.")
+    parser.add_argument("r2", help="Raw reverse reads of one sample.")
+    parser.add_argument("--id", default="benchmark")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Pipeline config supplying tool and reference paths.")
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=list(STEPS),
+                        help="Steps to run, in pipeline order; each needs the outputs of the steps before it.")
+    parser.add_argument("--dir", default=None, help="Directory to benchmark in (e.g. the shared project filesystem).")
+    args = parser.parse_args()
+
+    os.makedirs(log_dir, exist_ok=True)
+    backend = compression._gzip_backend()[0]
+    print(f"gzip backend: {backend}")
+    print("mode\tstep\tseconds\tbytes_written")
+    for compressed in (False, True):
+        results = run(compressed, args.id, args.r1, args.r2, args.steps, args.config, args.dir)
+        for step, (elapsed, written) in results.items():
+            print(f"{'compressed' if compressed else 'plain'}\t{step}\t{elapsed:.2f}\t{written}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import argparse
+from pathlib import Path
+
+import human_prefilter
+from pipeline_config import tool_path
+
+
+def random_genome(rng, length):
+    return bytes(rng.choices(b"ACGT", k=length))
+
+
+def sample_reads(rng, genome, n_reads, read_length, error_rate, prefix):
+    """Reads from random positions and strands of the genome, with substitution errors."""
+    complement = bytes.maketrans(b"ACGT", b"TGCA")
+    records = []
+    for i in range(n_reads):
+        start = rng.randrange(len(genome) - read_length)
+        read = bytearray(genome[start:start + read_length])
+        if rng.random() < 0.5:
+            read = bytearray(bytes(read).translate(complement)[::-1])
+        for j in range(read_length):
+            if rng.random() < error_rate:
+                read[j] = rng.choice(b"ACGT".replace(bytes([read[j]]), b""))
+        records.append(b"@%s%d\n%s\n+\n%s\n" % (prefix, i, bytes(read), b"F" * read_length))
+    return records
+
+
+def bwa_mapped(bwa, reference, reads_file):
+    """Names of the reads bwa maps, and the CPU seconds bwa used."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = subprocess.run([bwa, "mem", "-t", "1", str(reference), str(reads_file)],
+                            capture_output=True, check=True)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    mapped = {line.split(b"\t", 1)[0] for line in result.stdout.splitlines()
+              if not line.startswith(b"@") and not int(line.split(b"\t", 2)[1]) & 0x904}
+    return mapped, (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sensitivity and bwa CPU time of the human prefilter on synthetic reads.")
+    parser.add_argument("--genome-mb", type=float, default=5.0, help="Size of the synthetic 'human' reference.")
+    parser.add_argument("--human-reads", type=int, default=2000)
+    parser.add_argument("--other-reads", type=int, default=100000)
+    parser.add_argument("--read-length", type=int, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--min-hits", type=int, default=human_prefilter.PREFILTER_DEFAULTS["min_hits"])
+    parser.add_argument("--config", default="config/config.yaml", help="Pipeline config giving the bwa path.")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    human = random_genome(rng, int(args.genome_mb * 1e6))
+    other = random_genome(rng, int(args.genome_mb * 1e6))
+    human_reads = sample_reads(rng, human, args.human_reads, args.read_length, args.error_rate, b"human")
+    other_reads = sample_reads(rng, other, args.other_reads, args.read_length, args.error_rate, b"other")
+    reads = human_reads + other_reads
+    rng.shuffle(reads)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        config_file = work_dir / "config.yaml"
+        config_file.write_text(f"human_prefilter:\n  workers: 2\n  min_hits: {args.min_hits}\n")
+        config_file = str(config_file)
+        reference = work_dir / "human.fa"
+        reference.write_bytes(b">chr\n" + human + b"\n")
+        reads_file, candidates_file = work_dir / "reads.fq", work_dir / "candidates.fq"
+        reads_file.write_bytes(b"".join(reads))
+
+        start = time.perf_counter()
+        human_prefilter.load_filter(str(reference), config_file)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        counts = human_prefilter.split_reads(str(reads_file), str(candidates_file), str(work_dir / "cleared.fq"),
+                                             str(reference), config_file)
+        filter_seconds = time.perf_counter() - start
+
+        with open(candidates_file, "rb") as f:
+            candidates = {line[1:].split()[0] for i, line in enumerate(f) if i % 4 == 0}
+        human_names = {record.split(b"\n", 1)[0][1:] for record in human_reads}
+        print(f"filter build: {build_seconds:.2f} s; prefilter: {filter_seconds:.2f} s for {counts['reads']} reads")
+        print(f"reads sent to bwa: {counts['to_bwa']} ({counts['to_bwa'] / counts['reads']:.2%})")
+        print(f"synthetic human reads sent to bwa: {len(candidates & human_names) / len(human_names):.2%}")
+
+        bwa = tool_path("bwa", args.config)
+        if not shutil.which(bwa):
+            print(f"{bwa} not found; skipping the comparison with the full bwa path")
+            return
+        subprocess.run([bwa, "index", str(reference)], capture_output=True, check=True)
+        full, full_cpu = bwa_mapped(bwa, reference, reads_file)
+        filtered, filtered_cpu = bwa_mapped(bwa, reference, candidates_file)
+        print("path\tbwa_cpu_seconds\tmapped_reads")
+        print(f"full\t{full_cpu:.2f}\t{len(full)}")
+        print(f"prefilter\t{filtered_cpu:.2f}\t{len(filtered)}")
+        if full_cpu:
+            print(f"bwa CPU cut by the prefilter: {1 - filtered_cpu / full_cpu:.2%}")
+        print(f"sensitivity against the full bwa path: {len(filtered & full) / max(len(full), 1):.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,20 @@
-import os
-import sys
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import re
 import pathlib
 
-# Ensure the logs directory exists
-log_dir = "./logs"
-os.makedirs(log_dir, exist_ok=True)
+from assembler_router import load_assembler_choices
+from compression import fastq_to_fasta
+from contig_coverage import ContigCoverage, write_coverage
+from pipeline_config import log_dir, setup_logging, tool_path
+from scratch import get_scratch_manager, stage_out
+from work_queue import get_work_queue
 
-# Create a temporary assembly directory
-assembly_dir = './assemblies'
-tmp_dir = pathlib.Path(f"{assembly_dir}/temp")
-tmp_dir.mkdir(exist_ok=True)
-
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-if not logger.hasHandlers():
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
 
-    file_handler = logging.FileHandler(os.path.join(log_dir, "unassembled_reads.log"))
-    file_handler.setFormatter(formatter)
-
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+# Temporary alignment files go in node-local scratch, or <assembly_dir>/temp if there is none
+assembly_dir = './assemblies'
 
 def get_ids_and_files(seq_dir):
     dir_path = pathlib.Path(seq_dir)
@@ -62,12 +47,13 @@ def run_subprocess(command, id, log_prefix):
         logger.error(f"Error running {log_prefix} for {id}. See log for details.")
         raise subprocess.CalledProcessError(result.returncode, command)
 
-def concatenate_files(id, assembler):
-    contigs_file = find_assembly_file(assembler, id)
+def concatenate_files(id, assembler=None, assembly_dir=assembly_dir):
+    assembler = assembler or resolve_assembler(id, assembly_dir)
+    contigs_file = find_assembly_file(assembler, id, assembly_dir)
     unassembled_file = pathlib.Path(f"{assembly_dir}/{id}_{assembler}/unassembled.fa")
     final_assembly_file = pathlib.Path(f"{assembly_dir}/{id}_{assembler}/assembly.fa")
 
-    if contigs_file.exists() and unassembled_file.exists():
+    if contigs_file and contigs_file.exists() and unassembled_file.exists():
         try:
             with final_assembly_file.open('w') as output_file:
                 for input_file in [contigs_file, unassembled_file]:
@@ -75,12 +61,21 @@ def concatenate_files(id, assembler):
             logger.info(f"Successfully concatenated files for {id}.")
         except Exception as e:
             logger.error(f"Error concatenating files for {id}: {e}")
+            raise
     else:
         logger.error(f"Missing contigs or unassembled file for {id}.")
-
-import pathlib
-
-def find_assembly_file(assembler, id):
+        raise FileNotFoundError(f"Missing contigs or unassembled file for {id}")
+
+def resolve_assembler(id, assembly_dir=assembly_dir):
+    """Look up the assembler recorded for this ID by assembler_router.py."""
+    assembler = load_assembler_choices(assembly_dir).get(id)
+    if assembler is None:
+        logger.warning(f"No recorded assembler for {id}. Defaulting to megahit.")
+        return "megahit"
+    return assembler
+
+def find_assembly_file(assembler, id, assembly_dir=assembly_dir):
+    assembler = assembler or resolve_assembler(id, assembly_dir)
     assembly_files = {
         "megahit": "final.contigs.fa",
         "metaspades": "scaffolds.fasta",
@@ -124,79 +119,121 @@ def find_assembly_file(assembler, id):
             return None
 
 
-def run_bwa_unassembled(id, assembler, input_file):
+def run_bwa_unassembled(id, assembler, input_file, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    assembler = assembler or resolve_assembler(id, assembly_dir)
     logger.info(f"Processing with assembler: {assembler}")
 
-    assembly_fasta = find_assembly_file(assembler, id)
-    sam_file = pathlib.Path(f"{assembly_dir}/temp/{id}_assembly_mapped.sam")
-    bam_file = pathlib.Path(f"{assembly_dir}/temp/{id}_assembly_mapped.bam")
-    sorted_bam_file = pathlib.Path(f"{assembly_dir}/temp/{id}_assembly_mapped_sorted.bam")
+    assembly_fasta = find_assembly_file(assembler, id, assembly_dir)
     unassembled_fasta = pathlib.Path(f"{assembly_dir}/{id}_{assembler}/unassembled.fa")
-    assembly_stats_file = pathlib.Path(f"{assembly_dir}/{id}_{assembler}/assembly_stats.txt")
-
-    if assembly_fasta.is_file():
-        try:
-            # Indexing Assembly
-            logger.info(f"Indexing Assembly for {id}")
-            subprocess.run(["bwa", "index", str(assembly_fasta)], check=True)
-
-            # Running BWA MEM
-            with open(sam_file, "w") as sam_out:
-                logger.info(f"Running BWA MEM for {id}")
-                subprocess.run(["bwa", "mem", "-M", "-t", "8", assembly_fasta, input_file], stdout=sam_out, check=True)
-
-            # Convert SAM to BAM
-            logger.info(f"Converting SAM to BAM for {id}")
-            subprocess.run(["samtools", "view", "-b", "-S", sam_file, "-o", bam_file], check=True)
 
-            # Sort BAM file
-            logger.info(f"Sorting BAM file for {id}")
-            subprocess.run(["samtools", "sort", "-o", sorted_bam_file, bam_file], check=True)
-
-            # Extract unassembled reads
-            logger.info(f"Extracting unassembled reads for {id}")
-            with unassembled_fasta.open("w") as fastq_out:
-                subprocess.run(["samtools", "fasta", "-f", "4", sorted_bam_file], stdout=fastq_out, check=True)
-
-            # Generate statistics
-            logger.info(f"Generating statistics for {id}")
-            subprocess.run(["samtools", "stats", sorted_bam_file], stdout=open(assembly_stats_file, "w"), check=True)
-
-            logger.info(f"Successfully processed {id} for unassembled sequences")
-
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error during processing of {id}: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error during processing of {id}: {e}")
+    if assembly_fasta and assembly_fasta.is_file():
+        scratch = get_scratch_manager(config_file)
+        with scratch.reserve(id, scratch.estimate(input_file), pathlib.Path(assembly_dir) / "temp") as work_dir:
+            map_to_assembly(id, assembly_fasta, input_file, work_dir, unassembled_fasta.parent, config_file)
 
     else:
         logger.info(f"No assembly found for {id}, proceeding with unassembled reads")
-        subprocess.run(["cp", input_file, f"./assemblies/{id}_megahit/unassembled.fa"], check=True)
-
-def main(seq_dir, assembler, max_workers=6):
-    """Main function to process all IDs found in the sequence directory."""
+        unassembled_fasta.parent.mkdir(parents=True, exist_ok=True)
+        fastq_to_fasta(input_file, unassembled_fasta)
+
+def map_to_assembly(id, assembly_fasta, input_file, work_dir, final_dir, config_file="config/config.yaml"):
+    """Map reads back to the assembly with all alignment files in work_dir.
+
+    Per-contig coverage (coverage.npz and coverage.tsv) is collected from the bwa output as it is written.
+    Only these, unassembled.fa and assembly_stats.txt are moved to final_dir, once all are complete.
+    """
+    bwa = tool_path("bwa", config_file)
+    samtools = tool_path("samtools", config_file)
+    sam_file = work_dir / f"{id}_assembly_mapped.sam"
+    bam_file = work_dir / f"{id}_assembly_mapped.bam"
+    sorted_bam_file = work_dir / f"{id}_assembly_mapped_sorted.bam"
+    unassembled_fasta = work_dir / "unassembled.fa"
+    assembly_stats_file = work_dir / "assembly_stats.txt"
+    coverage_npz = work_dir / "coverage.npz"
+    coverage_tsv = work_dir / "coverage.tsv"
+
+    try:
+        # Indexing Assembly
+        logger.info(f"Indexing Assembly for {id}")
+        subprocess.run([bwa, "index", str(assembly_fasta)], check=True)
+
+        # Running BWA MEM, accumulating per-contig coverage from the SAM stream as it is written
+        coverage = ContigCoverage()
+        with open(sam_file, "wb") as sam_out:
+            logger.info(f"Running BWA MEM for {id}")
+            process = subprocess.Popen([bwa, "mem", "-M", "-t", "8", assembly_fasta, input_file],
+                                       stdout=subprocess.PIPE)
+            for line in process.stdout:
+                sam_out.write(line)
+                coverage.consume(line)
+            process.stdout.close()
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, "bwa mem")
+        write_coverage(coverage.table(), coverage_npz, coverage_tsv)
+
+        # Convert SAM to BAM
+        logger.info(f"Converting SAM to BAM for {id}")
+        subprocess.run([samtools, "view", "-b", "-S", sam_file, "-o", bam_file], check=True)
+
+        # Sort BAM file
+        logger.info(f"Sorting BAM file for {id}")
+        subprocess.run([samtools, "sort", "-o", sorted_bam_file, bam_file], check=True)
+
+        # Extract unassembled reads
+        logger.info(f"Extracting unassembled reads for {id}")
+        with unassembled_fasta.open("w") as fastq_out:
+            subprocess.run([samtools, "fasta", "-f", "4", sorted_bam_file], stdout=fastq_out, check=True)
+
+        # Generate statistics
+        logger.info(f"Generating statistics for {id}")
+        with assembly_stats_file.open("w") as stats_out:
+            subprocess.run([samtools, "stats", sorted_bam_file], stdout=stats_out, check=True)
+
+        for file in [unassembled_fasta, assembly_stats_file, coverage_npz, coverage_tsv]:
+            stage_out(file, final_dir / file.name)
+
+        logger.info(f"Successfully processed {id} for unassembled sequences")
+
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error during processing of {id}: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error during processing of {id}: {e}")
+        raise
+
+def unassembled_sample(id, assembler, input_file, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    """Map one sample back to its assembly, then concatenate contigs and unassembled reads."""
+    run_bwa_unassembled(id, assembler, input_file, assembly_dir, config_file)
+    concatenate_files(id, assembler, assembly_dir)
+
+def main(seq_dir, assembler=None, max_workers=6, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    """Main function to process all IDs found in the sequence directory.
+
+    If no assembler is given, each ID uses the assembler recorded for it by
+    assembler_router.py.
+    """
     id_to_file = get_ids_and_files(seq_dir)
     if not id_to_file:
         logger.error("No input files found. Exiting.")
         return
 
+    (pathlib.Path(assembly_dir) / "temp").mkdir(parents=True, exist_ok=True)
+
+    queue = get_work_queue("unassembled", config_file)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(run_bwa_unassembled, id, assembler, input_file) for id, input_file in id_to_file.items()]
+        futures = [executor.submit(queue.run, id, unassembled_sample, id, assembler, input_file, assembly_dir,
+                                   config_file)
+                   for id, input_file in id_to_file.items()]
         for future in futures:
             try:
                 future.result()
             except Exception as e:
                 logger.error(f"Error processing a file: {e}")
 
-    # After processing all files, concatenate the results
-    for id in id_to_file.keys():
-        try:
-            concatenate_files(id, assembler)
-        except Exception as e:
-            logger.error(f"Error concatenating files for {id}: {e}")
-
 if __name__ == "__main__":
+    setup_logging("unassembled_reads.log")
+
     seq_dir = './decontaminated_reads/'
-    assembler = 'metaspades'
+    assembler = None  # use the per-sample choice from assembler_router.py
 
     main(seq_dir, assembler, max_workers=6)
@@ -0,0 +1,169 @@
+"""Parallel MD5 verification with a manifest of already-hashed files.
+
+verify_md5_file() replaces `md5sum -c MD5.txt`: listed files are hashed across
+a process pool, and each hash is recorded in .md5_manifest.json next to MD5.txt
+with the file's size and mtime. Later runs trust the manifest for files that
+have not changed, so large archives are hashed once.
+
+HashingWriter, HashingReader and copy_and_hash() hash data as it passes
+through, so a download can be verified without reading the file back.
+"""
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 16 * 1024 * 1024  # read size; a multiple of the page and filesystem block size
+MANIFEST_NAME = ".md5_manifest.json"
+
+
+def md5_file(file_path, block_size=BLOCK_SIZE):
+    """MD5 hex digest of a file, read sequentially in large blocks into a reused buffer."""
+    md5 = hashlib.md5()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while (n := f.readinto(buffer)):
+            md5.update(view[:n])
+    return md5.hexdigest()
+
+
+def hash_files(file_paths, max_workers=None):
+    """Return {path: md5} for several files, hashed in parallel processes."""
+    file_paths = [str(p) for p in file_paths]
+    if len(file_paths) <= 1:
+        return {p: md5_file(p) for p in file_paths}
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(file_paths), os.cpu_count() or 1)) as executor:
+        return dict(zip(file_paths, executor.map(md5_file, file_paths)))
+
+
+def read_md5_file(md5_txt):
+    """Parse md5sum output ("<md5>  <name>" or "<md5> *<name>") into {name: md5}."""
+    expected = {}
+    with open(md5_txt) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            md5, name = line.rstrip("\n").split(None, 1)
+            expected[name.lstrip("*")] = md5.lower()
+    return expected
+
+
+class Manifest:
+    """Known hashes of files in one directory, keyed by path relative to it."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = self.directory / MANIFEST_NAME
+        self.entries = json.loads(self.path.read_text()) if self.path.is_file() else {}
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.directory)
+
+    def get(self, file_path):
+        """The recorded MD5 if the file is unchanged since it was recorded, else None."""
+        entry = self.entries.get(self._key(file_path))
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry["md5"]
+
+    def record(self, file_path, md5):
+        stat = os.stat(file_path)
+        self.entries[self._key(file_path)] = {"md5": md5, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.entries, indent=1, sort_keys=True))
+        os.replace(tmp_path, self.path)
+
+
+def verify_md5_file(md5_txt, max_workers=None, exclude=()):
+    """Check the files listed in an md5sum file, like `md5sum -c`.
+
+    Returns {name: "OK" | "FAILED" | "MISSING"}. Unchanged files already in the
+    manifest are not re-hashed. Names in exclude (checked some other way) are skipped.
+    """
+    md5_txt = Path(md5_txt)
+    directory = md5_txt.parent
+    manifest = Manifest(directory)
+    expected = {name: md5 for name, md5 in read_md5_file(md5_txt).items() if name not in exclude}
+
+    results = {}
+    to_hash = {}
+    for name, md5 in expected.items():
+        file_path = directory / name
+        if not file_path.is_file():
+            results[name] = "MISSING"
+        elif (known := manifest.get(file_path)) is not None:
+            results[name] = "OK" if known == md5 else "FAILED"
+        else:
+            to_hash[str(file_path)] = name
+
+    if to_hash:
+        logger.info(f"Hashing {len(to_hash)} of {len(expected)} files listed in {md5_txt}")
+    for file_path, md5 in hash_files(to_hash, max_workers).items():
+        name = to_hash[file_path]
+        results[name] = "OK" if md5 == expected[name] else "FAILED"
+        manifest.record(file_path, md5)
+    manifest.save()
+
+    for name, status in results.items():
+        if status != "OK":
+            logger.error(f"{name}: {status}")
+    return results
+
+
+class HashingWriter:
+    """File-like wrapper that MD5s everything written through it."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        return self.raw.write(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+class HashingReader:
+    """File-like wrapper that MD5s everything read through it."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.md5.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+def copy_and_hash(source, dest_path, block_size=BLOCK_SIZE, manifest=None):
+    """Copy a binary stream (e.g. a download's stdout) to dest_path, returning its MD5.
+
+    If a Manifest is given the written file is recorded in it, so a later
+    verify_md5_file() does not read it back.
+    """
+    with open(dest_path, "wb") as dest:
+        writer = HashingWriter(dest)
+        while (block := source.read(block_size)):
+            writer.write(block)
+    md5 = writer.hexdigest()
+    if manifest is not None:
+        manifest.record(dest_path, md5)
+    return md5
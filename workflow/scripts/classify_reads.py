@@ -0,0 +1,206 @@
+"""Classify decontaminated reads against the minimizer index of the lichen reference database.
+
+The index (minimizers.py) is built on first use and memory-mapped by each worker
+process. Reads are classified in batches: the minimizers of a whole batch are
+computed together, looked up with one binary search, and each read is assigned
+the taxon whose root-to-leaf path collects the most of its minimizer hits (the
+LCA of tied taxa), or left unclassified with fewer than `min_hits` hits.
+
+Outputs, per sample in the output directory:
+  <ID>_read_labels.tsv.gz  read, taxon, role, hits, minimizers
+  <ID>_abundance.tsv       reads and fraction of all reads per taxon (with lineage and role)
+  <ID>_roles.tsv           reads and fraction per role (mycobiont, photobiont, other, unclassified)
+"""
+import os
+import re
+import pathlib
+import logging
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from compression import open_input, open_output
+from minimizers import CLASSIFY_DEFAULTS, MAX_HASH, encode, ensure_index, kmer_hashes, load_index, window_minima
+from pipeline_config import get_section, setup_logging
+from work_queue import get_work_queue
+
+logger = logging.getLogger(__name__)
+
+UNCLASSIFIED = -1
+_index = None  # (keys, taxa, taxonomy, k, window), loaded once per worker process
+
+
+def _load_index(db_dir):
+    global _index
+    _index = load_index(db_dir)
+
+
+def get_ids_and_files(seq_dir):
+    dir_path = pathlib.Path(seq_dir)
+    if not dir_path.is_dir():
+        logger.error(f"Directory {seq_dir} does not exist.")
+        return {}
+    return {match.group(1): str(file) for file in sorted(dir_path.glob("*_decontaminated_reads.f*q*"))
+            if (match := re.match(r'(.+?)_decontaminated_reads', file.name))}
+
+
+def read_batches(reads_file, batch_reads):
+    """Yield (names, sequences) lists of up to batch_reads FASTQ records."""
+    names, sequences = [], []
+    with open_input(reads_file) as f:
+        for header in f:
+            sequence = next(f).rstrip()
+            next(f)
+            next(f)
+            names.append(header[1:].split(None, 1)[0].decode())
+            sequences.append(sequence)
+            if len(names) == batch_reads:
+                yield names, sequences
+                names, sequences = [], []
+    if names:
+        yield names, sequences
+
+
+def batch_minimizers(sequences, k, window):
+    """Distinct (read, minimizer) pairs of a batch, hashed in one pass over the concatenated reads."""
+    # Reads are joined by N so no k-mer spans two reads; windows spanning two reads are dropped below
+    codes = encode(b"N".join(sequences))
+    starts = np.cumsum([0] + [len(sequence) + 1 for sequence in sequences[:-1]])
+    minima = window_minima(kmer_hashes(codes, k), window)
+    read_of = np.searchsorted(starts, np.arange(len(codes)), side="right") - 1
+    first = np.arange(len(minima))
+    last = first + window + k - 2
+    keep = (minima != MAX_HASH) & (last < len(codes))
+    keep[keep] &= read_of[first[keep]] == read_of[last[keep]]
+    reads, minima = read_of[first[keep]], minima[keep]
+    if not len(reads):
+        return reads, minima
+    order = np.lexsort((minima, reads))
+    reads, minima = reads[order], minima[order]
+    distinct = np.concatenate(([True], (reads[1:] != reads[:-1]) | (minima[1:] != minima[:-1])))
+    return reads[distinct], minima[distinct]
+
+
+def best_taxon(hit_taxa, counts, taxonomy):
+    """Taxon whose root-to-leaf path has the most hits; ties resolve to their LCA. Returns (taxon, hits)."""
+    depth = taxonomy.depth[hit_taxa]
+    # on_path[i, j]: hit taxon j is taxon i or one of its ancestors
+    on_path = taxonomy.ancestors[np.ix_(hit_taxa, depth)] == hit_taxa[None, :]
+    scores = on_path.astype(np.int64) @ counts
+    best = scores.max()
+    tied = hit_taxa[scores == best]
+    taxon = tied[0]
+    for other in tied[1:]:
+        taxon = taxonomy.lca(np.array([taxon]), np.array([other]))[0]
+    return int(taxon), int(best)
+
+
+def classify_batch(names, sequences, min_hits):
+    """Classify one batch in a worker. Returns [(read, taxon, hits, minimizers)], taxon -1 if unclassified."""
+    keys, taxa, taxonomy, k, window = _index
+    reads, minima = batch_minimizers(sequences, k, window)
+    totals = np.bincount(reads, minlength=len(names))
+    found = np.searchsorted(keys, minima)
+    found[found == len(keys)] = 0
+    matched = keys[found] == minima
+    reads, hit_taxa = reads[matched], np.asarray(taxa[found[matched]], dtype=np.int64)
+
+    labels = [(name, UNCLASSIFIED, 0, int(total)) for name, total in zip(names, totals)]
+    if len(reads):
+        bounds = np.flatnonzero(np.diff(reads)) + 1
+        for read_taxa, read in zip(np.split(hit_taxa, bounds), reads[np.concatenate(([0], bounds))]):
+            unique, counts = np.unique(read_taxa, return_counts=True)
+            taxon, hits = best_taxon(unique, counts, taxonomy)
+            if hits >= min_hits:
+                labels[read] = (names[read], taxon, hits, labels[read][3])
+    return labels
+
+
+def classify_sample(id, reads_file, settings, executor=None):
+    ensure_index(settings)
+    taxonomy = load_index(settings["db"])[2]
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=settings["workers"], initializer=_load_index,
+                                       initargs=(settings["db"],))
+    output_dir = pathlib.Path(settings["output_dir"])
+    labels_file = output_dir / f"{id}_read_labels.tsv.gz"
+    tmp_file = output_dir / f"{id}_read_labels.tmp.tsv.gz"
+    counts = Counter()
+    try:
+        with open_output(tmp_file) as out:
+            out.write(b"read\ttaxon\trole\thits\tminimizers\n")
+            # Keep a bounded number of batches in flight so the reads are never all in memory
+            pending = deque()
+            batches = read_batches(reads_file, settings["batch_reads"])
+            for names, sequences in batches:
+                pending.append(executor.submit(classify_batch, names, sequences, settings["min_hits"]))
+                if len(pending) >= 2 * settings["workers"]:
+                    _write_labels(out, pending.popleft().result(), taxonomy, counts)
+            while pending:
+                _write_labels(out, pending.popleft().result(), taxonomy, counts)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    os.replace(tmp_file, labels_file)
+    write_abundance(id, counts, taxonomy, output_dir)
+
+
+def _write_labels(out, labels, taxonomy, counts):
+    lines = []
+    for read, taxon, hits, total in labels:
+        counts[taxon] += 1
+        if taxon == UNCLASSIFIED:
+            lines.append(f"{read}\tunclassified\tunclassified\t{hits}\t{total}\n")
+        else:
+            lines.append(f"{read}\t{taxonomy.names[taxon]}\t{taxonomy.roles[taxon]}\t{hits}\t{total}\n")
+    out.write("".join(lines).encode())
+
+
+def write_abundance(id, counts, taxonomy, output_dir):
+    total = sum(counts.values()) or 1
+    roles = Counter()
+    with open(pathlib.Path(output_dir) / f"{id}_abundance.tsv", "w") as out:
+        out.write("taxon\tlineage\trole\treads\tfraction\n")
+        for taxon, reads in counts.most_common():
+            if taxon == UNCLASSIFIED:
+                name, lineage, role = "unclassified", "", "unclassified"
+            else:
+                name, lineage, role = taxonomy.names[taxon], taxonomy.lineage(taxon), taxonomy.roles[taxon]
+            roles[role] += reads
+            out.write(f"{name}\t{lineage}\t{role}\t{reads}\t{reads / total:.6f}\n")
+    with open(pathlib.Path(output_dir) / f"{id}_roles.tsv", "w") as out:
+        out.write("role\treads\tfraction\n")
+        for role in ("mycobiont", "photobiont", "other", "unclassified"):
+            out.write(f"{role}\t{roles[role]}\t{roles[role] / total:.6f}\n")
+    logger.info(f"{id}: {total - counts[UNCLASSIFIED]} of {total} reads classified "
+                f"({roles['mycobiont']} mycobiont, {roles['photobiont']} photobiont)")
+
+
+def main(seq_dir, config_file="config/config.yaml", max_workers=2):
+    settings = get_section("classify", CLASSIFY_DEFAULTS, config_file)
+    id_to_file = get_ids_and_files(seq_dir)
+    if not id_to_file:
+        logger.error("No input files found. Exiting.")
+        return
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    ensure_index(settings)
+
+    queue = get_work_queue("classify", config_file)
+    # One process pool shared by the samples; each worker maps the index once
+    with ProcessPoolExecutor(max_workers=settings["workers"], initializer=_load_index,
+                             initargs=(settings["db"],)) as pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {id: executor.submit(queue.run, id, classify_sample, id, reads_file, settings, pool)
+                   for id, reads_file in id_to_file.items()}
+        for id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error classifying {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("classify_reads.log")
+    main('./decontaminated_reads/')
@@ -0,0 +1,185 @@
+"""Run a stage's per-sample tasks as a SLURM job array, or locally with the same interface.
+
+prepare_array_job() writes a job directory containing the task list (one sample
+ID per line), an sbatch script whose array index selects the ID, and empty
+results/ and logs/ directories. Each task writes results/<ID>.json when it
+finishes, and collect_results() summarises them.
+
+SlurmExecutor submits the script with sbatch. LocalExecutor runs the same
+script once per array index with subprocesses, so jobs can be tested without a
+cluster.
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `slurm` section of config/config.yaml
+SLURM_DEFAULTS = {
+    "partition": None,
+    "account": None,
+    "max_parallel": 50,       # array tasks running at once (%N on --array)
+    "sbatch_options": [],     # extra "#SBATCH" lines, e.g. ["--mail-type=FAIL"]
+    "resources": {},          # per-stage overrides of STAGE_RESOURCES, e.g. {assemble: {mem: 200G}}
+}
+
+# Resources for one task (one sample) of each stage
+DEFAULT_RESOURCES = {"cpus": 1, "mem": "4G", "time": "12:00:00"}
+STAGE_RESOURCES = {
+    "fastp": {"cpus": 4, "mem": "8G", "time": "6:00:00"},
+    "decontam": {"cpus": 8, "mem": "16G", "time": "12:00:00"},    # bwa -t 8 against GRCh38
+    "stream": {"cpus": 12, "mem": "20G", "time": "12:00:00"},     # fastp, BBDuk and bwa at once
+    "screen": {"cpus": 2, "mem": "8G", "time": "2:00:00"},
+    "assemble": {"cpus": 16, "mem": "120G", "time": "48:00:00"},  # metaSPAdes is the largest
+    "partition": {"cpus": 16, "mem": "64G", "time": "24:00:00"},  # classification, then up to 3 bin assemblies
+    "unassembled": {"cpus": 8, "mem": "16G", "time": "12:00:00"},
+    "composition": {"cpus": 1, "mem": "8G", "time": "2:00:00"},
+    "lichendb": {"cpus": 16, "mem": "32G", "time": "12:00:00"},   # 4 shards x bwa -t 4 at once
+    "classify": {"cpus": 8, "mem": "32G", "time": "6:00:00"},     # memory-mapped minimizer index
+}
+
+
+def stage_resources(stage, config_file="config/config.yaml"):
+    """Resources for one task of a stage, with overrides from the `slurm` config section."""
+    overrides = get_section("slurm", SLURM_DEFAULTS, config_file)["resources"] or {}
+    return {**DEFAULT_RESOURCES, **STAGE_RESOURCES.get(stage, {}), **(overrides.get(stage) or {})}
+
+
+def prepare_array_job(stage, ids, job_dir, task_command, config_file="config/config.yaml"):
+    """Write the task list and sbatch script for one stage; returns the job directory.
+
+    task_command is the command that runs one task; the sample ID and the results
+    directory are appended to it.
+    """
+    settings = get_section("slurm", SLURM_DEFAULTS, config_file)
+    resources = stage_resources(stage, config_file)
+    ids = sorted(ids)
+    if not ids:
+        raise ValueError(f"No tasks to submit for stage {stage}")
+
+    job_dir = Path(job_dir).resolve()
+    for sub_dir in ("results", "logs"):
+        (job_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+    (job_dir / "tasks.txt").write_text("".join(f"{id}\n" for id in ids))
+    (job_dir / "job.json").write_text(json.dumps({"stage": stage, "ids": ids, "resources": resources}, indent=2))
+
+    header = [
+        f"#SBATCH --job-name=lichens_{stage}",
+        f"#SBATCH --array=0-{len(ids) - 1}%{settings['max_parallel']}",
+        f"#SBATCH --cpus-per-task={resources['cpus']}",
+        f"#SBATCH --mem={resources['mem']}",
+        f"#SBATCH --time={resources['time']}",
+        f"#SBATCH --output={job_dir}/logs/%A_%a.out",
+    ]
+    if settings["partition"]:
+        header.append(f"#SBATCH --partition={settings['partition']}")
+    if settings["account"]:
+        header.append(f"#SBATCH --account={settings['account']}")
+    header.extend(f"#SBATCH {option}" for option in settings["sbatch_options"] or [])
+
+    command = " ".join(shlex.quote(str(part)) for part in task_command)
+    script = "\n".join([
+        "#!/bin/bash",
+        *header,
+        "",
+        "set -euo pipefail",
+        f"cd {shlex.quote(os.getcwd())}",
+        f"ID=$(sed -n \"$((SLURM_ARRAY_TASK_ID + 1))p\" {shlex.quote(str(job_dir / 'tasks.txt'))})",
+        f"exec {command} \"$ID\" --result-dir {shlex.quote(str(job_dir / 'results'))}",
+        "",
+    ])
+    (job_dir / "submit.sh").write_text(script)
+    logger.info(f"Prepared {len(ids)} {stage} tasks in {job_dir}")
+    return job_dir
+
+
+def write_result(result_dir, stage, id, status, started, error=None):
+    """Record the outcome of one task for collect_results()."""
+    result = {"ID": id, "stage": stage, "status": status, "host": socket.gethostname(),
+              "started": started, "finished": time.time(), "error": error}
+    result_file = Path(result_dir) / f"{id}.json"
+    tmp_file = result_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(result))
+    os.replace(tmp_file, result_file)
+
+
+def collect_results(job_dir):
+    """Return {"done": [...], "failed": [...], "missing": [...]} sample IDs for a job directory."""
+    job_dir = Path(job_dir)
+    job = json.loads((job_dir / "job.json").read_text())
+    summary = {"done": [], "failed": [], "missing": []}
+    for id in job["ids"]:
+        result_file = job_dir / "results" / f"{id}.json"
+        if not result_file.is_file():
+            summary["missing"].append(id)
+            continue
+        result = json.loads(result_file.read_text())
+        summary["done" if result["status"] == "done" else "failed"].append(id)
+        if result["status"] != "done":
+            logger.error(f"{job['stage']} failed for {id} on {result['host']}: {result['error']}")
+    logger.info(f"{job['stage']}: {len(summary['done'])} done, {len(summary['failed'])} failed, "
+                f"{len(summary['missing'])} missing")
+    return summary
+
+
+class SlurmExecutor:
+    """Submit a prepared job directory with sbatch."""
+
+    def submit(self, job_dir, wait=False):
+        command = ["sbatch", "--parsable", *(["--wait"] if wait else []), str(Path(job_dir) / "submit.sh")]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0 and not (wait and result.stdout.strip()):
+            # With --wait, sbatch exits non-zero if any array task failed; the collector reports those
+            logger.error(f"sbatch failed: {result.stderr.strip()}")
+            raise subprocess.CalledProcessError(result.returncode, command)
+        job_id = result.stdout.strip().split(";")[0]
+        logger.info(f"Submitted array job {job_id}")
+        return job_id
+
+
+class LocalExecutor:
+    """Run every array task of a prepared job directory on this machine."""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def _run_task(self, job_dir, index, cpus):
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(index), SLURM_CPUS_PER_TASK=str(cpus))
+        with open(job_dir / "logs" / f"local_{index}.out", "w") as log:
+            return subprocess.run(["bash", str(job_dir / "submit.sh")], env=env,
+                                  stdout=log, stderr=subprocess.STDOUT).returncode
+
+    def submit(self, job_dir, wait=True):
+        """Run the tasks (always waits; `wait` is accepted for interface compatibility)."""
+        job_dir = Path(job_dir)
+        job = json.loads((job_dir / "job.json").read_text())
+        cpus = job["resources"]["cpus"]
+        # Without a limit, run as many tasks as fit on this machine's CPUs
+        max_workers = self.max_workers or max(1, (os.cpu_count() or 1) // cpus)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return_codes = list(executor.map(lambda index: self._run_task(job_dir, index, cpus),
+                                             range(len(job["ids"]))))
+        failed = sum(1 for code in return_codes if code != 0)
+        if failed:
+            logger.warning(f"{failed} of {len(return_codes)} local tasks exited non-zero")
+        return "local"
+
+
+def get_executor(local=False, max_workers=None):
+    return LocalExecutor(max_workers) if local else SlurmExecutor()
+
+
+def task_command(stage, config_file):
+    """Command an array task runs to process one sample of a stage through lichens.py."""
+    return [sys.executable, str(Path(__file__).resolve().with_name("lichens.py")),
+            "--config", str(Path(config_file).resolve()), "task", stage]
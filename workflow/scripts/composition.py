@@ -0,0 +1,141 @@
+"""Tetranucleotide (and optionally pentanucleotide) frequency profiles of assembled contigs.
+
+Composition separates mycobiont from photobiont contigs, so downstream binning
+and plotting need a profile for every contig. Contigs are 2-bit encoded and
+processed in batches of about `batch_bases`: the batch is concatenated with
+separators, every k-mer is read with a sliding window view and mapped to its
+canonical k-mer, and one bincount over (contig, k-mer) gives the counts of the
+whole batch. k-mers containing N are skipped.
+
+Each sample's contig file (as recorded by assembler_router.py) is profiled in
+its own process. Outputs, per sample in the output directory:
+  <ID>_k4.npy         float32 matrix, one row per contig, one column per canonical 4-mer
+                      (lexicographic order, see canonical_kmers); rows sum to 1
+  <ID>_k5.npy         the same for 5-mers, if 5 is in `kmers`
+  <ID>_contigs.tsv    row index, contig name and length
+Contigs shorter than `min_length` are left out.
+"""
+import os
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from assembler_router import load_assembler_choices
+from bwa_unassembled import find_assembly_file
+from minimizers import encode, read_fasta
+from pipeline_config import get_section, setup_logging
+
+logger = logging.getLogger(__name__)
+
+assembly_dir = "./assemblies"
+
+# Defaults for the `composition` section of config/config.yaml
+COMPOSITION_DEFAULTS = {
+    "kmers": [4],            # add 5 for pentanucleotide profiles
+    "min_length": 1000,
+    "batch_bases": 10_000_000,
+    "workers": 4,            # assemblies profiled at once
+    "output_dir": "./composition",
+}
+
+
+@lru_cache(maxsize=None)
+def canonical_index(k):
+    """Column of each k-mer code (base-4 number) in the canonical profile, and the number of columns."""
+    codes = np.arange(4 ** k)
+    digits = (codes[:, None] >> (2 * np.arange(k - 1, -1, -1))) & 3
+    reverse = ((3 - digits[:, ::-1]) << (2 * np.arange(k - 1, -1, -1))).sum(axis=1)
+    canonical = np.minimum(codes, reverse)
+    columns, index = np.unique(canonical, return_inverse=True)
+    return index.astype(np.int64), len(columns)
+
+
+def canonical_kmers(k):
+    """Labels of the profile columns."""
+    return [kmer for kmer in map("".join, itertools.product("ACGT", repeat=k))
+            if kmer <= kmer[::-1].translate(str.maketrans("ACGT", "TGCA"))]
+
+
+def profile_batch(sequences, k):
+    """k-mer frequency matrix (float32) of a list of sequences."""
+    index, columns = canonical_index(k)
+    codes = encode(b"N".join(sequences))
+    contig = np.repeat(np.arange(len(sequences)), [len(sequence) + 1 for sequence in sequences])[:len(codes)]
+    windows = sliding_window_view(codes, k)
+    valid = (windows < 4).all(axis=1)
+    # Base-4 number of each k-mer; uint16 holds 4^k - 1 for the k used here and keeps the batch small
+    kmer_codes = windows @ (4 ** np.arange(k - 1, -1, -1)).astype(np.uint16)
+    counts = np.bincount(contig[:len(windows)][valid] * columns + index[kmer_codes[valid]],
+                         minlength=len(sequences) * columns).reshape(len(sequences), columns)
+    totals = counts.sum(axis=1, keepdims=True)
+    return (counts / np.maximum(totals, 1)).astype(np.float32)
+
+
+def contig_batches(fasta_file, min_length, batch_bases):
+    """Yield (names, sequences) of contigs of at least min_length, about batch_bases at a time."""
+    names, sequences, bases = [], [], 0
+    for header, sequence in read_fasta(fasta_file):
+        if len(sequence) < min_length:
+            continue
+        names.append(header.split()[0].decode())
+        sequences.append(sequence)
+        bases += len(sequence)
+        if bases >= batch_bases:
+            yield names, sequences
+            names, sequences, bases = [], [], 0
+    if names:
+        yield names, sequences
+
+
+def profile_assembly(id, fasta_file, settings):
+    """Write the composition matrices and contig index of one assembly. Returns the number of contigs."""
+    output_dir = settings["output_dir"]
+    matrices = {k: [] for k in settings["kmers"]}
+    contigs = 0
+    with open(f"{output_dir}/{id}_contigs.tsv", "w") as index_out:
+        index_out.write("row\tcontig\tlength\n")
+        for names, sequences in contig_batches(fasta_file, settings["min_length"], settings["batch_bases"]):
+            for k in matrices:
+                matrices[k].append(profile_batch(sequences, k))
+            index_out.writelines(f"{contigs + i}\t{name}\t{len(sequence)}\n"
+                                 for i, (name, sequence) in enumerate(zip(names, sequences)))
+            contigs += len(names)
+    for k, parts in matrices.items():
+        matrix = np.concatenate(parts) if parts else np.empty((0, canonical_index(k)[1]), dtype=np.float32)
+        np.save(f"{output_dir}/{id}_k{k}.npy", matrix)
+    logger.info(f"{id}: profiled {contigs} contigs from {fasta_file}")
+    return contigs
+
+
+def get_assemblies(assembly_dir=assembly_dir):
+    """{ID: contig file} for every sample with an assembly from its recorded assembler."""
+    assemblies = {id: find_assembly_file(assembler, id, assembly_dir)
+                  for id, assembler in load_assembler_choices(assembly_dir).items()}
+    return {id: str(fasta_file) for id, fasta_file in assemblies.items() if fasta_file}
+
+
+def main(config_file="config/config.yaml", assembly_dir=assembly_dir):
+    settings = get_section("composition", COMPOSITION_DEFAULTS, config_file)
+    assemblies = get_assemblies(assembly_dir)
+    if not assemblies:
+        logger.error("No assemblies found. Exiting.")
+        return
+    os.makedirs(settings["output_dir"], exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=settings["workers"]) as executor:
+        futures = {id: executor.submit(profile_assembly, id, fasta_file, settings)
+                   for id, fasta_file in assemblies.items()}
+        for id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error profiling the assembly of {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("composition.log")
+    main()
@@ -0,0 +1,82 @@
+import os
+import gzip
+import shutil
+import logging
+
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `compression` section of config/config.yaml
+COMPRESSION_DEFAULTS = {
+    "intermediates": False,
+    "level": 1,
+}
+
+
+def settings(config_file="config/config.yaml"):
+    return get_section("compression", COMPRESSION_DEFAULTS, config_file)
+
+
+def compress_intermediates(config_file="config/config.yaml"):
+    """True if intermediate FASTQ files should be written gzipped."""
+    return bool(settings(config_file)["intermediates"])
+
+
+def fq_suffix(config_file="config/config.yaml"):
+    """Suffix for intermediate FASTQ files: ".fq.gz" when compression is on, else ".fq"."""
+    return ".fq.gz" if compress_intermediates(config_file) else ".fq"
+
+
+def _gzip_backend():
+    """Return (name, open) for the fastest available gzip implementation."""
+    try:
+        from isal import igzip
+        return "isal", igzip.open
+    except ImportError:
+        pass
+    try:
+        from zlib_ng import gzip_ng
+        return "zlib-ng", gzip_ng.open
+    except ImportError:
+        pass
+    return "zlib", gzip.open
+
+
+def open_output(file_path, level=None, config_file="config/config.yaml"):
+    """Open a file for binary writing, gzipping with a fast backend if the name ends in .gz."""
+    if not str(file_path).endswith(".gz"):
+        return open(file_path, "wb")
+
+    name, gzip_open = _gzip_backend()
+    level = settings(config_file)["level"] if level is None else level
+    if name == "isal":
+        level = min(level, 3)  # isa-l supports levels 0-3
+    return gzip_open(file_path, "wb", compresslevel=level)
+
+
+def open_input(file_path):
+    """Open a plain or gzipped file for binary reading."""
+    if not str(file_path).endswith(".gz"):
+        return open(file_path, "rb")
+    return _gzip_backend()[1](file_path, "rb")
+
+
+def fastq_to_fasta(input_file, fasta_file):
+    """Write the reads of a plain or gzipped FASTQ file as FASTA, replacing fasta_file once complete."""
+    tmp_file = f"{fasta_file}.tmp"
+    with open_input(input_file) as fastq_in, open(tmp_file, "wb") as fasta_out:
+        for header in fastq_in:
+            sequence = next(fastq_in)
+            next(fastq_in)  # "+" line
+            next(fastq_in)  # qualities
+            fasta_out.write(b">" + header[1:] + sequence)
+    os.replace(tmp_file, fasta_file)
+
+
+def compressor_command(threads=4, level=None, config_file="config/config.yaml"):
+    """Command that gzips stdin to stdout, for compressing the output of a tool pipe."""
+    level = settings(config_file)["level"] if level is None else level
+    if shutil.which("pigz"):
+        return ["pigz", f"-{level}", "-p", str(threads), "-c"]
+    return ["gzip", f"-{level}", "-c"]
@@ -1,31 +1,14 @@
 import pathlib
 import csv
 import logging
-import pandas as pd
 import os
 from concurrent.futures import ThreadPoolExecutor
 
+from sample_sheet import get_ids
+
 # Set up logger
 logger = logging.getLogger(__name__)
 
-## FUNCTIONS TO READ IDS
-def xlsx2csv(file_path):
-    if not pathlib.Path(file_path).is_file():
-        logger.error(f"Error: The file '{file_path}' does not exist.")
-        return None
-
-    xlsx_read = pd.read_excel(file_path)
-    csv_name = pathlib.Path(file_path).stem
-    dirname = os.path.dirname(file_path)
-    csv_file_path = f"{dirname}/{csv_name}.csv"
-    xlsx_read.to_csv(csv_file_path, index=None, header=True)
-    logger.info(f"Successfully converted '{file_path}' to '{csv_file_path}'")
-    return csv_file_path
-
-def get_ids(file_path, column_name, delimiter):
-    df = pd.read_csv(file_path, delimiter=delimiter)
-    return df[column_name].tolist()
-
 ### FUNCTION TO FIND FILES FOR EACH DIRECTION	
 def find_files(input_dirs, ids, direction):
     # Generate the output CSV filename based on direction
@@ -105,11 +88,7 @@ def concatenate_files_per_id(output_dir, direction):
                             logger.error(f"Failed to append {file_path} for ID {id}: {e}")
 
 def main(file_path, input_dirs, output_dir, max_workers=8):
-    if pathlib.Path(file_path).suffix == ".xlsx":
-        file_path = xlsx2csv(file_path)
-        if not file_path:
-            return
-    
+    # .xlsx and .csv sheets are both read (and cached) by sample_sheet
     ids = get_ids(file_path, column_name, delimiter=",")
     
     if not ids:
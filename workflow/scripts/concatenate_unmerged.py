@@ -1,26 +1,14 @@
-import os
-import sys
 import re
+import shutil
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-# Ensure the logs directory exists
-log_dir = Path("./logs")
-log_dir.mkdir(parents=True, exist_ok=True)
+from compression import fq_suffix
+from pipeline_config import setup_logging
+from work_queue import get_work_queue
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-if not logger.hasHandlers():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
-
-    file_handler = logging.FileHandler(log_dir / "check_and_cat_assembly.log")
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(file_handler)
+logger = logging.getLogger(__name__)
 
 def get_ids(seq_dir):
     dir_path = Path(seq_dir)
@@ -29,8 +17,8 @@ def get_ids(seq_dir):
         return set()
 
     logger.info(f"Scanning directory: {dir_path}")
-    ids = {match.group(1) for file in dir_path.glob("*_processed.fq") 
-           if (match := re.match(r'(.+?)_processed\.fq$', file.name))}
+    ids = {match.group(1) for file in dir_path.glob("*_processed.fq*")
+           if (match := re.match(r'(.+?)_processed\.fq(\.gz)?$', file.name))}
 
     if not ids:
         logger.warning("No IDs found.")
@@ -39,35 +27,44 @@ def get_ids(seq_dir):
 
     return ids
 
-def concatenate_files(id, fastp_dir):
-    processed_file = Path(fastp_dir) / f"{id}_processed.fq"
-    unmerged_file1 = Path(fastp_dir) / f"{id}_unmerged_1.fq"
-    unmerged_file2 = Path(fastp_dir) / f"{id}_unmerged_2.fq"
-    output_file_path = Path(fastp_dir) / f"{id}_all_processed_reads.fq"
+def concatenate_files(id, fastp_dir, config_file="config/config.yaml"):
+    suffix = fq_suffix(config_file)
+    processed_file = Path(fastp_dir) / f"{id}_processed{suffix}"
+    unmerged_file1 = Path(fastp_dir) / f"{id}_unmerged_1{suffix}"
+    unmerged_file2 = Path(fastp_dir) / f"{id}_unmerged_2{suffix}"
+    output_file_path = Path(fastp_dir) / f"{id}_all_processed_reads{suffix}"
+
+    inputs = [processed_file, unmerged_file1, unmerged_file2]
+    if not any(input_file.exists() for input_file in inputs):
+        logger.error(f"No fastp output found for {id} in {fastp_dir}.")
+        raise FileNotFoundError(f"No fastp output for {id} in {fastp_dir}")
 
     try:
-        with output_file_path.open('w') as output_file:
-            for input_file in [processed_file, unmerged_file1, unmerged_file2]:
+        # Byte-level copy: concatenated gzip members are themselves a valid gzip file,
+        # so compressed intermediates are joined without recompressing
+        with output_file_path.open('wb') as output_file:
+            for input_file in inputs:
                 if input_file.exists():
                     logger.info(f"Including {input_file} in {output_file_path.name}")
-                    with input_file.open('r') as f:
-                        for line in f:
-                            output_file.write(line)
+                    with input_file.open('rb') as f:
+                        shutil.copyfileobj(f, output_file, 1 << 20)
                 else:
                     logger.warning(f"File {input_file} not found. Skipping.")
         logger.info(f"Successfully concatenated files for {id}.")
     except Exception as e:
         logger.error(f"Error concatenating files for {id}: {e}", exc_info=True)
+        raise
 
-def main(seq_dir, max_workers=4):
+def main(seq_dir, max_workers=4, config_file="config/config.yaml"):
     fastp_dir = Path(seq_dir)
     ids = get_ids(seq_dir)
     if not ids:
         logger.error("No IDs found. Exiting.")
         return
 
+    queue = get_work_queue("concatenate", config_file)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(concatenate_files, id, fastp_dir): id for id in ids}
+        futures = {executor.submit(queue.run, id, concatenate_files, id, fastp_dir, config_file): id for id in ids}
 
         for future in as_completed(futures):
             id = futures[future]
@@ -77,5 +74,7 @@ def main(seq_dir, max_workers=4):
                 logger.error(f"Failed to process sample {id}: {e}. Continuing with next sample.")
 
 if __name__ == "__main__":
+    setup_logging("check_and_cat_assembly.log", level=logging.DEBUG)
+
     seq_dir = './fastp_processed'
     main(seq_dir, max_workers=4)
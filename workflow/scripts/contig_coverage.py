@@ -0,0 +1,115 @@
+"""Per-contig coverage accumulated from a SAM alignment stream.
+
+Alignments are read as they stream out of the aligner, so coverage costs no
+extra sort or `samtools depth` pass. Contigs are numbered from the @SQ header
+lines and every count is kept in NumPy arrays indexed by contig number. Mean
+depth is the reference bases covered by alignments over the contig length.
+Breadth needs per-base depth, which is kept as one int32 difference array over
+the concatenated contigs (+1 where an alignment starts, -1 where it ends), so
+each alignment is two array updates; at the end it is summed up one range of
+contigs at a time, so only DEPTH_CHUNK bases of depth exist at once.
+
+Only primary alignments are counted (no unmapped, secondary or supplementary records).
+"""
+import re
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EVERY = 1 << 20  # alignments buffered before they are added to the arrays
+DEPTH_CHUNK = 1 << 24  # bases of per-base depth computed at once for breadth
+COLUMNS = ["contig", "length", "reads", "mean_depth", "breadth", "abundance"]
+
+# CIGAR operations that consume the reference
+_REF_CIGAR = re.compile(rb"(\d+)[MDN=X]")
+
+
+class ContigCoverage:
+    """Accumulates mapped reads, depth and breadth per contig from SAM lines."""
+
+    def __init__(self):
+        self.names, self.lengths = [], []
+        self.ids = {}
+        self.contigs, self.starts, self.ends = [], [], []
+        self.diff = self.offsets = self.reads = self.bases = None
+
+    def consume(self, line):
+        """Add one SAM line (bytes): an @SQ header or an alignment."""
+        if line.startswith(b"@"):
+            if line.startswith(b"@SQ"):
+                tags = dict(field.split(b":", 1) for field in line.rstrip().split(b"\t")[1:])
+                self.ids[tags[b"SN"]] = len(self.names)
+                self.names.append(tags[b"SN"].decode())
+                self.lengths.append(int(tags[b"LN"]))
+            return
+        fields = line.split(b"\t", 6)
+        if int(fields[1]) & 0x904:
+            return
+        start = int(fields[3]) - 1
+        self.contigs.append(self.ids[fields[2]])
+        self.starts.append(start)
+        self.ends.append(start + sum(int(length) for length in _REF_CIGAR.findall(fields[5])))
+        if len(self.contigs) >= FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        if self.diff is None:
+            self.offsets = np.concatenate(([0], np.cumsum(self.lengths, dtype=np.int64)))
+            self.diff = np.zeros(self.offsets[-1] + 1, dtype=np.int32)
+            self.reads = np.zeros(len(self.names), dtype=np.int64)
+            self.bases = np.zeros(len(self.names))
+        if not self.contigs:
+            return
+        contigs = np.array(self.contigs, dtype=np.int64)
+        base = self.offsets[contigs]
+        starts = np.array(self.starts, dtype=np.int64)
+        ends = np.minimum(np.array(self.ends, dtype=np.int64), self.offsets[contigs + 1] - base)
+        np.add.at(self.diff, base + starts, 1)
+        np.add.at(self.diff, base + ends, -1)
+        self.reads += np.bincount(contigs, minlength=len(self.names))
+        self.bases += np.bincount(contigs, weights=ends - starts, minlength=len(self.names))
+        self.contigs, self.starts, self.ends = [], [], []
+
+    def _covered_bases(self):
+        """Bases with depth > 0 per contig, from the depth of one range of whole contigs at a time."""
+        starts = self.offsets[:-1]
+        # Contigs starting in the same DEPTH_CHUNK window are summed together
+        firsts = np.concatenate(([0], np.flatnonzero(np.diff(starts // DEPTH_CHUNK)) + 1))
+        lasts = np.append(firsts[1:], len(starts))
+        covered = np.empty(len(starts), dtype=np.int64)
+        carry = 0  # depth at the end of the previous range
+        for first, last in zip(firsts, lasts):
+            low, high = self.offsets[first], self.offsets[last]
+            depth = np.cumsum(self.diff[low:high], dtype=np.int32)
+            depth += carry
+            carry = int(depth[-1])
+            covered[first:last] = np.add.reduceat(depth > 0, starts[first:last] - low, dtype=np.int64)
+        return covered
+
+    def table(self):
+        """Columns of the coverage table, one entry per contig."""
+        self._flush()
+        lengths = np.array(self.lengths, dtype=np.int64)
+        if not len(lengths):
+            return {column: np.empty(0) for column in COLUMNS}
+        mapped = self.reads.sum()
+        return {
+            "contig": np.array(self.names),
+            "length": lengths,
+            "reads": self.reads,
+            "mean_depth": self.bases / lengths,
+            "breadth": self._covered_bases() / lengths,
+            "abundance": self.reads / mapped if mapped else np.zeros(len(lengths)),
+        }
+
+
+def write_coverage(columns, npz_file, tsv_file):
+    """Write the table as column arrays (.npz, for loading with NumPy) and as TSV."""
+    np.savez_compressed(npz_file, **columns)
+    with open(tsv_file, "w") as out:
+        out.write("\t".join(COLUMNS) + "\n")
+        for row in zip(*(columns[column] for column in COLUMNS)):
+            contig, length, reads, depth, breadth, abundance = row
+            out.write(f"{contig}\t{length}\t{reads}\t{depth:.3f}\t{breadth:.4f}\t{abundance:.6g}\n")
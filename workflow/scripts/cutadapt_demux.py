@@ -6,10 +6,11 @@ import shutil
 import logging
 from concurrent.futures import ThreadPoolExecutor
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from compression import compress_intermediates
+from fastq_stats import write_stats
+from pipeline_config import setup_logging, tool_path
 
-def find_and_unzip_files(input_directory):
+def find_and_unzip_files(input_directory, config_file="config/config.yaml"):
     """Find and unzip .fq.gz files in the specified directory."""
     logging.info("Finding and unzipping input files...")
     input_files = []
@@ -24,6 +25,11 @@ def find_and_unzip_files(input_directory):
             logging.warning(f"Skipping unexpected file: {file}")
             continue
 
+        # cutadapt reads gzipped input directly, so only unzip when intermediates are uncompressed
+        if compress_intermediates(config_file):
+            input_files.append(file)
+            continue
+
         unzipped_file = file[:-3]  # Remove .gz extension
         with gzip.open(file, 'rb') as f_in:
             with open(unzipped_file, 'wb') as f_out:
@@ -63,11 +69,11 @@ def pair_input_files(input_files):
     logging.info(f"Paired files: {paired_files}")
     return paired_files
 
-def run_cutadapt(input_files, output_name, cutadapt_error_rate, i7_barcodes, i5_barcodes):
+def run_cutadapt(input_files, output_name, cutadapt_error_rate, i7_barcodes, i5_barcodes, config_file="config/config.yaml"):
     """Run the cutadapt command."""
     logging.info(f"Running cutadapt for pair: {input_files}...")
     cutadapt_command = [
-        "cutadapt",
+        tool_path("cutadapt", config_file),
         "-e", str(cutadapt_error_rate),
         "--no-indels",
         "-g", f"^file:{i5_barcodes}",
@@ -82,24 +88,22 @@ def run_cutadapt(input_files, output_name, cutadapt_error_rate, i7_barcodes, i5_
     subprocess.run(cutadapt_command, check=True)
     logging.info(f"Cutadapt completed successfully for pair: {input_files}.")
 
-def generate_seqkit_stats(stats_output):
-    """Generate statistics with seqkit."""
-    logging.info("Generating statistics with seqkit...")
-    fastq_files = glob.glob("*.fastq")
+def generate_read_stats(stats_output, config_file="config/config.yaml"):
+    """Generate read statistics of the demultiplexed files (fastq_stats.py, in parallel)."""
+    logging.info("Generating read statistics...")
+    fastq_files = sorted(glob.glob("*.fastq"))
     if not fastq_files:
         logging.error("No .fastq files found for statistics generation.")
         raise ValueError("No .fastq files found for statistics generation.")
-    seqkit_command = ["seqkit", "stats", *fastq_files]
-    with open(stats_output, "w") as stats_file:
-        subprocess.run(seqkit_command, stdout=stats_file, check=True)
+    write_stats(fastq_files, stats_output, config_file)
     logging.info(f"Statistics written to {stats_output}.")
 
-def main(cutadapt_error_rate, i7_barcodes, i5_barcodes, input_directory):
+def main(cutadapt_error_rate, i7_barcodes, i5_barcodes, input_directory, config_file="config/config.yaml"):
     """Main workflow."""
     stats_output = "undetermined_cutadapt.stats"
 
     # Unzip and sort input files
-    input_files = find_and_unzip_files(input_directory)
+    input_files = find_and_unzip_files(input_directory, config_file)
 
     # Pair files
     paired_files = pair_input_files(input_files)
@@ -111,16 +115,19 @@ def main(cutadapt_error_rate, i7_barcodes, i5_barcodes, input_directory):
         for pair in paired_files:
             prefix = os.path.basename(pair[0]).rsplit('_', 1)[0]
             output_name = f"{prefix}_cutadapt"
-            futures.append(executor.submit(run_cutadapt, pair, output_name, cutadapt_error_rate, i7_barcodes, i5_barcodes))
+            futures.append(executor.submit(run_cutadapt, pair, output_name, cutadapt_error_rate, i7_barcodes, i5_barcodes,
+                                           config_file))
 
         # Wait for all tasks to complete
         for future in futures:
             future.result()
 
     # Generate statistics
-    generate_seqkit_stats(stats_output)
+    generate_read_stats(stats_output, config_file)
 
 if __name__ == "__main__":
+    setup_logging("cutadapt_demux.log")
+
     # Configuration variables
     cutadapt_error_rate = 1
     i7_barcodes = "i7_barcodes.fasta"
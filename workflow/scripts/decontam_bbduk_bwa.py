@@ -1,29 +1,33 @@
 import os
-import sys
+import shutil
 import subprocess
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import re
 import pathlib
 
-# Ensure the logs directory exists
-log_dir = "./logs"
-os.makedirs(log_dir, exist_ok=True)
-
-# Set up logging to both stdout and a file
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-if not logger.hasHandlers():
-    stream_handler = logging.StreamHandler(sys.stdout)
-    file_handler = logging.FileHandler(os.path.join(log_dir, "decontam_processed.log"))
-
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    stream_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+from compression import compress_intermediates, compressor_command, fq_suffix, settings as compression_settings
+from pipeline_config import get_section, log_dir, reference_path, setup_logging, tool_path
+from reference_registry import prepare_bwa_index
+from scratch import get_scratch_manager, stage_out
+from work_queue import get_work_queue
+
+logger = logging.getLogger(__name__)
+
+PHIX_REF = "../ref/GCA_000819615.1_ViralProj14015_genomic.fna"
+HUMAN_REF = "../ref/GCF_000001405.40_GRCh38.p14_genomic.fna"
+
+# Defaults for the `human_prefilter` section of config/config.yaml. They live here rather than in
+# human_prefilter.py, which needs numpy and is only imported when the prefilter is enabled
+PREFILTER_DEFAULTS = {
+    "enabled": True,
+    "k": 31,
+    "window": 15,           # k-mers per minimizer window
+    "bits_per_minimizer": 12,
+    "min_hits": 1,          # minimizer hits that send a read to bwa
+    "batch_reads": 100000,
+    "workers": 8,           # processes building the filter
+}
 
 def run_subprocess(command, id, log_prefix):
     result = subprocess.run(command, capture_output=True, text=True)
@@ -35,18 +39,38 @@ def run_subprocess(command, id, log_prefix):
         logger.error(f"Error running {log_prefix} for {id}. See log for details.")
         raise subprocess.CalledProcessError(result.returncode, command)
 
-def run_bbduk(id, file_path, output_dir, temp_dir):
-    output_file = os.path.join(temp_dir, f"{id}_nophiX.fq")
+def bbduk_command(id, in_file, out_file, output_dir, config_file="config/config.yaml"):
     command = [
-        "../bbmap/bbduk.sh",
-        f"in={file_path}",
-        f"out={output_file}",
-        "ref=../ref/GCA_000819615.1_ViralProj14015_genomic.fna",
+        tool_path("bbduk", config_file),
+        f"in={in_file}",
+        f"out={out_file}",
+        f"ref={reference_path('phix', PHIX_REF, config_file)}",
         "k=31",
         "hdist=1",
         "-Xmx2g",
         f"stats={output_dir}/{id}_nophiX_stats.txt"
     ]
+    if str(out_file).endswith(".gz"):
+        command.append(f"zl={compression_settings(config_file)['level']}")
+    return command
+
+def decontaminated_fastq(id, output_dir, config_file="config/config.yaml"):
+    suffix = ".fastq.gz" if compress_intermediates(config_file) else ".fastq"
+    return f"{output_dir}/{id}_decontaminated_reads{suffix}"
+
+def write_fastq_output(command, output_path, stdin=None, config_file="config/config.yaml"):
+    """Start a tool writing FASTQ to stdout, gzipping it through a fast compressor when output_path ends in .gz."""
+    output = open(output_path, "wb")
+    if not output_path.endswith(".gz"):
+        return [subprocess.Popen(command, stdin=stdin, stdout=output)], output
+    tool = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE)
+    compressor = subprocess.Popen(compressor_command(config_file=config_file), stdin=tool.stdout, stdout=output)
+    tool.stdout.close()
+    return [tool, compressor], output
+
+def run_bbduk(id, file_path, output_dir, temp_dir, config_file="config/config.yaml"):
+    output_file = os.path.join(temp_dir, f"{id}_nophiX{fq_suffix(config_file)}")
+    command = bbduk_command(id, file_path, output_file, output_dir, config_file)
     run_subprocess(command, id, "bbduk")
     logger.info(f"Processed {id} for PhiX contamination")
     return output_file  # Return the processed file path
@@ -59,7 +83,7 @@ def get_ids(seq_dir):
 
     logger.info(f"Scanning directory: {dir_path}")
     # Adjust regex to capture full identifier (e.g., KEWP2_C10)
-    ids = {match.group(1) for file in dir_path.glob("*all_processed_reads.f*q")
+    ids = {match.group(1) for file in dir_path.glob("*all_processed_reads.f*q*")
            if (match := re.match(r'(.+?)_all_processed_reads', file.stem))}
 
     logger.info(f"Found IDs: {', '.join(ids)}")
@@ -73,7 +97,7 @@ def find_files(seq_dir, ids):
 
     # Adjusted to capture full identifier (e.g., KEWP2_C10)
     results = {id: str(files[0]) for id in ids
-               if (files := sorted(dir_path.glob(f"*{id}_all_processed_reads.f*q")))}
+               if (files := sorted(dir_path.glob(f"*{id}_all_processed_reads.f*q*")))}
 
     missing_ids = ids - results.keys()
     if missing_ids:
@@ -81,54 +105,106 @@ def find_files(seq_dir, ids):
 
     return results
 
-def run_bwa_mem_and_samtools(id, input_file, output_dir, temp_dir):
-    genome_fasta = "../ref/GCF_000001405.40_GRCh38.p14_genomic.fna"
+def run_prefilter(id, file_path, output_dir, temp_dir, config_file="config/config.yaml"):
+    """Split reads into those that may be human (for bwa) and those cleared by the human k-mer prefilter."""
+    import human_prefilter
+
+    candidates_file = os.path.join(temp_dir, f"{id}_human_candidates{fq_suffix(config_file)}")
+    cleared_file = os.path.join(temp_dir, f"{id}_prefilter_cleared{fq_suffix(config_file)}")
+    counts = human_prefilter.split_reads(file_path, candidates_file, cleared_file,
+                                         reference_path("human", HUMAN_REF, config_file), config_file)
+    with open(f"{output_dir}/{id}_human_prefilter.tsv", "w") as out:
+        out.write("reads\tto_bwa\tcleared\n")
+        out.write(f"{counts['reads']}\t{counts['to_bwa']}\t{counts['cleared']}\n")
+    logger.info(f"Human prefilter for {id}: {counts['to_bwa']} of {counts['reads']} reads sent to bwa")
+    return candidates_file, cleared_file
+
+def run_bwa_mem_and_samtools(id, input_file, output_dir, temp_dir, cleared_file=None, config_file="config/config.yaml"):
+    genome_fasta = reference_path("human", HUMAN_REF, config_file)
+    prepare_bwa_index(genome_fasta, config_file)  # shared-memory index, if enabled
+    bwa = tool_path("bwa", config_file)
+    samtools = tool_path("samtools", config_file)
     # Use the full identifier in BAM file names
     bam_file = f"{temp_dir}/{id}_output.bam"
     sorted_bam_file = f"{temp_dir}/{id}_output_sorted.bam"
-    unmapped_fastq = f"{output_dir}/{id}_decontaminated_reads.fastq"
-    stats_file = f"{output_dir}/{id}_human_mapping_flagtats.txt"
+    # Outputs are written in temp_dir and only moved to output_dir once complete
+    unmapped_fastq = decontaminated_fastq(id, temp_dir, config_file)
+    stats_file = f"{temp_dir}/{id}_human_mapping_flagtats.txt"
 
     try:
         # Run BWA MEM to align the reads and pipe directly to samtools view
         logger.info(f"Running BWA MEM and SAMtools for {id}")
-        bwa_cmd = ["bwa", "mem", "-M", "-t", "8", genome_fasta, input_file]
-        samtools_view_cmd = ["samtools", "view", "-b", "-o", bam_file]
+        bwa_cmd = [bwa, "mem", "-M", "-t", "8", genome_fasta, input_file]
+        samtools_view_cmd = [samtools, "view", "-b", "-o", bam_file]
         with open(bam_file, "w") as bam_out:
             p1 = subprocess.Popen(bwa_cmd, stdout=subprocess.PIPE)
             p2 = subprocess.Popen(samtools_view_cmd, stdin=p1.stdout, stdout=bam_out)
             p1.stdout.close()
             p2.communicate()
+        if p1.wait() != 0 or p2.returncode != 0:
+            raise subprocess.CalledProcessError(p1.returncode or p2.returncode, "bwa mem | samtools view")
 
         # Sort BAM file
         logger.info(f"Sorting BAM file for {id}")
-        subprocess.run(["samtools", "sort", "-o", sorted_bam_file, bam_file], check=True)
+        subprocess.run([samtools, "sort", "-o", sorted_bam_file, bam_file], check=True)
 
         # Extract unmapped reads and output as FASTQ
         logger.info(f"Extracting unmapped reads for {id}")
-        with open(unmapped_fastq, "w") as fastq_out:
-            p1 = subprocess.Popen(["samtools", "view", "-f4", sorted_bam_file], stdout=subprocess.PIPE)
-            p2 = subprocess.Popen(["samtools", "fastq"], stdin=p1.stdout, stdout=fastq_out)
-            p1.stdout.close()
-            p2.communicate()
+        p1 = subprocess.Popen([samtools, "view", "-f4", sorted_bam_file], stdout=subprocess.PIPE)
+        processes, fastq_out = write_fastq_output([samtools, "fastq"], unmapped_fastq, stdin=p1.stdout,
+                                                         config_file=config_file)
+        p1.stdout.close()
+        with fastq_out:
+            for process in processes:
+                if process.wait() != 0:
+                    raise subprocess.CalledProcessError(process.returncode, process.args)
+        if p1.wait() != 0:
+            raise subprocess.CalledProcessError(p1.returncode, "samtools view -f4")
+
+        # Reads the prefilter cleared without alignment are decontaminated reads too
+        if cleared_file:
+            with open(unmapped_fastq, "ab") as out, open(cleared_file, "rb") as cleared:
+                shutil.copyfileobj(cleared, out)
 
         # Generate statistics
         logger.info(f"Generating statistics for {id}")
-        subprocess.run(["samtools", "flagstat", sorted_bam_file], stdout=open(stats_file, "w"), check=True)
+        subprocess.run([samtools, "flagstat", sorted_bam_file], stdout=open(stats_file, "w"), check=True)
+
+        for file in [unmapped_fastq, stats_file]:
+            stage_out(file, os.path.join(output_dir, os.path.basename(file)))
 
         logger.info(f"Successfully processed {id} for genome alignment and stats generation")
 
     except subprocess.CalledProcessError as e:
         logger.error(f"Error during processing of {id}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Unexpected error during processing of {id}: {e}")
+        raise
+
+def decontaminate_sample(id, file_path, output_dir, temp_dir, config_file="config/config.yaml"):
+    """Run BBDuk, the human prefilter and the human alignment for one sample in a node-local scratch directory.
+
+    temp_dir on the project filesystem is only used if no scratch space is available.
+    """
+    scratch = get_scratch_manager(config_file)
+    with scratch.reserve(id, scratch.estimate(file_path), temp_dir) as work_dir:
+        nophix_file = run_bbduk(id, file_path, output_dir, work_dir, config_file)
+        cleared_file = None
+        if get_section("human_prefilter", PREFILTER_DEFAULTS, config_file)["enabled"]:
+            try:
+                nophix_file, cleared_file = run_prefilter(id, nophix_file, output_dir, work_dir, config_file)
+            except (ImportError, OSError, ValueError) as e:
+                # The prefilter only saves bwa time, so align every read rather than fail the sample
+                logger.warning(f"Human prefilter failed for {id}: {e}. Aligning all reads with bwa")
+        run_bwa_mem_and_samtools(id, nophix_file, output_dir, work_dir, cleared_file, config_file)
 
-def main(seq_dir, output_dir, max_workers=None):
+def main(seq_dir, output_dir, max_workers=None, config_file="config/config.yaml"):
     # Dynamically set number of workers to CPU count if not provided
     max_workers = max_workers or os.cpu_count()
 
+    # Fallback for when there is no node-local scratch (see `scratch` in config.yaml)
     temp_dir = os.path.join(output_dir, "temp_dir")
-    os.makedirs(temp_dir, exist_ok=True)
 
     ids = get_ids(seq_dir)
     if not ids:
@@ -140,18 +216,23 @@ def main(seq_dir, output_dir, max_workers=None):
         logger.error("No files found. Exiting.")
         return
 
+    os.makedirs(output_dir, exist_ok=True)
+
+    queue = get_work_queue("decontam", config_file)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(run_bbduk, id, file_path, output_dir, temp_dir) for id, file_path in files.items()]
+        futures = {executor.submit(queue.run, id, decontaminate_sample, id, file_path, output_dir, temp_dir,
+                                   config_file): id
+                   for id, file_path in files.items()}
 
         for future in as_completed(futures):
             try:
-                result = future.result()
-                id = result.split("/")[-1].split("_nophiX")[0]  # Extract full ID from result
-                executor.submit(run_bwa_mem_and_samtools, id, result, output_dir, temp_dir)
+                future.result()
             except Exception as e:
-                logger.error(f"Error processing a file: {e}")
+                logger.error(f"Error processing {futures[future]}: {e}")
 
 if __name__ == "__main__":
+    setup_logging("decontam_processed.log")
+
     seq_dir = './fastp_processed/'
     output_dir = './decontaminated_reads'
 
@@ -0,0 +1,368 @@
+"""Concurrent, resumable downloads with a content-addressed cache and local mirrors.
+
+download() fetches one URL into a destination file:
+  1. if the URL (or expected MD5) is already in the cache, the cached copy is
+     hard-linked or copied into place;
+  2. otherwise mirrors (local directories, or file:// / http:// base URLs) are
+     tried before the original URL, matching on the file name;
+  3. remote files are streamed to <dest>.part, resuming with an HTTP Range
+     request after a dropped connection, and retried with exponential backoff.
+The MD5 is computed as the bytes are written, stored in the cache under that
+hash, and recorded in the destination directory's checksum manifest.
+
+download_all() runs many downloads through a bounded thread pool; one failed
+file does not stop the others.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+
+from checksums import Manifest, copy_and_hash, md5_file
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `downloads` section of config/config.yaml
+DOWNLOAD_DEFAULTS = {
+    "max_workers": 4,
+    "retries": 5,
+    "backoff": 2.0,      # seconds before the first retry, doubling each time
+    "timeout": 60,       # seconds without data before a connection is retried
+    # Empty to disable caching (e.g. for raw-read archives that are only downloaded once)
+    "cache_dir": os.environ.get("LICHENS_DOWNLOAD_CACHE", str(Path.home() / ".cache" / "lichens_downloads")),
+    "mirrors": [],       # local directories or base URLs checked before the original URL
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# Manifests are shared by downloads into the same directory
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def file_name(url):
+    return unquote(Path(urlparse(url).path).name)
+
+
+class DownloadCache:
+    """Downloaded files stored by MD5, with an index from URL to MD5."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.objects = self.cache_dir / "objects"
+        self.urls = self.cache_dir / "urls"
+
+    def _object_path(self, md5):
+        return self.objects / md5[:2] / md5
+
+    def _url_path(self, url):
+        return self.urls / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def lookup(self, url, expected_md5=None):
+        """Return (path, md5) of a cached copy of the URL, or (None, None)."""
+        md5 = expected_md5
+        if md5 is None and self._url_path(url).is_file():
+            md5 = json.loads(self._url_path(url).read_text())["md5"]
+        if md5 and self._object_path(md5).is_file():
+            return self._object_path(md5), md5
+        return None, None
+
+    def store(self, url, file_path, md5):
+        """Add a downloaded file to the cache (hard link when on the same filesystem)."""
+        object_path = self._object_path(md5)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        self.urls.mkdir(parents=True, exist_ok=True)
+        if not object_path.exists():
+            tmp_path = object_path.with_name(f"{md5}.{os.getpid()}.{threading.get_ident()}.tmp")
+            _link_or_copy(file_path, tmp_path)
+            # Read-only, since hard-linked copies share the cached object's data
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, object_path)
+        url_path = self._url_path(url)
+        tmp_path = url_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps({"url": url, "md5": md5, "size": os.path.getsize(file_path)}))
+        os.replace(tmp_path, url_path)
+
+
+def _link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def _local_source(location):
+    """Path for a local directory entry or file:// URL, else None."""
+    if location.startswith("file://"):
+        return Path(unquote(urlparse(location).path))
+    if "://" not in location:
+        return Path(location)
+    return None
+
+
+def _candidates(url, mirrors):
+    name = file_name(url)
+    for mirror in mirrors:
+        yield mirror.rstrip("/") + "/" + name
+    yield url
+
+
+class ResumableStream:
+    """Read-only stream over a remote URL that reconnects from the current byte offset.
+
+    A dropped or truncated connection is reopened with an HTTP Range request and
+    reading continues where it stopped, retried with exponential backoff.
+    """
+
+    def __init__(self, url, settings):
+        self.url = url
+        self.settings = settings
+        self.offset = 0
+        self.size = None
+        self.response = self._open()
+
+    def _open(self):
+        request = urllib.request.Request(self.url)
+        if self.offset:
+            request.add_header("Range", f"bytes={self.offset}-")
+        response = urllib.request.urlopen(request, timeout=self.settings["timeout"])
+        length = response.headers.get("Content-Length")
+        if length is not None:
+            self.size = int(length) + self.offset
+        return response
+
+    def read(self, size=-1):
+        delay = self.settings["backoff"]
+        for attempt in range(1, self.settings["retries"] + 1):
+            try:
+                data = self.response.read(size)
+                if data or size == 0 or self.size is None or self.offset >= self.size:
+                    self.offset += len(data)
+                    return data
+                error = IOError(f"connection closed at byte {self.offset} of {self.size}")
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                error = e
+            if attempt == self.settings["retries"]:
+                raise error
+            logger.warning(f"Reading {self.url} failed at byte {self.offset} (attempt {attempt}): {error}. "
+                           f"Resuming in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+            self.response.close()
+            try:
+                self.response = self._open()
+            except urllib.error.HTTPError as e:
+                if e.code < 500 and e.code not in (408, 429):
+                    raise
+                continue  # the closed response reads empty, so the next attempt reconnects again
+            except (urllib.error.URLError, http.client.HTTPException, OSError):
+                continue
+            if getattr(self.response, "status", None) != 206:
+                # The caller has to start again from the beginning
+                self.response.close()
+                raise IOError(f"{self.url} does not support resuming at byte {self.offset}")
+        raise error
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_url(url, settings=None):
+    """Open a binary stream for url from the download cache, a mirror or the URL itself.
+
+    For readers that consume the data as it arrives, such as archive extraction.
+    Remote streams resume from the current offset after a dropped connection.
+    """
+    settings = settings or get_section("downloads", DOWNLOAD_DEFAULTS)
+    cached = DownloadCache(settings["cache_dir"]).lookup(url)[0] if settings["cache_dir"] else None
+    if cached is not None:
+        logger.info(f"Using cached copy of {url}")
+        return open(cached, "rb")
+    error = None
+    for source in _candidates(url, settings["mirrors"] or []):
+        local = _local_source(source)
+        if local is not None:
+            if local.is_file():
+                return open(local, "rb")
+            continue
+        if urlparse(source).scheme not in ("http", "https"):
+            return urllib.request.urlopen(source, timeout=settings["timeout"])
+        try:
+            return ResumableStream(source, settings)
+        except urllib.error.HTTPError as e:
+            if e.code >= 500 or e.code in (408, 429):
+                raise
+            error = e
+    raise FileNotFoundError(f"{url} not found ({error})" if error else f"{url} not found in any mirror")
+
+
+def _fetch(url, part_path, timeout):
+    """Stream a URL into part_path, resuming from its current size where the server allows.
+
+    Returns the MD5 of the complete file, hashed as it is written.
+    """
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    request = urllib.request.Request(url)
+    if offset and urlparse(url).scheme in ("http", "https"):
+        request.add_header("Range", f"bytes={offset}-")
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range starts at or past the end: the .part is complete if its size matches the file's
+        # (its MD5 is then checked by download()), otherwise it is stale and fetched again
+        content_range = e.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        if total.isdigit() and int(total) == offset:
+            logger.info(f"{part_path.name} is already complete")
+            return md5_file(part_path)
+        logger.warning(f"Discarding {part_path.name} ({offset} bytes; server reports {content_range or 'no size'})")
+        part_path.unlink()
+        return _fetch(url, part_path, timeout)
+    with response:
+        if offset and getattr(response, "status", None) != 206:
+            # Server ignored the range (or this is FTP): start again from the beginning
+            offset = 0
+        length = response.headers.get("Content-Length")
+        expected = int(length) + offset if length is not None else None
+
+        md5 = hashlib.md5()
+        if offset:
+            with open(part_path, "rb") as part:
+                while (block := part.read(CHUNK_SIZE)):
+                    md5.update(block)
+        with open(part_path, "ab" if offset else "wb") as out:
+            while (block := response.read(CHUNK_SIZE)):
+                md5.update(block)
+                out.write(block)
+
+    size = part_path.stat().st_size
+    if expected is not None and size != expected:
+        raise IOError(f"incomplete download ({size} of {expected} bytes)")
+    return md5.hexdigest()
+
+
+def _fetch_with_retries(url, part_path, settings):
+    delay = settings["backoff"]
+    for attempt in range(1, settings["retries"] + 1):
+        try:
+            return _fetch(url, part_path, settings["timeout"])
+        except urllib.error.HTTPError as e:
+            # Client errors such as 404 will not fix themselves
+            if e.code < 500 and e.code not in (408, 429):
+                raise
+            error = e
+        except (urllib.error.URLError, OSError) as e:
+            error = e
+        if attempt < settings["retries"]:
+            logger.warning(f"Download of {url} failed (attempt {attempt}): {error}. Retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+    raise error
+
+
+def _fetch_from(source, part_path, settings):
+    """Fetch from one mirror or the original URL; returns the MD5, or None if a local mirror lacks the file."""
+    local = _local_source(source)
+    if local is None:
+        return _fetch_with_retries(source, part_path, settings)
+    if not local.is_file():
+        return None
+    logger.info(f"Copying {local}")
+    with open(local, "rb") as f:
+        return copy_and_hash(f, part_path)
+
+
+def _manifest(directory):
+    with _manifests_lock:
+        key = str(Path(directory).resolve())
+        if key not in _manifests:
+            _manifests[key] = Manifest(directory)
+        return _manifests[key]
+
+
+def download(url, dest, expected_md5=None, settings=None):
+    """Download url to dest (a file path, or a directory to keep the URL's file name). Returns the path."""
+    settings = settings or get_section("downloads", DOWNLOAD_DEFAULTS)
+    dest = Path(dest)
+    if dest.is_dir():
+        dest = dest / file_name(url)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    cache = DownloadCache(settings["cache_dir"]) if settings["cache_dir"] else None
+    manifest = _manifest(dest.parent)
+
+    cached, md5 = cache.lookup(url, expected_md5) if cache else (None, None)
+    if cached is not None:
+        logger.info(f"Using cached copy of {url}")
+        if dest.exists():
+            dest.unlink()
+        _link_or_copy(cached, dest)
+        manifest.record(dest, md5)
+        return dest
+
+    part_path = dest.with_name(dest.name + ".part")
+    errors = []
+    for source in _candidates(url, settings["mirrors"] or []):
+        try:
+            md5 = _fetch_from(source, part_path, settings)
+        except Exception as e:
+            errors.append(f"{source}: {e}")
+            continue
+        if md5 is None:
+            continue
+        if expected_md5 and md5 != expected_md5:
+            errors.append(f"{source}: MD5 {md5} does not match expected {expected_md5}")
+            part_path.unlink()
+            continue
+
+        os.replace(part_path, dest)
+        manifest.record(dest, md5)
+        if cache:
+            cache.store(url, dest, md5)
+        logger.info(f"Downloaded {url} to {dest}")
+        return dest
+
+    raise RuntimeError(f"Failed to download {url}: {'; '.join(errors) or 'not found in any mirror'}")
+
+
+def download_all(jobs, max_workers=None, settings=None):
+    """Download (url, dest) or (url, dest, expected_md5) jobs concurrently.
+
+    Returns {url: path} for the files that succeeded and raises RuntimeError
+    listing the failures once every job has finished.
+    """
+    settings = settings or get_section("downloads", DOWNLOAD_DEFAULTS)
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers or settings["max_workers"]) as executor:
+        futures = {executor.submit(download, *job, settings=settings): job[0] for job in jobs}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                logger.error(str(e))
+                failures[url] = e
+
+    with _manifests_lock:
+        for manifest in _manifests.values():
+            manifest.save()
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(jobs)} downloads failed: {', '.join(failures)}")
+    return results
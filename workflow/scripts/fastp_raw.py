@@ -1,61 +1,80 @@
 import os
-import sys
 import csv
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 import logging
 
-# Ensure the logs directory exists
-log_dir = os.path.dirname("./logs/")
-os.makedirs(log_dir, exist_ok=True)  # Creates the directory if it doesn't exist
+from compression import compress_intermediates, fq_suffix, settings as compression_settings
+from pipeline_config import log_dir, setup_logging, tool_path
+from work_queue import get_work_queue
 
-logger = logging.getLogger()
-logger.addHandler(logging.StreamHandler(sys.stdout))
-logger.addHandler(logging.FileHandler("./logs/fastp_processing.log"))
-logger.setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
 
 
-# Function to run fastp
-def run_fastp(ids, r1_path, r2_path, output_dir="fastp_processed"):
-    # Create output directory for each sample
-    os.makedirs(output_dir, exist_ok=True)
+def fastp_command(ids, r1_path, r2_path, output_dir="fastp_processed", merged_out=None,
+                  out1=None, out2=None, unpaired=True, config_file="config/config.yaml"):
+    """Build the fastp command; the merged/unmerged outputs can be redirected (e.g. to FIFOs).
 
-    # Define the fastp command with appropriate options
+    With compressed intermediates on, outputs are named .fq.gz and fastp gzips them itself.
+    """
+    suffix = fq_suffix(config_file)
     command = [
-        "../../../users/marik2/apps/bin/fastp", "-i", r1_path, "-I", r2_path,
+        tool_path("fastp", config_file), "-i", r1_path, "-I", r2_path,
         "--merge",
-        "--merged_out", f"{output_dir}/{ids}_processed.fq",
-	"--qualified_quality_phred=8",
+        "--merged_out", merged_out or f"{output_dir}/{ids}_processed{suffix}",
+        "--qualified_quality_phred=8",
         "--detect_adapter_for_pe",
         "--disable_length_filtering",
         "--trim_poly_g",
         "--correction",
         "--dedup",
-        "--out1", f"{output_dir}/{ids}_unmerged_1.fq",
-        "--out2", f"{output_dir}/{ids}_unmerged_2.fq",
-        "--unpaired1", f"{output_dir}/{ids}_unpaired_1.fq",
-        "--unpaired2", f"{output_dir}/{ids}_unpaired_2.fq",
+        "--out1", out1 or f"{output_dir}/{ids}_unmerged_1{suffix}",
+        "--out2", out2 or f"{output_dir}/{ids}_unmerged_2{suffix}",
+    ]
+    if unpaired:
+        command += [
+            "--unpaired1", f"{output_dir}/{ids}_unpaired_1{suffix}",
+            "--unpaired2", f"{output_dir}/{ids}_unpaired_2{suffix}",
+        ]
+    if compress_intermediates(config_file):
+        command += ["--compression", str(compression_settings(config_file)["level"])]
+    command += [
         "--html", f"{output_dir}/{ids}_fastp.html",
         "--json", f"{output_dir}/{ids}_fastp.json",
         "--thread", "6"
     ]
+    return command
+
+# Function to run fastp
+def run_fastp(ids, r1_path, r2_path, output_dir="fastp_processed", config_file="config/config.yaml"):
+    # Create output directory for each sample
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Define the fastp command with appropriate options
+    command = fastp_command(ids, r1_path, r2_path, output_dir, config_file=config_file)
 
     # Run the command and capture the output and errors
     result = subprocess.run(command, capture_output=True, text=True)
 
     # Write stdout and stderr to log files
-    with open(f"logs/{ids}_fastp_output.log", "w") as f_out:
+    with open(f"{log_dir}/{ids}_fastp_output.log", "w") as f_out:
         f_out.write(result.stdout)
-    with open(f"logs/{ids}_fastp_error.log", "w") as f_err:
+    with open(f"{log_dir}/{ids}_fastp_error.log", "w") as f_err:
         f_err.write(result.stderr)
 
-    print(f"Processed {ids}")
+    if result.returncode != 0:
+        logger.error(f"fastp failed for {ids} with return code {result.returncode}. See log for details.")
+        raise subprocess.CalledProcessError(result.returncode, command)
+    logger.info(f"Processed {ids}")
 
-def main(csv_file, max_workers=4):
+def main(csv_file, output_dir="fastp_processed", max_workers=4, config_file="config/config.yaml"):
     # Read the CSV file
     with open(csv_file, newline='') as csvfile:
         reader = csv.DictReader(csvfile)
 
+        # Samples are claimed from the shared queue (if enabled) so several nodes can share a batch
+        queue = get_work_queue("fastp", config_file)
+
         # Use ThreadPoolExecutor to run fastp commands in parallel
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = []
@@ -65,19 +84,24 @@ def main(csv_file, max_workers=4):
                 r2_path = row['reverse'].strip()  # Adjust the column name to match your CSV
 
                 # Submit the fastp job to the executor
-                futures.append(executor.submit(run_fastp, ids, r1_path, r2_path))
+                futures.append(executor.submit(queue.run, ids, run_fastp, ids, r1_path, r2_path, output_dir,
+                                              config_file))
 
-            # Wait for all futures to complete
+            # Wait for all futures to complete; a failed sample does not stop the others
             for future in futures:
-                future.result()  # To re-raise exceptions if any occurred
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to process a sample: {e}")
 
-    print("All samples processed!")
+    logger.info("All samples processed!")
 
 if __name__ == "__main__":
+    setup_logging("fastp_processing.log")
+
     # Specify the CSV file to be read
     csv_file = 'samples_out.csv'
 
     # Run the main function with parallelism
     #1 hour 10 minutes for 8 libraries with 4 workers. 
     main(csv_file, max_workers=4)
-    
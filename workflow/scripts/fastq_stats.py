@@ -0,0 +1,297 @@
+"""Read and base statistics of FASTQ (and FASTA) files, in place of `seqkit stats`.
+
+Files are read in binary blocks of `block_bytes` (plain or gzipped, through
+compression.open_input) and each block is summarised with NumPy: the newline
+positions give every line, so the sequence and quality lines of all complete
+records are selected with one mask and counted with one bincount each. The
+incomplete record at the end of a block is carried over to the next one.
+
+Results are cached per file in `cache_dir`, keyed by the file's path, size and
+modification time, so later stages and reruns only read new or changed files.
+Files are summarised in parallel, `workers` at a time.
+
+The table (write_stats, `lichens stats`) has the `seqkit stats -a -T` columns
+that apply to reads, plus N(%):
+  file format num_seqs sum_len min_len avg_len max_len Q1 Q2 Q3 N50 Q20(%) Q30(%) GC(%) N(%)
+Quality columns are empty for FASTA.
+"""
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from compression import open_input
+from pipeline_config import get_section, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `fastq_stats` section of config/config.yaml
+STATS_DEFAULTS = {
+    "block_bytes": 8 * 2**20,   # bytes read and summarised at a time
+    "workers": 8,               # files summarised at once
+    "cache_dir": "./.fastq_stats",
+    "output_dir": "./read_stats",
+}
+
+# Files summarised by `lichens stats`, per stage: (paths section directory, glob)
+STAGE_FILES = {
+    "demux": ("demux_dir", "*.f*q*"),
+    "fastp": ("fastp_dir", "*_all_processed_reads.f*q*"),
+    "decontam": ("decontam_dir", "*_decontaminated_reads.f*q*"),
+    "unassembled": ("assembly_dir", "*/unassembled.fa*"),
+}
+
+COLUMNS = ["file", "format", "num_seqs", "sum_len", "min_len", "avg_len", "max_len",
+           "Q1", "Q2", "Q3", "N50", "Q20(%)", "Q30(%)", "GC(%)", "N(%)"]
+CACHE_VERSION = 1
+PHRED_OFFSET = 33
+NEWLINE, CR, HEADER = ord("\n"), ord("\r"), ord(">")
+GC_BYTES = [ord(base) for base in "GCgcSs"]
+N_BYTES = [ord(base) for base in "Nn"]
+FASTA_SUFFIXES = (".fa", ".fas", ".fasta", ".fna")
+
+
+def settings(config_file="config/config.yaml"):
+    return get_section("fastq_stats", STATS_DEFAULTS, config_file)
+
+
+class _Totals:
+    """Counts accumulated over the blocks of one file."""
+
+    def __init__(self):
+        self.lengths = np.zeros(0, dtype=np.int64)   # reads per length
+        self.bases = np.zeros(256, dtype=np.int64)   # sequence bytes by value
+        self.quals = np.zeros(256, dtype=np.int64)   # quality bytes by value
+
+    def add(self, lengths, sequence_bytes, quality_bytes=None):
+        histogram = np.bincount(lengths)
+        if len(histogram) > len(self.lengths):
+            self.lengths = np.concatenate((self.lengths, np.zeros(len(histogram) - len(self.lengths), dtype=np.int64)))
+        self.lengths[:len(histogram)] += histogram
+        self.bases += np.bincount(sequence_bytes, minlength=256)
+        if quality_bytes is not None:
+            self.quals += np.bincount(quality_bytes, minlength=256)
+
+
+def _fastq_block(data, totals):
+    """Add the complete 4-line records of data to totals. Returns the unprocessed tail."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == NEWLINE)
+    records = len(newlines) // 4
+    if not records:
+        return data
+    ends = newlines[:4 * records]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    if (arr[starts[::4]] != ord("@")).any():
+        raise ValueError("not a 4-line FASTQ file")
+    end = ends[-1] + 1
+    # Line of each record (0 header, 1 sequence, 2 plus, 3 quality) for every byte, newline included
+    kind = np.repeat(np.tile(np.arange(4, dtype=np.uint8), records), ends - starts + 1)
+    block = arr[:end]
+    lengths = ends[1::4] - starts[1::4]
+    lengths -= arr[ends[1::4] - 1] == CR
+    totals.add(lengths, block[kind == 1], block[kind == 3])
+    return data[end:]
+
+
+def _fasta_block(data, totals, final):
+    """Add the complete records of data to totals (all of them if final). Returns the unprocessed tail."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == NEWLINE)
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_starts = line_starts[line_starts < len(arr)]
+    headers = line_starts[arr[line_starts] == HEADER]
+    if not final:
+        # The last record may continue in the next block
+        if len(headers) < 2:
+            return data
+        end, headers = headers[-1], headers[:-1]
+    else:
+        end = len(arr)
+    if not len(headers):
+        return data[end:]
+    if headers[0] != 0:
+        raise ValueError("not a FASTA file")
+    block = arr[:end]
+    header_ends = np.append(newlines, len(arr))[np.searchsorted(newlines, headers)]
+    in_header = np.zeros(end + 1, dtype=np.int8)
+    in_header[headers] = 1
+    in_header[np.minimum(header_ends, end)] -= 1
+    sequence = np.flatnonzero((np.cumsum(in_header[:end], dtype=np.int8) == 0) & (block != NEWLINE) & (block != CR))
+    record = np.searchsorted(headers, sequence, side="right") - 1
+    totals.add(np.bincount(record, minlength=len(headers)), block[sequence])
+    return data[end:]
+
+
+def _file_format(path):
+    with open_input(path) as f:
+        first = f.read(1)
+    if first == b"@":
+        return "FASTQ"
+    if first == b">":
+        return "FASTA"
+    if not first:
+        return "FASTA" if Path(path).name.replace(".gz", "").endswith(FASTA_SUFFIXES) else "FASTQ"
+    raise ValueError(f"{path} is neither FASTQ nor FASTA")
+
+
+def file_stats(path, block_bytes=STATS_DEFAULTS["block_bytes"]):
+    """Counts of one FASTQ or FASTA file, as a JSON-serialisable dict."""
+    file_format = _file_format(path)
+    totals = _Totals()
+    tail = b""
+    try:
+        with open_input(path) as f:
+            while block := f.read(block_bytes):
+                data = tail + block
+                tail = _fastq_block(data, totals) if file_format == "FASTQ" else _fasta_block(data, totals, False)
+        if file_format == "FASTQ":
+            tail = _fastq_block(tail + b"\n" if tail and not tail.endswith(b"\n") else tail, totals)
+            if tail.strip():
+                raise ValueError("truncated FASTQ record at the end of the file")
+        else:
+            _fasta_block(tail, totals, True)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+
+    observed = np.flatnonzero(totals.lengths)
+    return {
+        "file": str(path),
+        "format": file_format,
+        "num_seqs": int(totals.lengths.sum()),
+        "sum_len": int(totals.lengths @ np.arange(len(totals.lengths))),
+        "gc": int(totals.bases[GC_BYTES].sum()),
+        "n": int(totals.bases[N_BYTES].sum()),
+        "quality_bases": int(totals.quals[PHRED_OFFSET:].sum()),
+        "q20": int(totals.quals[PHRED_OFFSET + 20:].sum()),
+        "q30": int(totals.quals[PHRED_OFFSET + 30:].sum()),
+        "lengths": [[int(length), int(totals.lengths[length])] for length in observed],
+    }
+
+
+def _cache_file(path, cache_dir):
+    stat = os.stat(path)
+    key = f"{CACHE_VERSION}:{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return Path(cache_dir) / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+
+def _load_cached(path, cache_dir):
+    cache_file = _cache_file(path, cache_dir)
+    if not cache_file.is_file():
+        return None
+    stats = json.loads(cache_file.read_text())
+    stats["file"] = str(path)
+    return stats
+
+
+def cached_file_stats(path, block_bytes, cache_dir):
+    """file_stats, read from or saved to the cache."""
+    stats = _load_cached(path, cache_dir)
+    if stats is None:
+        stats = file_stats(path, block_bytes)
+        cache_file = _cache_file(path, cache_dir)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(stats))
+        os.replace(tmp_file, cache_file)
+    return stats
+
+
+def collect_stats(paths, config_file="config/config.yaml"):
+    """Stats of each file in paths, in order; uncached files are read in parallel."""
+    config = settings(config_file)
+    paths = [str(path) for path in paths]
+    results = {path: _load_cached(path, config["cache_dir"]) for path in paths}
+    missing = [path for path, stats in results.items() if stats is None]
+    if missing:
+        logger.info(f"Reading {len(missing)} of {len(paths)} files ({len(paths) - len(missing)} cached)")
+        with ProcessPoolExecutor(max_workers=max(1, min(config["workers"], len(missing)))) as executor:
+            futures = {path: executor.submit(cached_file_stats, path, config["block_bytes"], config["cache_dir"])
+                       for path in missing}
+            for path, future in futures.items():
+                results[path] = future.result()
+    return [results[path] for path in paths]
+
+
+def length_quantile(lengths, fraction):
+    """Length at the given fraction of reads sorted by length, from [[length, reads]] pairs."""
+    if not lengths:
+        return 0
+    values, counts = np.array(lengths).T
+    return int(values[np.searchsorted(np.cumsum(counts), fraction * counts.sum())])
+
+
+def n50(lengths):
+    if not lengths:
+        return 0
+    values, counts = np.array(lengths).T
+    bases = np.cumsum((values * counts)[::-1])
+    return int(values[::-1][np.searchsorted(bases, bases[-1] / 2)])
+
+
+def summary_row(stats):
+    """Table row (strings, in COLUMNS order) of one file's stats."""
+    reads, bases = stats["num_seqs"], stats["sum_len"]
+    lengths = stats["lengths"]
+    quality = stats["format"] == "FASTQ" and stats["quality_bases"]
+
+    def percent(count, total):
+        return f"{100 * count / total:.2f}" if total else ""
+
+    return [
+        stats["file"], stats["format"], str(reads), str(bases),
+        str(lengths[0][0] if lengths else 0), f"{bases / reads:.1f}" if reads else "0.0",
+        str(lengths[-1][0] if lengths else 0),
+        str(length_quantile(lengths, 0.25)), str(length_quantile(lengths, 0.5)), str(length_quantile(lengths, 0.75)),
+        str(n50(lengths)),
+        percent(stats["q20"], stats["quality_bases"]) if quality else "",
+        percent(stats["q30"], stats["quality_bases"]) if quality else "",
+        percent(stats["gc"], bases), percent(stats["n"], bases),
+    ]
+
+
+def write_stats(paths, output, config_file="config/config.yaml"):
+    """Write the stats table of paths to output. Returns the stats."""
+    results = collect_stats(paths, config_file)
+    tmp_file = f"{output}.tmp"
+    with open(tmp_file, "w") as out:
+        out.write("\t".join(COLUMNS) + "\n")
+        out.writelines("\t".join(summary_row(stats)) + "\n" for stats in results)
+    os.replace(tmp_file, output)
+    return results
+
+
+def stage_files(stage, paths):
+    """Files summarised for a stage, given the `paths` config section."""
+    directory, pattern = STAGE_FILES[stage]
+    return sorted(str(file) for file in Path(paths[directory]).glob(pattern)
+                  if not file.name.endswith((".tmp", ".lock")))
+
+
+def main(paths, stages=tuple(STAGE_FILES), config_file="config/config.yaml"):
+    """Write <output_dir>/<stage>_stats.tsv for each stage with outputs."""
+    config = settings(config_file)
+    os.makedirs(config["output_dir"], exist_ok=True)
+    for stage in stages:
+        files = stage_files(stage, paths)
+        if not files:
+            logger.info(f"No {stage} outputs found; skipping")
+            continue
+        output = Path(config["output_dir"]) / f"{stage}_stats.tsv"
+        results = write_stats(files, output, config_file)
+        logger.info(f"{stage}: {sum(stats['num_seqs'] for stats in results)} reads, "
+                    f"{sum(stats['sum_len'] for stats in results)} bases in {len(files)} files -> {output}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    setup_logging("fastq_stats.log")
+    if len(sys.argv) < 3:
+        print("Usage: python fastq_stats.py <output.tsv> <file> [<file> ...]")
+        sys.exit(1)
+    write_stats(sys.argv[2:], sys.argv[1])
@@ -1,48 +1,13 @@
 import os
 import sys
-import pandas as pd
-from pathlib import Path
 import pathlib
 import logging
 import csv
 
-# Ensure the logs directory exists
-log_dir = os.path.dirname("./logs/Generate_Samples_Csv.log")
-os.makedirs(log_dir, exist_ok=True)  # Creates the directory if it doesn't exist
-
-# Configure logger
-logger = logging.getLogger()
-logger.addHandler(logging.StreamHandler(sys.stdout))
-logger.addHandler(logging.FileHandler("./logs/ids2csv.log"))
-logger.setLevel(logging.INFO)
-
-def xlsx2csv(file_path):
-    # Check if the provided file exists
-    if not Path(file_path).is_file():
-        logger.error(f"Error: The file '{file_path}' does not exist.")
-        sys.exit(1)
-
-    # Read the Excel sheet
-    xlsx_read = pd.read_excel(file_path)
-
-    # Extract the name of the Excel file without the extension
-    csv_name = pathlib.Path(file_path).stem
-    dirname = os.path.dirname(file_path)
-
-    # Convert the Excel sheet to a CSV file
-    csv_file_path = f"{dirname}/{csv_name}.csv"
-    xlsx_read.to_csv(csv_file_path, index=None, header=True)
-
-    logger.info(f"Successfully converted '{file_path}' to '{csv_file_path}'")
-    return csv_file_path
-
-
-def get_ids(file_path, column_name, delimiter):
-    # Reading in file
-    df = pd.read_csv(file_path, delimiter=delimiter)
-    ids = df[column_name]
-    return ids
+from pipeline_config import setup_logging
+from sample_sheet import get_ids
 
+logger = logging.getLogger(__name__)
 
 def find_files(project_dir, ids):
     # Initialize a dictionary to store the results
@@ -85,13 +50,12 @@ def write_to_csv(results, output_filename):
 
 
 def main(project_dir, file_path, column_name, delimiter):
-    # If the file is an XLSX, convert it to CSV
-    if pathlib.Path(file_path).suffix == ".xlsx":
-        file_path = xlsx2csv(file_path)
-    
-    # Extract IDs from the CSV
+    # Extract IDs from the .xlsx or delimited sample sheet
     ids = get_ids(file_path, column_name, delimiter)
-    logger.info(f"Extracted IDs: {list(ids)}")
+    if not ids:
+        logger.error(f"No IDs found in '{file_path}'.")
+        sys.exit(1)
+    logger.info(f"Extracted IDs: {ids}")
 
     # Find the corresponding files
     files_info = find_files(project_dir, ids)
@@ -103,6 +67,8 @@ def main(project_dir, file_path, column_name, delimiter):
 
     
 if __name__ == "__main__":
+    setup_logging("ids2csv.log")
+
     # Define project-specific arguments
     delimiter = ','  
     project_dir = 'Test_dir/SRA_dir'
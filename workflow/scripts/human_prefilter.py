@@ -0,0 +1,191 @@
+"""Human k-mer prefilter: only reads that may be human are aligned to GRCh38.
+
+The human fraction of lichen samples is tiny, so nearly all of the `bwa mem`
+work in decontam_bbduk_bwa.py is spent on reads that cannot be human. The
+minimizers of the human reference (minimizers.py hashing) are stored once in a
+Bloom filter, cached next to the reference FASTA (<reference> itself, or
+<reference>.gz as linked by reference_registry.py) as
+  <reference>.bloom_k<k>_w<window>.npy   the filter bits (memory-mapped when loaded)
+  <reference>.bloom_k<k>_w<window>.json  its parameters and the reference size and mtime
+and rebuilt when the reference changes.
+
+Each read's minimizers are looked up in the filter; reads with at least
+`min_hits` hits are sent to bwa, as are reads too short (or too ambiguous) to
+have `min_hits` minimizers at all; all other reads go straight to the
+decontaminated output. False positives only send a few extra reads to bwa, and
+a human read is missed only if sequencing errors leave it with fewer than
+`min_hits` intact minimizers (see benchmark_prefilter.py).
+"""
+import os
+import json
+import math
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from classify_reads import batch_minimizers
+from compression import open_input, open_output
+from decontam_bbduk_bwa import PREFILTER_DEFAULTS
+from minimizers import CHUNK, MAX_HASH, encode, kmer_hashes, read_fasta, window_minima
+from pipeline_config import get_section
+from work_queue import file_lock
+
+logger = logging.getLogger(__name__)
+
+def settings(config_file="config/config.yaml"):
+    return get_section("human_prefilter", PREFILTER_DEFAULTS, config_file)
+
+
+def bloom_positions(hashes, bits, n_hashes):
+    """Bit positions of each hash (rows) for n_hashes functions by double hashing; bits is a power of two."""
+    step = (hashes >> np.uint64(32)) | np.uint64(1)
+    with np.errstate(over="ignore"):
+        positions = hashes[:, None] + step[:, None] * np.arange(n_hashes, dtype=np.uint64)
+    return positions & np.uint64(bits - 1)
+
+
+def bloom_add(words, hashes, n_hashes):
+    positions = bloom_positions(hashes, len(words) * 64, n_hashes).ravel()
+    np.bitwise_or.at(words, positions >> np.uint64(6), np.uint64(1) << (positions & np.uint64(63)))
+
+
+def bloom_contains(words, hashes, n_hashes):
+    positions = bloom_positions(hashes, len(words) * 64, n_hashes)
+    bits = (words[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+    return bits.all(axis=1)
+
+
+def sequence_minimizers(sequence, k, window):
+    """Distinct minimizers of one reference sequence, hashed a chunk at a time."""
+    overlap = k + window - 2
+    parts = []
+    for start in range(0, max(len(sequence) - overlap, 1), CHUNK):
+        minima = window_minima(kmer_hashes(encode(sequence[start:start + CHUNK + overlap]), k), window)
+        parts.append(np.unique(minima[minima != MAX_HASH]))
+    return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+
+
+def resolve_reference(reference):
+    """Path of the reference FASTA: reference itself, or reference.gz when only the gzipped copy exists.
+
+    The registry links GRCh38 as <name>.fna.gz with its bwa index under the <name>.fna prefix.
+    """
+    for path in (Path(reference), Path(f"{reference}.gz")):
+        if path.is_file():
+            return str(path)
+    raise FileNotFoundError(f"Human reference {reference} (or {reference}.gz) not found")
+
+
+def filter_paths(reference, config):
+    stem = f"{reference}.bloom_k{config['k']}_w{config['window']}"
+    return Path(f"{stem}.npy"), Path(f"{stem}.json")
+
+
+def build_filter(reference, config):
+    """Insert the minimizers of every reference sequence into a new Bloom filter."""
+    words_path, meta_path = filter_paths(reference, config)
+    # Sized for the expected minimizer count, 2 / (window + 1) per base, taking the file size as the base count
+    # (times 4 for a gzipped reference, about the compression ratio of DNA)
+    bases = os.path.getsize(reference) * (4 if str(reference).endswith(".gz") else 1)
+    expected = 2 * bases / (config["window"] + 1)
+    bits = 1 << max(12, round(math.log2(expected * config["bits_per_minimizer"])))
+    n_hashes = max(1, round(config["bits_per_minimizer"] * math.log(2)))
+    words = np.zeros(bits // 64, dtype=np.uint64)
+
+    inserted = 0
+    with ProcessPoolExecutor(max_workers=config["workers"]) as executor:
+        # Keep a bounded number of sequences in flight; chromosomes are large
+        pending = deque()
+        for _, sequence in read_fasta(reference):
+            pending.append(executor.submit(sequence_minimizers, sequence, config["k"], config["window"]))
+            if len(pending) >= config["workers"]:
+                minimizers = pending.popleft().result()
+                bloom_add(words, minimizers, n_hashes)
+                inserted += len(minimizers)
+        while pending:
+            minimizers = pending.popleft().result()
+            bloom_add(words, minimizers, n_hashes)
+            inserted += len(minimizers)
+
+    np.save(f"{words_path}.tmp.npy", words)
+    stat = os.stat(reference)
+    meta = {"k": config["k"], "window": config["window"], "n_hashes": n_hashes, "bits": bits,
+            "minimizers": inserted, "reference_size": stat.st_size, "reference_mtime": stat.st_mtime}
+    Path(f"{meta_path}.tmp").write_text(json.dumps(meta))
+    os.replace(f"{words_path}.tmp.npy", words_path)
+    os.replace(f"{meta_path}.tmp", meta_path)
+    logger.info(f"Human prefilter: {inserted} minimizers in a {bits // 8 // 2**20} MiB filter")
+
+
+def _is_current(reference, meta_path):
+    if not meta_path.is_file():
+        return False
+    meta = json.loads(meta_path.read_text())
+    stat = os.stat(reference)
+    return (meta["reference_size"], meta["reference_mtime"]) == (stat.st_size, stat.st_mtime)
+
+
+def load_filter(reference, config_file="config/config.yaml"):
+    """Returns (words, n_hashes, k, window), building the filter first if it is missing or stale."""
+    return _load_filter(resolve_reference(reference), config_file)
+
+
+@lru_cache(maxsize=None)
+def _load_filter(reference, config_file):
+    config = settings(config_file)
+    words_path, meta_path = filter_paths(reference, config)
+    if not _is_current(reference, meta_path):
+        # Concurrent samples (or nodes) wait for a single build
+        with file_lock(f"{words_path}.lock"):
+            if not _is_current(reference, meta_path):
+                build_filter(reference, config)
+    meta = json.loads(meta_path.read_text())
+    return np.load(words_path, mmap_mode="r"), meta["n_hashes"], meta["k"], meta["window"]
+
+
+def read_records(reads_file, batch_reads):
+    """Yield (records, sequences): whole 4-line FASTQ records as bytes, and their sequences."""
+    records, sequences = [], []
+    with open_input(reads_file) as f:
+        for header in f:
+            sequence, plus, quality = next(f), next(f), next(f)
+            records.append(header + sequence + plus + quality)
+            sequences.append(sequence.rstrip())
+            if len(records) == batch_reads:
+                yield records, sequences
+                records, sequences = [], []
+    if records:
+        yield records, sequences
+
+
+def candidate_mask(sequences, words, n_hashes, k, window, min_hits):
+    """True for the reads with at least min_hits minimizers in the human filter.
+
+    Reads with fewer than min_hits minimizers in all (shorter than k + window - 1,
+    or mostly N) cannot be cleared by the filter, so they are sent to bwa as well.
+    """
+    reads, minima = batch_minimizers(sequences, k, window)
+    hits = bloom_contains(words, minima, n_hashes)
+    totals = np.bincount(reads, minlength=len(sequences))
+    return (np.bincount(reads[hits], minlength=len(sequences)) >= min_hits) | (totals < min_hits)
+
+
+def split_reads(reads_file, candidates_file, cleared_file, reference, config_file="config/config.yaml"):
+    """Write reads that may be human to candidates_file and all others to cleared_file. Returns the counts."""
+    config = settings(config_file)
+    words, n_hashes, k, window = load_filter(reference, config_file)
+    counts = {"reads": 0, "to_bwa": 0, "cleared": 0}
+    with open_output(candidates_file, config_file=config_file) as candidates_out, \
+            open_output(cleared_file, config_file=config_file) as cleared_out:
+        for records, sequences in read_records(reads_file, config["batch_reads"]):
+            mask = candidate_mask(sequences, words, n_hashes, k, window, config["min_hits"])
+            candidates_out.write(b"".join(record for record, keep in zip(records, mask) if keep))
+            cleared_out.write(b"".join(record for record, keep in zip(records, mask) if not keep))
+            counts["reads"] += len(records)
+            counts["to_bwa"] += int(mask.sum())
+    counts["cleared"] = counts["reads"] - counts["to_bwa"]
+    return counts
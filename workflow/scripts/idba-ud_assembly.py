@@ -1,29 +1,16 @@
 import os
-import sys
 import subprocess
 import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import pathlib
 
-# Ensure necessary directories exist
-log_dir = "./logs"
-assembly_dir = "./assemblies"
-os.makedirs(log_dir, exist_ok=True)
-os.makedirs(assembly_dir, exist_ok=True)
-
-# Set up logging to both stdout and a file
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+from compression import fastq_to_fasta
+from pipeline_config import log_dir, setup_logging, tool_path
 
-if not logger.hasHandlers():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
+logger = logging.getLogger(__name__)
 
-    file_handler = logging.FileHandler(os.path.join(log_dir, "idba-ud_processed.log"))
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(file_handler)
+assembly_dir = "./assemblies"
 
 def get_ids(seq_dir):
     dir_path = pathlib.Path(seq_dir)
@@ -42,11 +29,17 @@ def get_ids(seq_dir):
     
     return ids
 
-def run_fq2fa(id, seq_dir):
-    merged_file = f"{seq_dir}/{id}_unmapped_reads.fastq"  # Corrected merged file path
-    output_file = f"{seq_dir}/{id}_unmapped_reads.fas"
+def run_fq2fa(id, seq_dir, config_file="config/config.yaml", merged_file=None, output_file=None):
+    merged_file = merged_file or f"{seq_dir}/{id}_unmapped_reads.fastq"  # Corrected merged file path
+    output_file = output_file or f"{seq_dir}/{id}_unmapped_reads.fas"
 
-    command = ["../../../users/marik2/apps/idba-1.1.3/bin/fq2fa", merged_file, output_file]
+    if merged_file.endswith(".gz"):
+        # fq2fa does not read gzipped FASTQ
+        fastq_to_fasta(merged_file, output_file)
+        logger.info(f"Processed {id} from FASTQ to FASTA")
+        return output_file
+
+    command = [tool_path("fq2fa", config_file), merged_file, output_file]
 
     try:
         with open(output_file, "w") as out_fh:
@@ -59,16 +52,18 @@ def run_fq2fa(id, seq_dir):
 
     except subprocess.CalledProcessError as e:
         logger.error(f"Error processing {id}: {e.stderr}")
+        raise
     except IOError as e:
         logger.error(f"File error for {id}: {str(e)}")
+        raise
 
     return output_file
 
-def run_idba_ud(id, fasta_file):
+def run_idba_ud(id, fasta_file, assembly_dir=assembly_dir, config_file="config/config.yaml"):
     logger.info(f"Starting idba-ud for {id}")
 
     command = [
-        "../../../users/marik2/apps/idba-1.1.3/bin/idba_ud",
+        tool_path("idba_ud", config_file),
         "-r", fasta_file,
         "--num_threads", "1",
         "-o", f"{assembly_dir}/{id}_idba_ud/"
@@ -76,12 +71,7 @@ def run_idba_ud(id, fasta_file):
 
     logger.debug(f"Running command: {' '.join(command)}")
 
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        logger.info(f"IDBA-UD completed for {id}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"IDBA-UD failed for {id}: {e.stderr}")
-        return
+    result = subprocess.run(command, capture_output=True, text=True)
 
     try:
         with open(f"{log_dir}/{id}_IDBA-UD_processed_output.log", "w") as f_out:
@@ -91,12 +81,14 @@ def run_idba_ud(id, fasta_file):
     except IOError as e:
         logger.error(f"Error writing logs for {id}: {e}")
 
-    if result.returncode == 0:
-        logger.info(f"Successfully processed {id}")
-    else:
-        logger.error(f"IDBA-UD processing failed for {id} with return code {result.returncode}")
+    if result.returncode != 0:
+        logger.error(f"IDBA-UD processing failed for {id} with return code {result.returncode}: {result.stderr}")
+        raise subprocess.CalledProcessError(result.returncode, command)
+    logger.info(f"Successfully processed {id}")
+
+def main(seq_dir, max_workers=4, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    os.makedirs(assembly_dir, exist_ok=True)
 
-def main(seq_dir, max_workers=4):
     ids = get_ids(seq_dir)
     if not ids:
         logger.error("No IDs found. Exiting.")
@@ -110,7 +102,7 @@ def main(seq_dir, max_workers=4):
 
             # Check if FASTA already exists, if not, convert FASTQ to FASTA
             if not os.path.exists(fasta_file):
-                futures[executor.submit(run_fq2fa, id, seq_dir)] = id
+                futures[executor.submit(run_fq2fa, id, seq_dir, config_file)] = id
 
         # Wait for all FASTQ-to-FASTA conversions to complete before running idba-ud
         for future in as_completed(futures):
@@ -118,10 +110,12 @@ def main(seq_dir, max_workers=4):
             try:
                 fasta_file = future.result()  # Get the resulting FASTA file
                 # Submit idba_ud for this ID
-                executor.submit(run_idba_ud, id, fasta_file)
+                executor.submit(run_idba_ud, id, fasta_file, assembly_dir, config_file)
             except Exception as e:
                 logger.error(f"FASTQ to FASTA conversion failed for {id}: {e}")
 
 if __name__ == "__main__":
+    setup_logging("idba-ud_processed.log", level=logging.DEBUG)
+
     seq_dir = './decontaminated_reads/'
     main(seq_dir, max_workers=2)
@@ -0,0 +1,372 @@
+"""Single entry point for the lichen pipeline stages.
+
+Stage modules (and pandas) are only imported when a stage actually runs, so
+`lichens --help` and `lichens report` start quickly.
+
+Usage: python lichens.py [--config config/config.yaml] <stage>
+       python lichens.py run fastp decontam assemble unassembled
+       python lichens.py submit decontam [--local]   # one SLURM array task per sample
+"""
+import argparse
+import functools
+import importlib
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from pipeline_config import CONFIG_FILE, get_section, load_config, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `paths` section of config/config.yaml
+PATH_DEFAULTS = {
+    "samples_csv": "samples_out.csv",
+    "raw_dir": "./raw_data/",
+    "demux_dir": "./demultiplexed",
+    "fastp_dir": "./fastp_processed",
+    "decontam_dir": "./decontaminated_reads",
+    "assembly_dir": "./assemblies",
+}
+
+# Defaults for the `demux` section of config/config.yaml
+DEMUX_DEFAULTS = {
+    "error_rate": 1,
+    "i7_barcodes": "i7_barcodes.fasta",
+    "i5_barcodes": "i5_barcodes.fasta",
+}
+
+
+def _stage_module(name):
+    return importlib.import_module(name)
+
+
+def stage_samples(paths, config_file):
+    config = load_config(config_file)
+    _stage_module("generate_samples_csv").main(
+        config["project_dir"], config["sample_ids"], config["sample_ids_col_name"], ","
+    )
+
+
+def stage_demux(paths, config_file):
+    demux = get_section("demux", DEMUX_DEFAULTS, config_file)
+    _stage_module("cutadapt_demux").main(
+        demux["error_rate"], demux["i7_barcodes"], demux["i5_barcodes"], paths["raw_dir"], config_file=config_file
+    )
+
+
+def stage_clean(paths, config_file):
+    config = load_config(config_file)
+    _stage_module("seqkit_cleanup").main(config["sample_ids"], config["sample_ids_col_name"], paths["demux_dir"],
+                                         config_file=config_file)
+
+
+def stage_fastp(paths, config_file):
+    _stage_module("fastp_raw").main(paths["samples_csv"], output_dir=paths["fastp_dir"], config_file=config_file)
+    _stage_module("concatenate_unmerged").main(paths["fastp_dir"], config_file=config_file)
+
+
+def stage_decontam(paths, config_file):
+    _stage_module("decontam_bbduk_bwa").main(paths["fastp_dir"], paths["decontam_dir"], config_file=config_file)
+
+
+def stage_stream(paths, config_file):
+    _stage_module("streaming_decontam").main(paths["samples_csv"], paths["fastp_dir"], paths["decontam_dir"],
+                                             config_file=config_file)
+
+
+def stage_screen(paths, config_file):
+    _stage_module("sketch_screen").main(paths["decontam_dir"], config_file=config_file)
+
+
+def stage_assemble(paths, config_file):
+    _stage_module("assembler_router").main(paths["decontam_dir"], paths["fastp_dir"], config_file=config_file,
+                                           assembly_dir=paths["assembly_dir"])
+
+
+def stage_partition(paths, config_file):
+    _stage_module("partition_assembly").main(paths["decontam_dir"], config_file=config_file,
+                                             assembly_dir=paths["assembly_dir"])
+
+
+def stage_unassembled(paths, config_file):
+    _stage_module("bwa_unassembled").main(paths["decontam_dir"], assembly_dir=paths["assembly_dir"],
+                                          config_file=config_file)
+
+
+def stage_composition(paths, config_file):
+    _stage_module("composition").main(config_file=config_file, assembly_dir=paths["assembly_dir"])
+
+
+def stage_stats(paths, config_file):
+    _stage_module("fastq_stats").main(paths, config_file=config_file)
+
+
+def stage_lichendb(paths, config_file):
+    _stage_module("map_lichendb").main(paths["decontam_dir"], config_file=config_file)
+
+
+def stage_classify(paths, config_file):
+    _stage_module("classify_reads").main(paths["decontam_dir"], config_file=config_file)
+
+
+def stage_report(paths, config_file):
+    """Print which stage outputs exist for each sample (stdlib only)."""
+    import csv
+    import re
+
+    ids = set()
+    samples_csv = Path(paths["samples_csv"])
+    if samples_csv.is_file():
+        with samples_csv.open(newline="") as f:
+            ids.update(row["ID"] for row in csv.DictReader(f))
+    for file in Path(paths["fastp_dir"]).glob("*_processed.fq"):
+        if (match := re.match(r'(.+?)_processed\.fq$', file.name)):
+            ids.add(match.group(1))
+
+    choices = {}
+    choices_file = Path(paths["assembly_dir"]) / "assembler_choices.tsv"
+    if choices_file.is_file():
+        with choices_file.open(newline="") as f:
+            choices = {row["ID"]: row["assembler"] for row in csv.DictReader(f, delimiter="\t")}
+
+    writer = csv.writer(sys.stdout, delimiter="\t")
+    writer.writerow(["ID", "fastp", "decontam", "assembler", "unassembled", "assembly"])
+    for id in sorted(ids):
+        assembler = choices.get(id, "")
+        assembly_path = Path(paths["assembly_dir"]) / f"{id}_{assembler or 'megahit'}"
+        writer.writerow([
+            id,
+            (Path(paths["fastp_dir"]) / f"{id}_all_processed_reads.fq").exists(),
+            any(Path(paths["decontam_dir"]).glob(f"{id}_decontaminated_reads.f*q*")),
+            assembler or "-",
+            (assembly_path / "unassembled.fa").exists(),
+            (assembly_path / "assembly.fa").exists(),
+        ])
+
+
+def _read_samples(csv_file):
+    import csv
+
+    with open(csv_file, newline='') as f:
+        return [(row['ID'].strip(), row['forward'].strip(), row['reverse'].strip()) for row in csv.DictReader(f)]
+
+
+def _fastp_sample(id, r1_path, r2_path, fastp_dir, config_file):
+    _stage_module("fastp_raw").run_fastp(id, r1_path, r2_path, fastp_dir, config_file)
+    _stage_module("concatenate_unmerged").concatenate_files(id, fastp_dir, config_file)
+
+
+def tasks_fastp(paths, config_file):
+    return {id: functools.partial(_fastp_sample, id, r1_path, r2_path, paths["fastp_dir"], config_file)
+            for id, r1_path, r2_path in _read_samples(paths["samples_csv"])}
+
+
+def tasks_decontam(paths, config_file):
+    decontam = _stage_module("decontam_bbduk_bwa")
+    files = decontam.find_files(paths["fastp_dir"], decontam.get_ids(paths["fastp_dir"]))
+    temp_dir = os.path.join(paths["decontam_dir"], "temp_dir")
+    return {id: functools.partial(decontam.decontaminate_sample, id, file_path, paths["decontam_dir"], temp_dir,
+                                  config_file)
+            for id, file_path in files.items()}
+
+
+def tasks_stream(paths, config_file):
+    streaming = _stage_module("streaming_decontam")
+    settings = get_section("streaming", streaming.STREAMING_DEFAULTS, config_file)
+    return {id: functools.partial(streaming.run_streaming_sample, id, r1_path, r2_path,
+                                  paths["fastp_dir"], paths["decontam_dir"], settings, config_file)
+            for id, r1_path, r2_path in _read_samples(paths["samples_csv"])}
+
+
+def tasks_screen(paths, config_file):
+    screen = _stage_module("sketch_screen")
+    settings = get_section("screen", screen.SCREEN_DEFAULTS, config_file)
+    classify_settings = get_section("classify", screen.CLASSIFY_DEFAULTS, config_file)
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    return {id: functools.partial(screen.screen_sample, id, reads_file, settings, classify_settings)
+            for id, reads_file in screen.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+def tasks_assemble(paths, config_file):
+    router = _stage_module("assembler_router")
+    settings = get_section("assembler_routing", router.ROUTING_DEFAULTS, config_file)
+    return {id: functools.partial(router.route_and_assemble, id, reads_file,
+                                  paths["decontam_dir"], paths["fastp_dir"], settings, paths["assembly_dir"],
+                                  config_file)
+            for id, reads_file in router.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+def tasks_partition(paths, config_file):
+    partition = _stage_module("partition_assembly")
+    settings = get_section("partition", partition.PARTITION_DEFAULTS, config_file)
+    classify_settings = get_section("classify", partition.CLASSIFY_DEFAULTS, config_file)
+    routing = get_section("assembler_routing", partition.ROUTING_DEFAULTS, config_file)
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    return {id: functools.partial(partition.partition_sample, id, reads_file, settings, classify_settings, routing,
+                                  None, paths["assembly_dir"], config_file)
+            for id, reads_file in partition.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+def tasks_unassembled(paths, config_file):
+    unassembled = _stage_module("bwa_unassembled")
+    return {id: functools.partial(unassembled.unassembled_sample, id, None, input_file, paths["assembly_dir"],
+                                  config_file)
+            for id, input_file in unassembled.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+def tasks_composition(paths, config_file):
+    composition = _stage_module("composition")
+    settings = get_section("composition", composition.COMPOSITION_DEFAULTS, config_file)
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    return {id: functools.partial(composition.profile_assembly, id, fasta_file, settings)
+            for id, fasta_file in composition.get_assemblies(paths["assembly_dir"]).items()}
+
+
+def tasks_lichendb(paths, config_file):
+    lichendb = _stage_module("map_lichendb")
+    settings = get_section("lichendb", lichendb.LICHENDB_DEFAULTS, config_file)
+    shards = lichendb.load_shards(settings["manifest"])
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    return {id: functools.partial(lichendb.map_sample, id, reads_file, settings["output_dir"], shards, settings,
+                                  config_file)
+            for id, reads_file in lichendb.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+def tasks_classify(paths, config_file):
+    classify = _stage_module("classify_reads")
+    settings = get_section("classify", classify.CLASSIFY_DEFAULTS, config_file)
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    return {id: functools.partial(classify.classify_sample, id, reads_file, settings)
+            for id, reads_file in classify.get_ids_and_files(paths["decontam_dir"]).items()}
+
+
+# Per-sample tasks of each stage, for running one sample per cluster job (`lichens submit`)
+STAGE_TASKS = {
+    "fastp": tasks_fastp,
+    "decontam": tasks_decontam,
+    "stream": tasks_stream,
+    "screen": tasks_screen,
+    "assemble": tasks_assemble,
+    "partition": tasks_partition,
+    "unassembled": tasks_unassembled,
+    "composition": tasks_composition,
+    "lichendb": tasks_lichendb,
+    "classify": tasks_classify,
+}
+
+
+STAGES = {
+    "samples": (stage_samples, "Find raw read pairs for the sample sheet IDs (samples_out.csv)."),
+    "demux": (stage_demux, "Demultiplex undetermined reads with cutadapt."),
+    "clean": (stage_clean, "Sanitise and re-pair demultiplexed reads with seqkit."),
+    "fastp": (stage_fastp, "Trim/merge reads with fastp and concatenate merged and unmerged reads."),
+    "decontam": (stage_decontam, "Remove PhiX (BBDuk) and human (bwa) reads."),
+    "stream": (stage_stream, "Run fastp and decontamination as one streamed pipeline per sample."),
+    "screen": (stage_screen, "Sketch each sample and rank lichen database genomes by containment; flag off-target samples."),
+    "assemble": (stage_assemble, "Route each sample to megahit, metaSPAdes or IDBA-UD and assemble."),
+    "partition": (stage_partition, "Bin reads into mycobiont, photobiont and residual and assemble the bins concurrently."),
+    "unassembled": (stage_unassembled, "Map reads back to assemblies and collect unassembled reads."),
+    "composition": (stage_composition, "Write tetranucleotide frequency profiles of each sample's contigs."),
+    "stats": (stage_stats, "Write read and base statistics of the demux, fastp, decontam and unassembled outputs."),
+    "lichendb": (stage_lichendb, "Align decontaminated reads to the sharded lichen reference database."),
+    "classify": (stage_classify, "Classify decontaminated reads by minimizer matches to the lichen database."),
+    "report": (stage_report, "Print per-sample stage status."),
+}
+
+
+def run_pipeline(stages, config_file=CONFIG_FILE):
+    """Run stages in order in this Python process."""
+    paths = get_section("paths", PATH_DEFAULTS, config_file)
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}'. Valid stages are: {', '.join(STAGES)}")
+        logger.info(f"Running stage: {name}")
+        STAGES[name][0](paths, config_file)
+
+
+def run_task(stage, id, config_file=CONFIG_FILE, result_dir=None):
+    """Run one sample of a stage, recording the outcome in result_dir for the job collector."""
+    from cluster import write_result
+
+    paths = get_section("paths", PATH_DEFAULTS, config_file)
+    started = time.time()
+    try:
+        tasks = STAGE_TASKS[stage](paths, config_file)
+        if id not in tasks:
+            raise ValueError(f"No {stage} input found for {id}")
+        tasks[id]()
+    except Exception as e:
+        logger.error(f"{stage} failed for {id}: {e}")
+        if result_dir:
+            write_result(result_dir, stage, id, "failed", started, error=str(e))
+        raise
+    if result_dir:
+        write_result(result_dir, stage, id, "done", started)
+
+
+def submit_stage(stage, config_file=CONFIG_FILE, job_dir=None, local=False, wait=True, max_workers=None):
+    """Submit one array task per sample of a stage (or run them locally) and collect the results."""
+    cluster = _stage_module("cluster")
+
+    paths = get_section("paths", PATH_DEFAULTS, config_file)
+    ids = list(STAGE_TASKS[stage](paths, config_file))
+    job_dir = job_dir or f"jobs/{stage}_{time.strftime('%Y%m%d_%H%M%S')}"
+    cluster.prepare_array_job(stage, ids, job_dir, cluster.task_command(stage, config_file), config_file)
+    cluster.get_executor(local, max_workers).submit(job_dir, wait=wait)
+    if wait:
+        return cluster.collect_results(job_dir)
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lichens", description="DEFRA lichen metagenome pipeline.")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"Pipeline config file (default: {CONFIG_FILE}).")
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+    for name, (_, help_text) in STAGES.items():
+        subparsers.add_parser(name, help=help_text)
+    run_parser = subparsers.add_parser("run", help="Run several stages in order in one process.")
+    run_parser.add_argument("stages", nargs="+", choices=list(STAGES))
+    task_parser = subparsers.add_parser("task", help="Run one sample of a stage (used by array jobs).")
+    task_parser.add_argument("task_stage", choices=list(STAGE_TASKS))
+    task_parser.add_argument("id")
+    task_parser.add_argument("--result-dir", help="Write <ID>.json with the outcome here.")
+    submit_parser = subparsers.add_parser("submit", help="Run a stage as a SLURM array, one task per sample.")
+    submit_parser.add_argument("task_stage", choices=list(STAGE_TASKS))
+    submit_parser.add_argument("--job-dir", help="Job directory (default: jobs/<stage>_<timestamp>).")
+    submit_parser.add_argument("--local", action="store_true", help="Run the array tasks here with subprocesses.")
+    submit_parser.add_argument("--max-workers", type=int, help="Concurrent local tasks (with --local).")
+    submit_parser.add_argument("--no-wait", action="store_true", help="Return after sbatch instead of waiting.")
+    collect_parser = subparsers.add_parser("collect", help="Summarise the results of a submitted job.")
+    collect_parser.add_argument("job_dir")
+    args = parser.parse_args(argv)
+
+    if args.stage == "collect":
+        summary = _stage_module("cluster").collect_results(args.job_dir)
+        for status, ids in summary.items():
+            print(f"{status}\t{len(ids)}\t{','.join(ids)}")
+        sys.exit(1 if summary["failed"] or summary["missing"] else 0)
+    if args.stage == "task":
+        setup_logging(f"{args.task_stage}_{args.id}.log")
+        try:
+            run_task(args.task_stage, args.id, args.config, args.result_dir)
+        except Exception:
+            sys.exit(1)
+        return
+    if args.stage == "submit":
+        setup_logging("lichens.log")
+        summary = submit_stage(args.task_stage, args.config, args.job_dir, args.local,
+                               not args.no_wait, args.max_workers)
+        if summary and (summary["failed"] or summary["missing"]):
+            sys.exit(1)
+        return
+
+    stages = args.stages if args.stage == "run" else [args.stage]
+    if stages != ["report"]:
+        setup_logging("lichens.log")
+    run_pipeline(stages, args.config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Align decontaminated reads to the sharded lichen reference database and keep each read's best hit.
+
+The shard set is read from the manifest written by databases/scripts/shard_lichen_db.py.
+For each sample, the reads are aligned to every shard in parallel (`bwa mem`, primary
+alignments only), and each read's best-scoring hit (AS tag) across the shards is kept.
+Reads whose best score is shared by hits to different taxa are marked ambiguous.
+
+Outputs, per sample in the output directory:
+  <ID>_lichendb_hits.tsv     read, contig, accession, taxon, score, mapq, shard, ambiguous
+  <ID>_lichendb_summary.tsv  reads per taxon (unambiguous best hits)
+"""
+import os
+import re
+import json
+import pathlib
+import subprocess
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from classify_reads import get_ids_and_files
+from pipeline_config import get_section, log_dir, setup_logging, tool_path
+from work_queue import get_work_queue
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `lichendb` section of config/config.yaml
+LICHENDB_DEFAULTS = {
+    "manifest": "../ref/lichendb/shards/manifest.json",
+    "output_dir": "./lichendb_hits",
+    "bwa_threads": 4,        # per shard alignment
+    "parallel_shards": 4,    # shards aligned at once for one sample
+}
+
+_AS_TAG = re.compile(rb"\tAS:i:(-?\d+)")
+
+
+def load_shards(manifest_file):
+    """Shard entries from the manifest, with index prefixes resolved against its directory."""
+    manifest_file = pathlib.Path(manifest_file)
+    shards = json.loads(manifest_file.read_text())["shards"]
+    for shard in shards:
+        shard["prefix"] = str(manifest_file.parent / shard["prefix"])
+    return shards
+
+
+def align_to_shard(id, reads_file, shard, threads, config_file="config/config.yaml"):
+    """Align reads to one shard. Returns {read: (score, contig, mapq)} for the primary alignments."""
+    hits = {}
+    with open(f"{log_dir}/{id}_lichendb_{shard['name']}_error.log", "w") as err:
+        bwa = subprocess.Popen([tool_path("bwa", config_file), "mem", "-t", str(threads), shard["prefix"], reads_file],
+                               stdout=subprocess.PIPE, stderr=err)
+        # Drop unmapped (0x4), secondary (0x100) and supplementary (0x800) records
+        samtools = subprocess.Popen([tool_path("samtools", config_file), "view", "-F", "2308", "-"],
+                                    stdin=bwa.stdout, stdout=subprocess.PIPE, stderr=err)
+        bwa.stdout.close()
+        for line in samtools.stdout:
+            fields = line.split(b"\t", 5)
+            score = _AS_TAG.search(line)
+            hits[fields[0]] = (int(score.group(1)) if score else 0, fields[2], int(fields[4]))
+        samtools.stdout.close()
+        for process, name in [(bwa, "BWA MEM"), (samtools, "samtools view")]:
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, name)
+    return hits
+
+
+def merge_hits(best, hits, shard, order):
+    """Fold one shard's hits into best, {read: (score, contig, mapq, shard, ambiguous)}.
+
+    Shards can be merged in any order: ties keep the hit from the shard listed first
+    in the manifest (order maps shard names to their position).
+    """
+    for read, (score, contig, mapq) in hits.items():
+        current = best.get(read)
+        if current is None or score > current[0]:
+            best[read] = (score, contig, mapq, shard, False)
+        elif score == current[0]:
+            ambiguous = current[4] or _taxon(contig, shard) != _taxon(current[1], current[3])
+            if order[shard["name"]] < order[current[3]["name"]]:
+                best[read] = (score, contig, mapq, shard, ambiguous)
+            else:
+                best[read] = (*current[:4], ambiguous)
+
+
+def _taxon(contig, shard):
+    return shard["accessions"].get(contig.split(b"|", 1)[0].decode(), "unknown")
+
+
+def map_sample(id, reads_file, output_dir, shards, settings, config_file="config/config.yaml"):
+    logger.info(f"Aligning {id} to {len(shards)} lichendb shards")
+    order = {shard["name"]: i for i, shard in enumerate(shards)}
+    best = {}
+    with ThreadPoolExecutor(max_workers=settings["parallel_shards"]) as executor:
+        futures = {executor.submit(align_to_shard, id, reads_file, shard, settings["bwa_threads"], config_file): shard
+                   for shard in shards}
+        # Merge each shard as it finishes and drop its future, so only the shards still running hold their hits
+        for future in as_completed(futures):
+            shard = futures.pop(future)
+            merge_hits(best, future.result(), shard, order)
+
+    hits_file = pathlib.Path(output_dir) / f"{id}_lichendb_hits.tsv"
+    summary_file = pathlib.Path(output_dir) / f"{id}_lichendb_summary.tsv"
+    counts = Counter()
+    tmp_file = hits_file.with_suffix(".tsv.tmp")
+    with open(tmp_file, "w") as out:
+        out.write("read\tcontig\taccession\ttaxon\tscore\tmapq\tshard\tambiguous\n")
+        for read, (score, contig, mapq, shard, ambiguous) in best.items():
+            contig = contig.decode()
+            accession = contig.split("|", 1)[0]
+            taxon = shard["accessions"].get(accession, "unknown")
+            if not ambiguous:
+                counts[taxon] += 1
+            out.write(f"{read.decode()}\t{contig}\t{accession}\t{taxon}\t{score}\t{mapq}\t{shard['name']}\t{ambiguous}\n")
+    os.replace(tmp_file, hits_file)
+    with open(summary_file, "w") as out:
+        out.write("taxon\treads\n")
+        for taxon, reads in counts.most_common():
+            out.write(f"{taxon}\t{reads}\n")
+    logger.info(f"{id}: {len(best)} reads hit lichendb ({sum(counts.values())} unambiguously)")
+
+
+def main(seq_dir, config_file="config/config.yaml", max_workers=2):
+    settings = get_section("lichendb", LICHENDB_DEFAULTS, config_file)
+    shards = load_shards(settings["manifest"])
+    id_to_file = get_ids_and_files(seq_dir)
+    if not id_to_file:
+        logger.error("No input files found. Exiting.")
+        return
+    os.makedirs(settings["output_dir"], exist_ok=True)
+
+    queue = get_work_queue("lichendb", config_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {id: executor.submit(queue.run, id, map_sample, id, reads_file, settings["output_dir"], shards,
+                                       settings, config_file)
+                   for id, reads_file in id_to_file.items()}
+        for id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error mapping {id} to lichendb: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("map_lichendb.log")
+    main('./decontaminated_reads/')
@@ -1,31 +1,15 @@
 import os
-import sys
 import subprocess
 import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import pathlib
 
-# Ensure the logs directory exists
-log_dir = "./logs"
-os.makedirs(log_dir, exist_ok=True)
+from pipeline_config import log_dir, setup_logging, tool_path
 
-#Ensure assembly directory exists
-assembly_dir = "./assemblies"
-os.makedirs(assembly_dir, exist_ok=True)
-
-# Set up logging to both stdout and a file
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)  # Set to DEBUG for more detailed logs
+logger = logging.getLogger(__name__)
 
-if not logger.hasHandlers():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
-
-    file_handler = logging.FileHandler(os.path.join(log_dir, "megahit_processed.log"))
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(file_handler)
+assembly_dir = "./assemblies"
 
 def get_ids(seq_dir):
     dir_path = pathlib.Path(seq_dir)
@@ -67,32 +51,31 @@ def find_files(seq_dir, ids):
 
     return results
 
-def run_megahit(id, r1_path, r2_path=None):
+def run_megahit(id, r1_path, r2_path=None, assembly_dir=assembly_dir, config_file="config/config.yaml"):
     logger.info(f"Starting Megahit for {id}")
 
-    command = ["../../../users/marik2/apps/MEGAHIT-1.2.9-Linux-x86_64-static/bin/megahit", "-r", r1_path, "-o", f"assemblies/{id}_megahit/"]  
+    megahit = tool_path("megahit", config_file)
+    command = [megahit, "-r", r1_path, "-o", f"{assembly_dir}/{id}_megahit/"]
     if r2_path:
-        command = ["../../../users/marik2/apps/MEGAHIT-1.2.9-Linux-x86_64-static/bin/megahit", "-1", r1_path, "-2", r2_path, "-o", f"assemblies/{id}_megahit/"]
+        command = [megahit, "-1", r1_path, "-2", r2_path, "-o", f"{assembly_dir}/{id}_megahit/"]
 
     logger.debug(f"Running command: {' '.join(command)}")
 
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        logger.info(f"Megahit completed for {id}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Megahit failed for {id}: {e.stderr}")
+    result = subprocess.run(command, capture_output=True, text=True)
 
     with open(f"{log_dir}/{id}_Megahit_processed_output.log", "w") as f_out:
         f_out.write(result.stdout)
     with open(f"{log_dir}/{id}_Megahit_processed_error.log", "w") as f_err:
         f_err.write(result.stderr)
 
-    if result.returncode == 0:
-        logger.info(f"Successfully processed {id}")
-    else:
+    if result.returncode != 0:
         logger.error(f"Megahit processing failed for {id} with return code {result.returncode}")
+        raise subprocess.CalledProcessError(result.returncode, command)
+    logger.info(f"Successfully processed {id}")
+
+def main(seq_dir, max_workers=4, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    os.makedirs(assembly_dir, exist_ok=True)
 
-def main(seq_dir, max_workers=4):
     ids = get_ids(seq_dir)
     if not ids:
         logger.error("No IDs found. Exiting.")
@@ -104,7 +87,8 @@ def main(seq_dir, max_workers=4):
         return
 
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(run_megahit, id, *paths): id for id, paths in results.items()}
+        futures = {executor.submit(run_megahit, id, *paths, assembly_dir, config_file): id
+                   for id, paths in results.items()}
 
         for future in as_completed(futures):
             id = futures[future]
@@ -114,5 +98,7 @@ def main(seq_dir, max_workers=4):
                 logger.error(f"Megahit processing failed for {id}: {e}")
 
 if __name__ == "__main__":
+    setup_logging("megahit_processed.log", level=logging.DEBUG)
+
     seq_dir = './bbduk_processed/'
     main(seq_dir, max_workers=2)
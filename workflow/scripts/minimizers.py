@@ -0,0 +1,297 @@
+"""Minimizer -> taxon index of the lichen reference database.
+
+The index is built once from the group FASTA files under ref/lichendb
+(<phylum>/<group>/concatenated_genomes.fa[.gz]) and stored as three files:
+  keys.npy       sorted uint64 minimizer hashes
+  taxa.npy       uint32 taxon of each minimizer
+  taxonomy.json  the taxon tree (names, parents, roles) and the k-mer parameters
+The arrays are memory-mapped when loaded, so classification workers on a node
+share one copy through the page cache, and lookups are vectorised binary searches.
+
+Each contig's taxon is the lineage of its genome when the accession prefix of
+its name (`>GCA_...|contig`, from build_lichen_db.py) is in the lineage table
+written by databases/scripts/lichen_groups.py; otherwise it is the group
+directory (phylum/class). A minimizer found in several taxa is assigned their
+lowest common ancestor (LCA).
+
+Minimizers are the smallest canonical k-mer hash in each window of `window`
+consecutive k-mers. Hashing and window minima are computed with NumPy over
+whole sequences (or batches of reads) at once.
+
+Usage: python minimizers.py build [--config config/config.yaml]
+"""
+import os
+import csv
+import json
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from compression import open_input
+from pipeline_config import get_section, setup_logging
+from work_queue import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `classify` section of config/config.yaml
+CLASSIFY_DEFAULTS = {
+    "lichendb": "../ref/lichendb",
+    "db": "../ref/lichendb/minimizers",
+    "lineages": "",          # scaffold_reference_genomes_lineages.csv from databases/scripts/lichen_groups.py
+    "k": 31,
+    "window": 32,            # k-mers per minimizer window
+    "roles": {
+        "mycobiont": ["Ascomycota", "Basidiomycota"],
+        "photobiont": ["Chlorophyta", "Cyanobacteriota", "Cyanobacteria"],
+    },
+    "workers": os.cpu_count() or 1,
+    "batch_reads": 50000,
+    "min_hits": 2,           # minimizer hits supporting a read's taxon
+    "output_dir": "./classified",
+}
+
+MAX_HASH = np.uint64(0xFFFFFFFFFFFFFFFF)  # marks k-mers containing N
+CHUNK = 1 << 22          # bases hashed at a time when indexing long contigs
+REDUCE_EVERY = 1 << 26   # minimizers collected before merging duplicates
+
+# A, C, G, T (either case) -> 0-3; anything else -> 4
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _CODES[_base] = _CODES[_base + 32] = _code
+
+
+def encode(sequence):
+    return _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def kmer_hashes(codes, k):
+    """Hash of the canonical k-mer starting at each position; MAX_HASH where the k-mer contains N."""
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    bases = (codes & 3).astype(np.uint64)
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        window = bases[j:j + n]
+        forward = (forward << np.uint64(2)) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * j)
+    with np.errstate(over="ignore"):
+        # splitmix64 finaliser
+        x = np.minimum(forward, reverse) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    x[(invalid[k:] - invalid[:-k]) != 0] = MAX_HASH
+    return x
+
+
+def window_minima(hashes, window):
+    """Minimum of every run of `window` consecutive hashes (van Herk/Gil-Werman, O(n))."""
+    n = len(hashes)
+    if n < window:
+        return hashes[:0] if n == 0 else hashes.min(keepdims=True)
+    padded = np.concatenate([hashes, np.full(-n % window, MAX_HASH, dtype=np.uint64)]).reshape(-1, window)
+    prefix = np.minimum.accumulate(padded, axis=1).ravel()
+    suffix = np.minimum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    count = n - window + 1
+    return np.minimum(suffix[:count], prefix[window - 1:window - 1 + count])
+
+
+def read_fasta(fasta_file):
+    """Yield (header, sequence) bytes for each record of a plain or gzipped FASTA."""
+    with open_input(fasta_file) as f:
+        header, lines = None, []
+        for line in f:
+            if line.startswith(b">"):
+                if header is not None:
+                    yield header, b"".join(lines)
+                header, lines = line[1:].rstrip(), []
+            else:
+                lines.append(line.rstrip())
+        if header is not None:
+            yield header, b"".join(lines)
+
+
+class Taxonomy:
+    """Taxon tree built from lineage paths, with vectorised lowest-common-ancestor lookups. Node 0 is the root."""
+
+    def __init__(self, names, parents, roles):
+        self.names, self.parents, self.roles = names, parents, roles
+        self.ids = {}
+        depth = [0] * len(names)
+        paths = [()] * len(names)
+        for node in range(1, len(names)):
+            paths[node] = paths[parents[node]] + (names[node],)
+            depth[node] = depth[parents[node]] + 1
+            self.ids[paths[node]] = node
+        self.ids[()] = 0
+        self.paths = paths
+        self.depth = np.array(depth, dtype=np.int32)
+        # ancestors[node, d] is the node's ancestor at depth d (-1 below the node)
+        self.ancestors = np.full((len(names), self.depth.max() + 1), -1, dtype=np.int32)
+        for node in range(len(names)):
+            current = node
+            for d in range(depth[node], -1, -1):
+                self.ancestors[node, d] = current
+                current = parents[current]
+
+    @classmethod
+    def from_paths(cls, paths, role_taxa):
+        names, parents, ids = ["root"], [0], {(): 0}
+        for path in sorted(set(paths)):
+            for depth in range(1, len(path) + 1):
+                if path[:depth] not in ids:
+                    ids[path[:depth]] = len(names)
+                    names.append(path[depth - 1])
+                    parents.append(ids[path[:depth - 1]])
+        role_of = {taxon: role for role, taxa in role_taxa.items() for taxon in taxa}
+        roles = ["other"] * len(names)
+        for path, node in ids.items():
+            roles[node] = next((role_of[name] for name in reversed(path) if name in role_of), "other")
+        return cls(names, parents, roles)
+
+    def node(self, path):
+        return self.ids[tuple(path)]
+
+    def lineage(self, node):
+        return ";".join(self.paths[node])
+
+    def lca(self, a, b):
+        """Lowest common ancestors of two arrays of nodes."""
+        ancestors = self.ancestors
+        shared = np.cumprod((ancestors[a] == ancestors[b]) & (ancestors[a] >= 0), axis=1).sum(axis=1)
+        return ancestors[a, shared - 1]
+
+    def to_dict(self):
+        return {"names": self.names, "parents": self.parents, "roles": self.roles}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["names"], data["parents"], data["roles"])
+
+
+def reduce_lca(keys, taxa, taxonomy):
+    """Collapse repeated keys to one entry each, with the LCA of their taxa. Returns sorted (keys, taxa)."""
+    order = np.argsort(keys, kind="stable")
+    keys, taxa = keys[order], taxa[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    lengths = np.diff(np.append(starts, len(keys)))
+    merged = taxa[starts].copy()
+    for offset in range(1, int(lengths.max()) if len(lengths) else 0):
+        runs = np.flatnonzero(lengths > offset)
+        merged[runs] = taxonomy.lca(merged[runs], taxa[starts[runs] + offset])
+    return keys[starts], merged
+
+
+def read_lineages(lineage_csv):
+    """{accession: lineage path} from lichen_groups.py's merged table (accession first, Rfmt_Lineage k;p;c;o;f;g;s)."""
+    lineages = {}
+    if not lineage_csv:
+        return lineages
+    with open(lineage_csv, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        column = header.index("Rfmt_Lineage")
+        for row in reader:
+            # Drop the superkingdom so paths line up with the phylum/group directories
+            path = tuple(rank for rank in row[column].split(";")[1:] if rank)
+            if path:
+                lineages[row[0]] = path
+    return lineages
+
+
+def group_files(lichendb):
+    """{FASTA path: group path (directories below lichendb)} for each group's concatenated genomes."""
+    root = Path(lichendb)
+    return {path: path.parent.relative_to(root).parts
+            for pattern in ("concatenated_genomes.fa", "concatenated_genomes.fa.gz")
+            for path in sorted(root.rglob(pattern))}
+
+
+def index_file(fasta_file, group_path, lineages, taxonomy, k, window):
+    """Minimizers of one group FASTA with their (LCA-resolved) taxa."""
+    fallback = taxonomy.node(group_path)
+    keys, taxa, collected = [], [], 0
+    overlap = k + window - 2
+    for header, sequence in read_fasta(fasta_file):
+        accession = header.split(b"|", 1)[0].decode() if b"|" in header else None
+        node = taxonomy.node(lineages[accession]) if accession in lineages else fallback
+        for start in range(0, max(len(sequence) - overlap, 1), CHUNK):
+            minima = window_minima(kmer_hashes(encode(sequence[start:start + CHUNK + overlap]), k), window)
+            minima = np.unique(minima[minima != MAX_HASH])
+            keys.append(minima)
+            taxa.append(np.full(len(minima), node, dtype=np.uint32))
+            collected += len(minima)
+        if collected > REDUCE_EVERY:
+            merged_keys, merged_taxa = reduce_lca(np.concatenate(keys), np.concatenate(taxa), taxonomy)
+            keys, taxa, collected = [merged_keys], [merged_taxa], len(merged_keys)
+    if not keys:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32)
+    return reduce_lca(np.concatenate(keys), np.concatenate(taxa), taxonomy)
+
+
+def build_index(settings):
+    """Build the minimizer index of the lichen database into settings["db"]."""
+    files = group_files(settings["lichendb"])
+    if not files:
+        raise FileNotFoundError(f"No concatenated_genomes.fa[.gz] found under {settings['lichendb']}")
+    lineages = read_lineages(settings["lineages"])
+    taxonomy = Taxonomy.from_paths([*files.values(), *lineages.values()], settings["roles"] or {})
+
+    keys = np.empty(0, dtype=np.uint64)
+    taxa = np.empty(0, dtype=np.uint32)
+    with ProcessPoolExecutor(max_workers=min(settings["workers"], len(files))) as executor:
+        futures = {executor.submit(index_file, path, group, lineages, taxonomy, settings["k"], settings["window"]): path
+                   for path, group in files.items()}
+        for future in as_completed(futures):
+            file_keys, file_taxa = future.result()
+            keys, taxa = reduce_lca(np.concatenate([keys, file_keys]), np.concatenate([taxa, file_taxa]), taxonomy)
+            logger.info(f"Indexed {futures[future]} ({len(file_keys)} minimizers)")
+
+    db_dir = Path(settings["db"])
+    db_dir.mkdir(parents=True, exist_ok=True)
+    np.save(db_dir / "keys.tmp.npy", keys)
+    np.save(db_dir / "taxa.tmp.npy", taxa)
+    meta = {"k": settings["k"], "window": settings["window"], "taxonomy": taxonomy.to_dict()}
+    (db_dir / "taxonomy.tmp.json").write_text(json.dumps(meta))
+    for name in ("keys.npy", "taxa.npy", "taxonomy.json"):
+        stem, suffix = name.split(".")
+        os.replace(db_dir / f"{stem}.tmp.{suffix}", db_dir / name)
+    logger.info(f"Minimizer index: {len(keys)} minimizers, {len(taxonomy.names)} taxa in {db_dir}")
+
+
+def load_index(db_dir):
+    """Returns (keys, taxa, taxonomy, k, window) with the arrays memory-mapped."""
+    db_dir = Path(db_dir)
+    meta = json.loads((db_dir / "taxonomy.json").read_text())
+    return (np.load(db_dir / "keys.npy", mmap_mode="r"), np.load(db_dir / "taxa.npy", mmap_mode="r"),
+            Taxonomy.from_dict(meta["taxonomy"]), meta["k"], meta["window"])
+
+
+def ensure_index(settings):
+    """Build the index unless it exists; concurrent callers wait for one build."""
+    db_dir = Path(settings["db"])
+    if (db_dir / "taxonomy.json").is_file():
+        return
+    db_dir.mkdir(parents=True, exist_ok=True)
+    with file_lock(db_dir / ".lock"):
+        if not (db_dir / "taxonomy.json").is_file():
+            build_index(settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the minimizer -> taxon index of the lichen database.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--config", default="config/config.yaml")
+    args = parser.parse_args(argv)
+    build_index(get_section("classify", CLASSIFY_DEFAULTS, args.config))
+
+
+if __name__ == "__main__":
+    setup_logging("minimizers.log")
+    main()
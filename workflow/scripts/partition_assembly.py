@@ -0,0 +1,221 @@
+"""Split each sample's reads into taxon bins and assemble the bins separately and concurrently.
+
+Reads are binned by their minimizer classification against the lichen reference
+database (classify_reads.py, using the `classify` index and role settings):
+mycobiont, photobiont and residual (other and unclassified reads). Each bin is
+much smaller and less mixed than the whole sample, so the bins assemble faster
+and in less memory, and run at the same time.
+
+The sample's assembler is chosen as in assembler_router.py, for single-end
+input (megahit or IDBA-UD), and recorded in assembler_choices.tsv. Each bin is
+assembled as `<ID>_<bin>`; bins with fewer than `min_bin_reads` reads are not
+assembled and their reads are left for bwa_unassembled.py to collect. The bin
+contigs are then merged, with headers prefixed by their bin (`>mycobiont|k141_1`),
+into the sample's usual assembly file (e.g. assemblies/<ID>_megahit/final.contigs.fa),
+so `bwa_unassembled.py` finds and concatenates it as before. Bins whose assembly
+fails are left out of the merged file and marked failed in <ID>_bins.tsv; the
+sample fails if no bin assembled.
+
+Outputs, per sample in the output directory:
+  <ID>_<bin>_reads.fa  reads of each bin
+  <ID>_bins.tsv        reads, bases, assembled contigs and status per bin
+"""
+import os
+import pathlib
+import logging
+import importlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from assembler_router import ROUTING_DEFAULTS, choose_assembler, free_memory_bytes, measure_reads, \
+    record_assembler_choices
+from bwa_unassembled import find_assembly_file
+from classify_reads import UNCLASSIFIED, _load_index, classify_batch, get_ids_and_files, read_batches
+from minimizers import CLASSIFY_DEFAULTS, ensure_index, load_index
+from pipeline_config import get_section, setup_logging
+from work_queue import get_work_queue
+
+logger = logging.getLogger(__name__)
+
+assembly_dir = "./assemblies"
+
+# Defaults for the `partition` section of config/config.yaml
+PARTITION_DEFAULTS = {
+    "output_dir": "./partitioned_reads",
+    "min_bin_reads": 10000,   # smaller bins are not assembled
+    "parallel_bins": 3,       # bin assemblies run at once per sample
+}
+
+BINS = ["mycobiont", "photobiont", "residual"]
+# Assembly file each assembler writes, for the merged contigs
+ASSEMBLY_FILES = {"megahit": "final.contigs.fa", "idba_ud": "contig.fa"}
+
+
+def bin_of(taxon, taxonomy):
+    role = "unclassified" if taxon == UNCLASSIFIED else taxonomy.roles[taxon]
+    return role if role in BINS else "residual"
+
+
+def partition_reads(id, reads_file, output_dir, classify_settings, executor):
+    """Write the sample's reads to one FASTA per bin. Returns {bin: (path, reads, bases)}."""
+    taxonomy = load_index(classify_settings["db"])[2]
+    paths = {name: pathlib.Path(output_dir) / f"{id}_{name}_reads.fa" for name in BINS}
+    counts = {name: [0, 0] for name in BINS}
+    handles = {name: open(path.with_suffix(".fa.tmp"), "w") for name, path in paths.items()}
+
+    def write(sequences, labels):
+        lines = {name: [] for name in BINS}
+        for sequence, (read, taxon, _, _) in zip(sequences, labels):
+            name = bin_of(taxon, taxonomy)
+            lines[name].append(f">{read}\n{sequence.decode()}\n")
+            counts[name][0] += 1
+            counts[name][1] += len(sequence)
+        for name, chunk in lines.items():
+            handles[name].write("".join(chunk))
+
+    try:
+        # Keep a bounded number of batches in flight so the reads are never all in memory
+        pending = deque()
+        for names, sequences in read_batches(reads_file, classify_settings["batch_reads"]):
+            pending.append((sequences, executor.submit(classify_batch, names, sequences,
+                                                       classify_settings["min_hits"])))
+            if len(pending) >= 2 * classify_settings["workers"]:
+                sequences, future = pending.popleft()
+                write(sequences, future.result())
+        while pending:
+            sequences, future = pending.popleft()
+            write(sequences, future.result())
+    finally:
+        for handle in handles.values():
+            handle.close()
+    for path in paths.values():
+        os.replace(path.with_suffix(".fa.tmp"), path)
+    return {name: (paths[name], *counts[name]) for name in BINS}
+
+
+def choose_sample_assembler(id, reads_file, routing, assembly_dir=assembly_dir):
+    """Route the whole sample as single-end input, since bins are not paired, and record the choice."""
+    if routing["assembler"] == "metaspades":
+        logger.warning(f"{id}: metaSPAdes needs read pairs; assembling bins with megahit")
+        routing = {**routing, "assembler": "megahit"}
+    metrics = measure_reads(reads_file, routing["kmer_size"], routing["sketch_size"], routing["sketch_reads"])
+    free_memory = free_memory_bytes()
+    assembler = choose_assembler(metrics, routing, free_memory, has_pairs=False)
+    record_assembler_choices([{"ID": id, "assembler": assembler, "free_memory": free_memory, **metrics}], assembly_dir)
+    return assembler
+
+
+def assemble_bin(bin_id, assembler, fasta_file, assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    """Assemble one bin; the bins are FASTA, which megahit and IDBA-UD both read directly."""
+    if assembler == "megahit":
+        importlib.import_module("megahit_assembly").run_megahit(bin_id, fasta_file, None, assembly_dir, config_file)
+    else:
+        importlib.import_module("idba-ud_assembly").run_idba_ud(bin_id, fasta_file, assembly_dir, config_file)
+
+
+def merge_contigs(id, assembler, bins, assembly_dir=assembly_dir):
+    """Merge the bin assemblies into the sample's assembly file with bin-tagged headers. Returns contigs per bin.
+
+    Bins without an assembly file are left out of the result; if none has one, nothing
+    is written and FileNotFoundError is raised.
+    """
+    merged = pathlib.Path(f"{assembly_dir}/{id}_{assembler}/{ASSEMBLY_FILES[assembler]}")
+    merged.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = merged.with_suffix(".tmp")
+    contigs = {}
+    with open(tmp_file, "w") as out:
+        for name in bins:
+            bin_assembly = find_assembly_file(assembler, f"{id}_{name}", assembly_dir)
+            if bin_assembly is None:
+                continue
+            contigs[name] = 0
+            with open(bin_assembly) as f:
+                for line in f:
+                    if line.startswith(">"):
+                        line = f">{name}|{line[1:]}"
+                        contigs[name] += 1
+                    out.write(line)
+    if not contigs:
+        tmp_file.unlink()
+        raise FileNotFoundError(f"No bin assembly found for {id} ({', '.join(bins) or 'no bins assembled'})")
+    os.replace(tmp_file, merged)
+    logger.info(f"{id}: merged {sum(contigs.values())} contigs from {len(contigs)} bins into {merged}")
+    return contigs
+
+
+def partition_sample(id, reads_file, settings, classify_settings, routing, executor=None,
+                     assembly_dir=assembly_dir, config_file="config/config.yaml"):
+    """Bin, assemble and merge one sample."""
+    ensure_index(classify_settings)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=classify_settings["workers"], initializer=_load_index,
+                                       initargs=(classify_settings["db"],))
+    try:
+        bins = partition_reads(id, reads_file, settings["output_dir"], classify_settings, executor)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    logger.info(f"{id}: " + ", ".join(f"{name} {reads} reads" for name, (_, reads, _) in bins.items()))
+
+    assembler = choose_sample_assembler(id, reads_file, routing, assembly_dir)
+    to_assemble = [name for name, (_, reads, _) in bins.items() if reads >= settings["min_bin_reads"]]
+    with ThreadPoolExecutor(max_workers=settings["parallel_bins"]) as bin_executor:
+        futures = {name: bin_executor.submit(assemble_bin, f"{id}_{name}", assembler, str(bins[name][0]),
+                                               assembly_dir, config_file)
+                   for name in to_assemble}
+        failed = set()
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Assembly of the {name} bin failed for {id}: {e}")
+                failed.add(name)
+    try:
+        contigs = merge_contigs(id, assembler, [name for name in to_assemble if name not in failed], assembly_dir)
+    except FileNotFoundError as e:
+        logger.error(str(e))
+        contigs = {}
+    failed.update(name for name in to_assemble if name not in contigs)
+
+    with open(pathlib.Path(settings["output_dir"]) / f"{id}_bins.tsv", "w") as out:
+        out.write("bin\treads\tbases\tcontigs\tstatus\n")
+        for name, (_, reads, bases) in bins.items():
+            status = "failed" if name in failed else "assembled" if name in contigs else "too_few_reads"
+            out.write(f"{name}\t{reads}\t{bases}\t{contigs.get(name, 0)}\t{status}\n")
+
+    if not contigs:
+        raise RuntimeError(f"No bin assembled for {id}")
+    if failed:
+        logger.warning(f"{id}: assembly contigs do not include the failed bins: {', '.join(sorted(failed))}")
+
+
+def main(seq_dir, config_file="config/config.yaml", max_workers=2, assembly_dir=assembly_dir):
+    settings = get_section("partition", PARTITION_DEFAULTS, config_file)
+    classify_settings = get_section("classify", CLASSIFY_DEFAULTS, config_file)
+    routing = get_section("assembler_routing", ROUTING_DEFAULTS, config_file)
+    id_to_file = get_ids_and_files(seq_dir)
+    if not id_to_file:
+        logger.error("No input files found. Exiting.")
+        return
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    ensure_index(classify_settings)
+
+    queue = get_work_queue("partition", config_file)
+    # One classification pool shared by the samples; each worker maps the index once
+    with ProcessPoolExecutor(max_workers=classify_settings["workers"], initializer=_load_index,
+                             initargs=(classify_settings["db"],)) as pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {id: executor.submit(queue.run, id, partition_sample, id, reads_file, settings,
+                                       classify_settings, routing, pool, assembly_dir, config_file)
+                   for id, reads_file in id_to_file.items()}
+        for id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Partitioned assembly failed for {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("partition_assembly.log")
+    main('./decontaminated_reads/')
@@ -0,0 +1,70 @@
+import os
+import sys
+import logging
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Default location of the pipeline config, relative to the project directory
+CONFIG_FILE = "config/config.yaml"
+
+log_dir = "./logs"
+
+
+@lru_cache(maxsize=None)
+def _read_config(config_file):
+    config_path = Path(config_file)
+    if not config_path.is_file():
+        logger.warning(f"Config file {config_file} not found. Using defaults.")
+        return {}
+
+    import yaml
+
+    with config_path.open() as f:
+        return yaml.safe_load(f) or {}
+
+
+def load_config(config_file=CONFIG_FILE):
+    """Read the pipeline config file, returning an empty dict if it is missing."""
+    return dict(_read_config(str(Path(config_file).resolve())))
+
+
+def get_section(name, defaults, config_file=CONFIG_FILE):
+    """Return a config section with any missing keys filled in from defaults."""
+    section = dict(defaults)
+    section.update(load_config(config_file).get(name) or {})
+    return section
+
+
+def tool_path(name, config_file=CONFIG_FILE):
+    """Return the executable configured under `tools`, falling back to the bare name on $PATH."""
+    return str((load_config(config_file).get("tools") or {}).get(name, name))
+
+
+def reference_path(name, default, config_file=CONFIG_FILE):
+    """Return a reference file configured under `references`."""
+    return str((load_config(config_file).get("references") or {}).get(name, default))
+
+
+def setup_logging(log_name, level=logging.INFO):
+    """Log to stdout and ./logs/<log_name>, creating the logs directory if needed.
+
+    Called from each script's __main__ (and by lichens.py) rather than at import,
+    so importing a stage module has no side effects.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    if not any(type(h) is logging.StreamHandler for h in root.handlers):
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+        root.addHandler(stream_handler)
+
+    log_file = os.path.abspath(os.path.join(log_dir, log_name))
+    if not any(getattr(h, "baseFilename", None) == log_file for h in root.handlers):
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(formatter)
+        root.addHandler(file_handler)
@@ -0,0 +1,210 @@
+"""Shared, versioned reference bundles (human and PhiX) built once and symlinked into projects.
+
+Each reference is built into <root>/<name>/<version>/ (downloaded, optionally
+decompressed and bwa-indexed) under a lock, so concurrent setups build it once.
+manifest.json is written last and marks a bundle as complete. Projects then get
+symlinks to the bundle's files instead of their own copies.
+
+With `shm: True`, the human bwa index is loaded into shared memory once per node
+(`bwa shm`); every `bwa mem` on that node then uses it instead of loading its own copy.
+
+Usage: python reference_registry.py list
+       python reference_registry.py build human
+       python reference_registry.py link human <project>/ref
+       python reference_registry.py shm human | --drop
+"""
+import os
+import json
+import time
+import gzip
+import shutil
+import argparse
+import subprocess
+import logging
+from functools import lru_cache
+from pathlib import Path
+
+from downloads import download
+from pipeline_config import get_section, setup_logging, tool_path
+from work_queue import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `reference_registry` section of config/config.yaml
+REGISTRY_DEFAULTS = {
+    "root": os.environ.get("LICHENS_REFERENCE_ROOT", str(Path.home() / ".local" / "share" / "lichens_references")),
+    "shm": False,            # load bwa indexes into shared memory for concurrent jobs on a node
+    "references": {},        # extra or overridden catalogue entries
+}
+
+# Built-in references. `file` is the name the pipeline expects (config `references`);
+# gzipped references keep `file` as the bwa index prefix.
+CATALOGUE = {
+    "human": {
+        "version": "GRCh38.p14",
+        "url": "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/405/GCF_000001405.40_GRCh38.p14/GCF_000001405.40_GRCh38.p14_genomic.fna.gz",
+        "file": "GCF_000001405.40_GRCh38.p14_genomic.fna",
+        "decompress": False,
+        "bwa_index": True,
+    },
+    "phix": {
+        "version": "GCA_000819615.1",
+        "url": "ftp://ftp.ncbi.nlm.nih.gov/genomes/genbank/viral/Sinsheimervirus_phiX174/latest_assembly_versions/GCA_000819615.1_ViralProj14015/GCA_000819615.1_ViralProj14015_genomic.fna.gz",
+        "file": "GCA_000819615.1_ViralProj14015_genomic.fna",
+        "decompress": True,
+        "bwa_index": False,
+    },
+}
+
+BWA_INDEX_SUFFIXES = [".amb", ".ann", ".bwt", ".pac", ".sa"]
+SHM_LOCK = "/tmp/lichens_bwa_shm.lock"
+
+
+def settings(config_file="config/config.yaml"):
+    return get_section("reference_registry", REGISTRY_DEFAULTS, config_file)
+
+
+def catalogue(config_file="config/config.yaml"):
+    return {**CATALOGUE, **(settings(config_file)["references"] or {})}
+
+
+def bundle_dir(name, config_file="config/config.yaml"):
+    entry = catalogue(config_file)[name]
+    return Path(settings(config_file)["root"]).expanduser() / name / entry["version"]
+
+
+def bundle_files(entry):
+    """File names in a bundle: the FASTA (gzipped unless decompressed) and any bwa index."""
+    files = [entry["file"] if entry["decompress"] else entry["file"] + ".gz"]
+    if entry["bwa_index"]:
+        files += [entry["file"] + suffix for suffix in BWA_INDEX_SUFFIXES]
+    return files
+
+
+def _decompress(gz_path, out_path):
+    with gzip.open(gz_path, "rb") as src, open(out_path, "wb") as dest:
+        shutil.copyfileobj(src, dest, 1 << 20)
+
+
+def build(name, config_file="config/config.yaml"):
+    """Build a reference bundle if it is not already in the registry. Returns its directory."""
+    entry = catalogue(config_file)[name]
+    final_dir = bundle_dir(name, config_file)
+    if (final_dir / "manifest.json").is_file():
+        return final_dir
+
+    final_dir.parent.mkdir(parents=True, exist_ok=True)
+    with file_lock(final_dir.parent / ".lock"):
+        if (final_dir / "manifest.json").is_file():  # built by another process while we waited
+            return final_dir
+
+        build_dir = final_dir.parent / f".{entry['version']}.{os.getpid()}.tmp"
+        shutil.rmtree(build_dir, ignore_errors=True)
+        build_dir.mkdir()
+        logger.info(f"Building {name} {entry['version']} in {final_dir}")
+        fasta_gz = download(entry["url"], build_dir / (entry["file"] + ".gz"))
+        if entry["decompress"]:
+            _decompress(fasta_gz, build_dir / entry["file"])
+            fasta_gz.unlink()
+        if entry["bwa_index"]:
+            # bwa reads the .gz directly; -p names the index after the uncompressed file
+            subprocess.run([tool_path("bwa", config_file), "index", "-p", str(build_dir / entry["file"]),
+                            str(fasta_gz)], check=True)
+
+        for file in bundle_files(entry):
+            os.chmod(build_dir / file, 0o444)
+        manifest = {"name": name, **entry, "files": bundle_files(entry), "built": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        (build_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        if final_dir.exists():
+            shutil.rmtree(final_dir)  # an incomplete bundle left by an interrupted build
+        os.rename(build_dir, final_dir)
+    logger.info(f"Built {name} {entry['version']}")
+    return final_dir
+
+
+def link(name, dest_dir, config_file="config/config.yaml"):
+    """Build the bundle if needed and symlink its files into dest_dir. Returns the link paths."""
+    source_dir = build(name, config_file)
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    links = []
+    for file in bundle_files(catalogue(config_file)[name]):
+        dest = dest_dir / file
+        if dest.is_symlink():
+            dest.unlink()
+        elif dest.exists():
+            logger.warning(f"{dest} exists and is not a link; leaving it in place")
+            continue
+        dest.symlink_to(source_dir / file)
+        links.append(dest)
+    return links
+
+
+def _shm_loaded(bwa):
+    result = subprocess.run([bwa, "shm", "-l"], capture_output=True, text=True)
+    return {line.split()[0] for line in result.stdout.splitlines() if line.strip()}
+
+
+def load_shm(prefix, config_file="config/config.yaml"):
+    """Load a bwa index into shared memory unless it is already there. Returns True if it is loaded.
+
+    `bwa mem` uses a shared-memory index whose name matches its index prefix, so
+    the callers' commands do not change.
+    """
+    bwa = tool_path("bwa", config_file)
+    prefix = str(Path(prefix).resolve())
+    with file_lock(SHM_LOCK):
+        if Path(prefix).name in _shm_loaded(bwa):
+            return True
+        logger.info(f"Loading bwa index {prefix} into shared memory")
+        result = subprocess.run([bwa, "shm", prefix], capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.warning(f"Could not load {prefix} into shared memory (is /dev/shm large enough?): "
+                           f"{result.stderr.strip()}")
+            return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def prepare_bwa_index(prefix, config_file="config/config.yaml"):
+    """Called before `bwa mem`: loads the index into shared memory once per process if `shm` is on."""
+    if settings(config_file)["shm"]:
+        return load_shm(prefix, config_file)
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and share reference indexes.")
+    parser.add_argument("--config", default="config/config.yaml")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List catalogue entries and whether they are built.")
+    build_parser = subparsers.add_parser("build", help="Build a reference bundle in the registry.")
+    build_parser.add_argument("name")
+    link_parser = subparsers.add_parser("link", help="Symlink a reference bundle into a directory.")
+    link_parser.add_argument("name")
+    link_parser.add_argument("dest_dir")
+    shm_parser = subparsers.add_parser("shm", help="Load a bwa index into shared memory on this node.")
+    shm_parser.add_argument("name", nargs="?")
+    shm_parser.add_argument("--drop", action="store_true", help="Remove all bwa indexes from shared memory.")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, entry in catalogue(args.config).items():
+            built = (bundle_dir(name, args.config) / "manifest.json").is_file()
+            print(f"{name}\t{entry['version']}\t{'built' if built else 'not built'}\t{bundle_dir(name, args.config)}")
+    elif args.command == "build":
+        print(build(args.name, args.config))
+    elif args.command == "link":
+        for path in link(args.name, args.dest_dir, args.config):
+            print(path)
+    elif args.drop:
+        subprocess.run([tool_path("bwa", args.config), "shm", "-d"], check=True)
+    else:
+        entry = catalogue(args.config)[args.name]
+        if not load_shm(bundle_dir(args.name, args.config) / entry["file"], args.config):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    setup_logging("reference_registry.log")
+    main()
@@ -0,0 +1,110 @@
+import os
+import csv
+import json
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Parsed sheets are cached here, one file per sheet content hash
+CACHE_DIR = Path(os.environ.get("SAMPLE_SHEET_CACHE", Path.home() / ".cache" / "lichens_sample_sheets"))
+
+# In-process cache so repeated lookups in one run skip even the JSON load
+_tables = {}
+
+
+def file_hash(file_path):
+    """Return the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _clean(value):
+    """Turn a cell into a string, mapping blanks/NaN to None and 12.0 to '12'."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _parse_excel(file_path):
+    import pandas as pd
+
+    df = pd.read_excel(file_path, dtype=object)
+    return {str(col): [_clean(v) for v in df[col].tolist()] for col in df.columns}
+
+
+def _parse_delimited(file_path, delimiter):
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        if len(delimiter) == 1:
+            reader = csv.reader(f, delimiter=delimiter)
+        else:
+            # csv only takes one-character delimiters; split plain lines on longer ones
+            reader = (line.rstrip("\r\n").split(delimiter) for line in f if line.strip())
+        header = next(reader, [])
+        columns = {name: [] for name in header}
+        for row in reader:
+            row = row + [None] * (len(header) - len(row))
+            for name, value in zip(header, row):
+                columns[name].append(_clean(value))
+    return columns
+
+
+def _write_cache(cache_file, table):
+    # Write to a temporary file and rename, so concurrent scripts never read a partial cache
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(table, f)
+    os.replace(tmp_name, cache_file)
+
+
+def load_table(file_path, delimiter=","):
+    """Return the sheet as {column name: list of values}, parsing it at most once per content."""
+    file_path = Path(file_path)
+    if not file_path.is_file():
+        logger.error(f"Error: The file '{file_path}' does not exist.")
+        return None
+
+    # Excel sheets ignore the delimiter; any delimiter string is hashed into a file-name-safe key
+    delimiter_key = "xlsx" if file_path.suffix == ".xlsx" else hashlib.sha256(delimiter.encode()).hexdigest()[:16]
+    key = f"{file_hash(file_path)}_{delimiter_key}"
+    if key in _tables:
+        return _tables[key]
+
+    cache_file = CACHE_DIR / f"{key}.json"
+    try:
+        with cache_file.open() as f:
+            table = json.load(f)
+        logger.debug(f"Loaded cached sample sheet for '{file_path}'")
+    except (OSError, ValueError):
+        if file_path.suffix == ".xlsx":
+            table = _parse_excel(file_path)
+        else:
+            table = _parse_delimited(file_path, delimiter)
+        _write_cache(cache_file, table)
+        logger.info(f"Parsed and cached sample sheet '{file_path}'")
+
+    _tables[key] = table
+    return table
+
+
+def get_ids(file_path, column_name, delimiter=","):
+    """Return the non-empty values of one column as a list of strings."""
+    table = load_table(file_path, delimiter)
+    if table is None:
+        return []
+    if column_name not in table:
+        logger.error(f"Column '{column_name}' not found in '{file_path}'. Columns: {list(table)}")
+        return []
+    return [value for value in table[column_name] if value is not None]
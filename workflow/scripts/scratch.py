@@ -0,0 +1,120 @@
+import os
+import atexit
+import shutil
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `scratch` section of config/config.yaml
+SCRATCH_DEFAULTS = {
+    "dirs": ["$TMPDIR"],  # tried in order; unset variables are skipped
+    "quota_gb": 100,      # total scratch all running samples may reserve
+    "min_free_gb": 5,     # always leave this much free on a scratch filesystem
+    "size_factor": 3,     # scratch needed per byte of sample input
+}
+
+GB = 1024 ** 3
+
+
+class ScratchManager:
+    """Hands out per-sample scratch directories on node-local storage within a quota.
+
+    reserve() blocks while the quota is used up, so extra samples wait for running
+    ones to finish instead of filling the disk. Directories are removed when the
+    sample finishes, whether it succeeded or failed.
+    """
+
+    def __init__(self, dirs, quota_bytes, min_free_bytes, size_factor=3):
+        self.roots = [Path(d) for d in (os.path.expandvars(str(d)) for d in dirs)
+                      if "$" not in d and os.path.isdir(d) and os.access(d, os.W_OK)]
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.size_factor = size_factor
+        self.reserved = 0
+        self.active = set()
+        self.condition = threading.Condition()
+        atexit.register(self.cleanup)
+
+    def estimate(self, *input_files):
+        """Scratch bytes needed for a sample, from the size of its inputs."""
+        return int(sum(os.path.getsize(f) for f in input_files if os.path.exists(f)) * self.size_factor)
+
+    def _pick_root(self, nbytes):
+        for root in self.roots:
+            if shutil.disk_usage(root).free - nbytes >= self.min_free_bytes:
+                return root
+        return None
+
+    @contextmanager
+    def reserve(self, id, nbytes, fallback_dir):
+        """Yield a scratch directory for one sample, waiting for quota if necessary.
+
+        Falls back to a directory under fallback_dir (the project filesystem) when
+        no scratch location is configured or large enough.
+        """
+        nbytes = int(nbytes)
+        root = None
+        with self.condition:
+            if self.roots:
+                # Wait for running samples to free quota or disk space. With nothing else
+                # reserved a sample runs anyway, on the fallback dir if no root has room.
+                self.condition.wait_for(
+                    lambda: self.reserved == 0 or (self.reserved + nbytes <= self.quota_bytes
+                                                   and self._pick_root(nbytes) is not None)
+                )
+                root = self._pick_root(nbytes)
+            if root is not None:
+                self.reserved += nbytes
+
+        if root is None:
+            logger.warning(f"No local scratch with {nbytes / GB:.1f} GB free for {id}; using {fallback_dir}")
+            root = Path(fallback_dir)
+            root.mkdir(parents=True, exist_ok=True)
+            nbytes = 0
+
+        work_dir = Path(tempfile.mkdtemp(prefix=f"{id}_", dir=root))
+        self.active.add(work_dir)
+        logger.info(f"Using scratch directory {work_dir} for {id}")
+        try:
+            yield work_dir
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            self.active.discard(work_dir)
+            with self.condition:
+                self.reserved -= nbytes
+                self.condition.notify_all()
+
+    def cleanup(self):
+        """Remove scratch directories left behind by an interrupted run."""
+        for work_dir in list(self.active):
+            shutil.rmtree(work_dir, ignore_errors=True)
+            self.active.discard(work_dir)
+
+
+def stage_out(src, dest):
+    """Move a finished file from scratch to its final location on the project filesystem."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(src), str(dest))
+    return dest
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_scratch_manager(config_file="config/config.yaml"):
+    """Return the process-wide scratch manager, so all stages share one quota."""
+    with _managers_lock:
+        if config_file not in _managers:
+            settings = get_section("scratch", SCRATCH_DEFAULTS, config_file)
+            _managers[config_file] = ScratchManager(
+                settings["dirs"], settings["quota_gb"] * GB, settings["min_free_gb"] * GB, settings["size_factor"]
+            )
+        return _managers[config_file]
@@ -1,35 +1,17 @@
 import pathlib
 import csv
 import logging
-import pandas as pd
-import os
 import subprocess
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Set up logger
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-def xlsx2csv(file_path):
-    if not pathlib.Path(file_path).is_file():
-        logger.error(f"Error: The file '{file_path}' does not exist.")
-        return None
-
-    xlsx_read = pd.read_excel(file_path)
-    csv_name = pathlib.Path(file_path).stem
-    dirname = os.path.dirname(file_path)
-    csv_file_path = f"{dirname}/{csv_name}.csv"
-    xlsx_read.to_csv(csv_file_path, index=None, header=True)
-    logger.info(f"Successfully converted '{file_path}' to '{csv_file_path}'")
-    return csv_file_path
+from pipeline_config import log_dir, setup_logging, tool_path
+from sample_sheet import get_ids
 
-def get_ids(file_path, column_name, delimiter=','):
-    df = pd.read_csv(file_path, delimiter=delimiter)
-    return df[column_name].tolist()
+logger = logging.getLogger(__name__)
 
-def seqkit_cleanup(project_dir, id, direction):
+def seqkit_cleanup(project_dir, id, direction, config_file="config/config.yaml"):
     command = [
-        "seqkit", "sana",
+        tool_path("seqkit", config_file), "sana",
         f"{project_dir}/{id}.{direction}.fastq",
         "-o",
         f"{project_dir}/{id}.{direction}.sanitised.fastq"
@@ -37,9 +19,9 @@ def seqkit_cleanup(project_dir, id, direction):
 
     result = subprocess.run(command, capture_output=True, text=True)
 
-    with open(f"logs/{id}_seqkit_cleanup_output.log", "w") as f_out:
+    with open(f"{log_dir}/{id}_seqkit_cleanup_output.log", "w") as f_out:
         f_out.write(result.stdout)
-    with open(f"logs/{id}_seqkit_cleanup_error.log", "w") as f_err:
+    with open(f"{log_dir}/{id}_seqkit_cleanup_error.log", "w") as f_err:
         f_err.write(result.stderr)
 
     logger.info(f"Sanitized {id} in {direction} direction")
@@ -72,34 +54,30 @@ def find_files(project_dir, ids):
 
     return results
 
-def seqkit_pair(id, r1_path, r2_path):
+def seqkit_pair(id, r1_path, r2_path, config_file="config/config.yaml"):
     command = [
-        "seqkit", "pair",
+        tool_path("seqkit", config_file), "pair",
         "-1", r1_path,
         "-2", r2_path
     ]
 
     result = subprocess.run(command, capture_output=True, text=True)
 
-    with open(f"logs/{id}_seqkit_pair_output.log", "w") as f_out:
+    with open(f"{log_dir}/{id}_seqkit_pair_output.log", "w") as f_out:
         f_out.write(result.stdout)
-    with open(f"logs/{id}_seqkit_pair_error.log", "w") as f_err:
+    with open(f"{log_dir}/{id}_seqkit_pair_error.log", "w") as f_err:
         f_err.write(result.stderr)
 
     logger.info(f"Paired reads for {id}")
 
-def main(input_file, column_name, project_dir):
-    logs_dir = pathlib.Path("logs")
-    logs_dir.mkdir(parents=True, exist_ok=True)
-    
-# Step 1: Check and convert .xlsx to .csv if necessary
-    if input_file.endswith(".xlsx"):
-        input_file = xlsx2csv(input_file)
-        if input_file is None:
-            return
-
-    # Step 2: Extract IDs from the CSV file
+def main(input_file, column_name, project_dir, config_file="config/config.yaml"):
+    pathlib.Path(log_dir).mkdir(parents=True, exist_ok=True)
+
+    # Steps 1-2: Extract IDs from the .xlsx or .csv sample sheet
     ids = get_ids(input_file, column_name)
+    if not ids:
+        logger.error("No IDs found in input file. Exiting.")
+        return
 
     # Step 3: Run seqkit_cleanup for each ID in both directions
     directions = ["1", "2"]
@@ -107,7 +85,7 @@ def main(input_file, column_name, project_dir):
     with ThreadPoolExecutor() as executor:
         for id in ids:
             for direction in directions:
-                cleanup_futures.append(executor.submit(seqkit_cleanup, project_dir, id, direction))
+                cleanup_futures.append(executor.submit(seqkit_cleanup, project_dir, id, direction, config_file))
         for future in as_completed(cleanup_futures):
             future.result()  # Ensure all cleanups are complete before proceeding
 
@@ -118,11 +96,13 @@ def main(input_file, column_name, project_dir):
     pair_futures = []
     with ThreadPoolExecutor() as executor:
         for id, (r1_path, r2_path) in paired_files.items():
-            pair_futures.append(executor.submit(seqkit_pair, id, r1_path, r2_path))
+            pair_futures.append(executor.submit(seqkit_pair, id, r1_path, r2_path, config_file))
         for future in as_completed(pair_futures):
             future.result()  # Ensure all pairing is complete
 
 if __name__ == "__main__":
+    setup_logging("seqkit_cleanup.log")
+
     input_file = "./Batch_1_Lichen_Tracking_Sheet.csv"  # Replace with your input file path
     column_name = "Novogene_Sub_Library_Name"  # Replace with the column name containing IDs
     project_dir = "./demultiplexed"  # Replace with your project directory
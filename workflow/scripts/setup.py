@@ -3,6 +3,12 @@ from pathlib import Path
 import subprocess
 import zipfile
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import reference_registry
+from archives import FASTA_PATTERNS, extract_zips
+from checksums import verify_md5_file
+from downloads import download_all
 ##requires: bwa 
 
 # Helper functions
@@ -33,77 +39,59 @@ create_dir(project_dir)
 create_dir(ref_dir)
 create_dir(lichen_db_dir)
 
-# URLs and file paths
-HUMAN_GENOME_URL = "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/405/GCF_000001405.40_GRCh38.p14/GCF_000001405.40_GRCh38.p14_genomic.fna.gz"
-PHAGE_GENOME_URL = "ftp://ftp.ncbi.nlm.nih.gov/genomes/genbank/viral/Sinsheimervirus_phiX174/latest_assembly_versions/GCA_000819615.1_ViralProj14015/GCA_000819615.1_ViralProj14015_genomic.fna.gz"
+# URLs and file paths (the human and PhiX references come from reference_registry.py)
 BBMAP_URL = "https://sourceforge.net/projects/bbmap/files/BBMap_39.10.tar.gz"
 
-human_genome_gz = ref_dir / "GCF_000001405.40_GRCh38.p14_genomic.fna.gz"
-phage_genome_gz = ref_dir / "GCA_000819615.1_ViralProj14015_genomic.fna.gz"
-human_genome_fna = ref_dir / "GCF_000001405.40_GRCh38.p14_genomic.fna"
 lichen_db_csv = "lichen_reference_genomes.csv"
 lichen_md5_file = lichen_db_dir / "MD5.txt"
 bbmap_tarball = project_dir / "BBMap_39.10.tar.gz"
 
-# Download files and process them
-run_command(
-    ["wget", PHAGE_GENOME_URL, "-P", ref_dir, "-q"],
-    "Failed to download the phage genome."
-)
-run_command(
-    ["gunzip", str(phage_genome_gz)],
-    "Failed to decompress the PhiX genome."
-)
-run_command(
-    ["wget", HUMAN_GENOME_URL, "-P", ref_dir, "-q"],
-    "Failed to download the human genome."
-)
-run_command(
-    ["gunzip", str(human_genome_gz)],
-    "Failed to decompress the human genome."
-)
-run_command(
-    ["bwa", "index", str(human_genome_fna)],
-    "Failed to index the human genome."
-)
-
-
-# Lichen DB setup
-run_command(
-    ["wget", "-i", str(lichen_db_csv), "-P", lichen_db_dir, "-q"],
-    "Failed to download Lichen DB genomes."
-)
-
-# Run md5sum in the Lichen DB directory
-run_command(
-    ["md5sum", "-c", lichen_md5_file.name],  # Use only the file name
-    "MD5 checksum validation failed.",
-    cwd=lichen_db_dir  # Change the working directory to lichendb
-)
-
-# Unzip all ZIP files in the Lichen DB directory using run_command
+# The human (bwa-indexed) and PhiX references are built once in the shared registry and symlinked
+# into ref/; only the first project on a system downloads and indexes them. This runs in the
+# background while the lichen DB and BBMap are downloaded and unpacked.
+references = ThreadPoolExecutor(max_workers=1)
+reference_links = references.submit(lambda: [reference_registry.link(name, ref_dir) for name in ("human", "phix")])
+
+# Download everything concurrently (resumable, and reused from the download cache on later setups)
+with open(lichen_db_csv) as f:
+    lichen_db_urls = [line.strip() for line in f if line.strip()]
+try:
+    download_all([
+        *((url, lichen_db_dir) for url in lichen_db_urls),
+        (BBMAP_URL, project_dir),
+    ])
+except RuntimeError as e:
+    print(f"Failed to download reference files.\nError Details: {e}")
+    exit(1)
+
+# Verify the Lichen DB downloads in parallel (hashes of unchanged files are reused on reruns)
+failed = [name for name, status in verify_md5_file(lichen_md5_file).items() if status != "OK"]
+if failed:
+    print(f"MD5 checksum validation failed.\nError Details: {', '.join(failed)}")
+    exit(1)
+
+# Unzip all ZIP files in the Lichen DB directory in parallel, keeping only the genome FASTA files
+# at their paths in the archive, e.g. Ascomycota/<class>/ (compressed members stay compressed;
+# reports and metadata are skipped)
 zip_files = list(lichen_db_dir.glob("*.zip"))
 if zip_files:
-    for zip_file in zip_files:
-        try:
-            print(f"Extracting {zip_file}...")
-            run_command(
-                ["unzip", str(zip_file), "-d", str(lichen_db_dir)],
-                f"Failed to unzip {zip_file}."
-            )
-            print(f"Extraction of {zip_file} completed.")
-        except SystemExit:
+    print(f"Extracting {len(zip_files)} ZIP files...")
+    for zip_file, members in extract_zips(zip_files, lichen_db_dir, FASTA_PATTERNS, keep_paths=True).items():
+        if isinstance(members, Exception):
             print(f"Extraction failed for {zip_file}. Moving to the next file.")
-            continue  # Move to the next file
+        else:
+            print(f"Extracted {len(members)} genomes from {zip_file}.")
 else:
-    logger.info(f"No ZIP files found in {lichen_db_dir}.")
+    print(f"No ZIP files found in {lichen_db_dir}.")
 
-# Download and extract BBMap
-run_command(
-    ["wget", BBMAP_URL, "-P", project_dir, "-q"],
-    "Failed to download BBMap."
-)
+try:
+    reference_links.result()
+except Exception as e:
+    print(f"Failed to set up the human and PhiX references.\nError Details: {e}")
+    exit(1)
+references.shutdown()
 
+# Extract BBMap
 run_command(
     ["tar", "zvxf", str(bbmap_tarball), "-C", str(project_dir)],
     "Failed to extract BBMap."
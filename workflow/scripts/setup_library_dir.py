@@ -1,9 +1,15 @@
 import shutil
 import os
-import subprocess
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import argparse
 
+from archives import FASTQ_PATTERNS, extract_tar_stream, flat_route, stream_extract_tar
+from checksums import read_md5_file, verify_md5_file
+from downloads import DOWNLOAD_DEFAULTS, download_all, file_name
+from pipeline_config import get_section
+
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Process and organize sequencing files.")
 parser.add_argument(
@@ -42,53 +48,86 @@ raw_data_dir = sub_dir / "raw_data"  # Directory to store all .fq.gz files
 # Create directories
 raw_data_dir.mkdir(parents=True, exist_ok=True)
 
-# Download files using wget
+def validate_checksums(md5_file, exclude=()):
+    """Verify the files listed in an MD5.txt in parallel, reusing hashes from earlier runs."""
+    print(f"Validating checksums using {md5_file}...")
+    results = verify_md5_file(md5_file, exclude=exclude)
+    failed = [name for name, status in results.items() if status != "OK"]
+    if failed:
+        print(f"MD5 checksum validation failed for: {', '.join(failed)}.")
+    else:
+        print(f"Checksum validation completed ({len(results)} files OK).")
+
+# Download the non-archive files (MD5.txt etc.) concurrently; each is resumed and retried on its
+# own, and hashed as it is written so the MD5 check below does not read it back
+with links_file.open() as f:
+    urls = [line.strip() for line in f if line.strip()]
+tar_urls = [url for url in urls if file_name(url).endswith(".tar")]
 try:
-    subprocess.run(["wget", "-i", str(links_file), "-P", str(sub_dir)], check=True)
-except subprocess.CalledProcessError as e:
-    raise RuntimeError(f"Error: Download failed. {e}")
+    download_all([(url, sub_dir) for url in urls if url not in tar_urls])
+except RuntimeError as e:
+    raise RuntimeError(f"Error: Download failed. {e}. Rerun to resume the remaining files.")
 
-# Run MD5 checksum validation
+# Run MD5 checksum validation (streamed archives are checked as they are extracted)
 md5_file = sub_dir / "MD5.txt"
 if md5_file.is_file():
-    try:
-        print("Validating checksums using MD5.txt...")
-        subprocess.run(["md5sum", "-c", "MD5.txt"], cwd=sub_dir, check=True)
-        print("Checksum validation completed.")
-    except subprocess.CalledProcessError as e:
-        print(f"MD5 checksum validation failed: {e}.")
+    validate_checksums(md5_file, exclude={file_name(url) for url in tar_urls})
 else:
     print("No MD5.txt file found. Skipping checksum validation.")
+expected_tar_md5 = read_md5_file(md5_file) if md5_file.is_file() else {}
+
+fastq_route = flat_route(raw_data_dir, FASTQ_PATTERNS)
+
+def tar_route(tar_name):
+    """Send FASTQ members straight to raw_data/ and each archive's MD5.txt to <sub_dir>/<archive>/."""
+    def route(name):
+        if Path(name).name == "MD5.txt":
+            return sub_dir / Path(tar_name).stem / "MD5.txt"
+        return fastq_route(name)
+    return route
+
+def check_members(tar_name, members):
+    """Check extracted reads against the archive's own MD5.txt, using the hashes taken during extraction."""
+    md5_file2 = sub_dir / Path(tar_name).stem / "MD5.txt"
+    if not md5_file2.is_file():
+        print(f"No MD5.txt file found in {tar_name}. Skipping checksum validation.")
+        return
+    hashes = {dest.name: md5 for dest, md5 in members.items()}
+    failed = [name for name, md5 in read_md5_file(md5_file2).items()
+              if fastq_route(name) and hashes.get(Path(name).name) != md5]
+    if failed:
+        print(f"MD5 checksum validation failed for: {', '.join(failed)}.")
+    else:
+        print(f"Checksum validation of {tar_name} completed.")
 
-# Extract all .tar files in sub_dir
+# Extract the .tar archives while they download, keeping only the reads; the archives are never stored
+with ThreadPoolExecutor(max_workers=get_section("downloads", DOWNLOAD_DEFAULTS)["max_workers"]) as executor:
+    futures = {executor.submit(stream_extract_tar, url, tar_route(file_name(url))): file_name(url) for url in tar_urls}
+    for future in as_completed(futures):
+        tar_name = futures[future]
+        try:
+            tar_md5, members = future.result()
+        except Exception as e:
+            print(f"Extraction failed for {tar_name}: {e}. Moving to the next file.")
+            continue
+        print(f"Extracted {len(members)} files from {tar_name}.")
+        if tar_name in expected_tar_md5:
+            status = "OK" if expected_tar_md5[tar_name] == tar_md5 else "FAILED"
+            print(f"{tar_name}: {status}")
+        check_members(tar_name, members)
+
+# Extract any .tar files that were already present in sub_dir
 for tar_file in sub_dir.glob("*.tar"):
     try:
         print(f"Extracting {tar_file}...")
-        subprocess.run(
-            ["tar", "-xvf", str(tar_file), "-C", str(sub_dir)],
-            check=True  # Ensures an exception is raised if the command fails
-        )
+        with tar_file.open("rb") as f:
+            check_members(tar_file.name, extract_tar_stream(f, tar_route(tar_file.name)))
         tar_file.unlink()  # Remove the .tar file after successful extraction
         print(f"Removed {tar_file}.")
-    except subprocess.CalledProcessError as e:
+    except (OSError, tarfile.TarError) as e:
         print(f"Extraction failed for {tar_file}: {e}. Moving to the next file.")
         continue
 
-# Run MD5 checksum validation 2
-data_dir = Path(tar_file).stem  # Extract the name without extension
-data_path = sub_dir / data_dir  # Construct the full path to the data directory
-md5_file2 = data_path / "MD5.txt"
-
-if md5_file2.is_file():
-    try:
-        print("Validating checksums using MD5.txt...")
-        subprocess.run(["md5sum", "-c", "MD5.txt"], cwd=data_path, check=True)
-        print("Checksum validation completed.")
-    except subprocess.CalledProcessError as e:
-        print(f"MD5 checksum validation failed: {e}.")
-else:
-    print("No MD5.txt file found. Skipping checksum validation.")
-
 # Move all .fq.gz files to the raw_data directory
 for fq_gz_file in sub_dir.rglob("*.fq.gz"):
     target_path = raw_data_dir / fq_gz_file.name
@@ -0,0 +1,246 @@
+"""Screen each sample's composition against the lichen reference database with FracMinHash sketches.
+
+A quick check before assembly: each decontaminated read set is hashed once into
+a scaled MinHash sketch (canonical k-mer hashes below 2^64 / scaled, with their
+counts; hashes seen fewer than `min_abundance` times are dropped as sequencing
+errors). The sketch is compared with precomputed sketches of every genome in the
+lichen database, built once from the group FASTA files like the minimizer index
+(minimizers.py, using the `classify` lichendb, lineage and role settings).
+
+For each genome, containment is the fraction of its sketch found in the sample,
+and ANI is estimated as containment^(1/k). The on-target fraction is the share
+of the sample's sketched k-mers (weighted by count) found in any database
+genome; samples below `off_target` are flagged, and assembler_router.py queues
+them last and assembles them with `assembler_routing: off_target_assembler`.
+
+Outputs, in the output directory:
+  <ID>_screen.tsv     genomes ranked by containment (genome, lineage, role, containment, ani, shared, sketch, abundance)
+  screen_summary.tsv  one row per sample: on-target fraction, best genome and best containment per role, off_target
+"""
+import os
+import csv
+import json
+import pathlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from classify_reads import get_ids_and_files, read_batches
+from minimizers import CHUNK, CLASSIFY_DEFAULTS, MAX_HASH, Taxonomy, encode, group_files, kmer_hashes, read_fasta, \
+    read_lineages
+from pipeline_config import get_section, setup_logging
+from work_queue import file_lock, get_work_queue
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `screen` section of config/config.yaml
+SCREEN_DEFAULTS = {
+    "sketches": "../ref/lichendb/sketches",   # genome sketches, built on first use
+    "k": 21,
+    "scaled": 1000,
+    "min_abundance": 2,        # sample hashes seen fewer times are treated as errors
+    "min_containment": 0.01,   # genomes listed in <ID>_screen.tsv
+    "off_target": 0.5,         # flag samples with a smaller on-target fraction
+    "batch_reads": 100000,
+    "workers": 4,              # processes building the genome sketches
+    "output_dir": "./screen",
+}
+
+SUMMARY_FILE = "screen_summary.tsv"
+SUMMARY_HEADER = ["ID", "reads", "bases", "sketch_hashes", "on_target", "top_genome", "top_containment",
+                  "mycobiont_containment", "photobiont_containment", "off_target"]
+
+
+def sketch(codes, k, scaled):
+    """Distinct FracMinHash hashes of the k-mers in the encoded sequence."""
+    hashes = kmer_hashes(codes, k)
+    return np.unique(hashes[hashes < MAX_HASH // np.uint64(scaled)])
+
+
+def sketch_group_file(fasta_file, group_path, lineages, k, scaled):
+    """{genome: (lineage path, hashes)} for one group FASTA; contigs are grouped by accession prefix."""
+    genomes = {}
+    for header, sequence in read_fasta(fasta_file):
+        accession = header.split(b"|", 1)[0].decode() if b"|" in header else None
+        name = accession or "/".join(group_path)
+        path = lineages.get(accession, group_path)
+        parts = genomes.setdefault(name, (path, []))[1]
+        for start in range(0, max(len(sequence) - k + 1, 1), CHUNK):
+            parts.append(sketch(encode(sequence[start:start + CHUNK + k - 1]), k, scaled))
+    return {name: (path, np.unique(np.concatenate(parts))) for name, (path, parts) in genomes.items()}
+
+
+def build_sketches(settings, classify_settings):
+    """Sketch every genome of the lichen database into settings["sketches"]."""
+    files = group_files(classify_settings["lichendb"])
+    if not files:
+        raise FileNotFoundError(f"No concatenated_genomes.fa[.gz] found under {classify_settings['lichendb']}")
+    lineages = read_lineages(classify_settings["lineages"])
+    genomes = {}
+    with ProcessPoolExecutor(max_workers=min(settings["workers"], len(files))) as executor:
+        futures = {executor.submit(sketch_group_file, path, group, lineages, settings["k"], settings["scaled"]): path
+                   for path, group in files.items()}
+        for future in as_completed(futures):
+            genomes.update(future.result())
+            logger.info(f"Sketched {futures[future]}")
+
+    taxonomy = Taxonomy.from_paths([path for path, _ in genomes.values()], classify_settings["roles"] or {})
+    entries, arrays, start = [], [], 0
+    for name, (path, hashes) in sorted(genomes.items()):
+        if not len(hashes):
+            continue
+        node = taxonomy.node(path)
+        entries.append({"name": name, "lineage": taxonomy.lineage(node), "role": taxonomy.roles[node],
+                        "start": start, "end": start + len(hashes)})
+        arrays.append(hashes)
+        start += len(hashes)
+    hashes = np.concatenate(arrays)
+
+    out_dir = pathlib.Path(settings["sketches"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / "hashes.tmp.npy", hashes)
+    np.save(out_dir / "union.tmp.npy", np.unique(hashes))
+    meta = {"k": settings["k"], "scaled": settings["scaled"], "genomes": entries}
+    (out_dir / "genomes.tmp.json").write_text(json.dumps(meta))
+    for name in ("hashes.npy", "union.npy", "genomes.json"):
+        stem, suffix = name.split(".")
+        os.replace(out_dir / f"{stem}.tmp.{suffix}", out_dir / name)
+    logger.info(f"Sketched {len(entries)} genomes into {out_dir}")
+
+
+def load_sketches(settings, classify_settings):
+    """Returns (hashes, union, genomes), building the sketches first if needed; arrays are memory-mapped."""
+    out_dir = pathlib.Path(settings["sketches"])
+    if not (out_dir / "genomes.json").is_file():
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with file_lock(out_dir / ".lock"):
+            if not (out_dir / "genomes.json").is_file():
+                build_sketches(settings, classify_settings)
+    meta = json.loads((out_dir / "genomes.json").read_text())
+    if (meta["k"], meta["scaled"]) != (settings["k"], settings["scaled"]):
+        raise ValueError(f"Sketches in {out_dir} use k={meta['k']}, scaled={meta['scaled']}; "
+                         "remove them to rebuild with the configured values")
+    return (np.load(out_dir / "hashes.npy", mmap_mode="r"), np.load(out_dir / "union.npy", mmap_mode="r"),
+            meta["genomes"])
+
+
+def sketch_reads(reads_file, settings):
+    """Sample sketch as sorted (hashes, counts), plus the read and base counts."""
+    keys, counts = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    pending = []
+    reads = bases = 0
+
+    def merge(keys, counts):
+        keys, inverse = np.unique(np.concatenate([keys, *pending]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts, np.ones(len(inverse) - len(counts))]))
+        pending.clear()
+        return keys, counts.astype(np.int64)
+
+    threshold = MAX_HASH // np.uint64(settings["scaled"])
+    for _, sequences in read_batches(reads_file, settings["batch_reads"]):
+        reads += len(sequences)
+        bases += sum(map(len, sequences))
+        # Reads are joined by N, so no k-mer spans two reads
+        hashes = kmer_hashes(encode(b"N".join(sequences)), settings["k"])
+        pending.append(hashes[hashes < threshold])
+        # Merge once the unmerged hashes outgrow the sketch, rather than re-sorting it for every batch
+        if sum(map(len, pending)) >= max(len(keys), 1 << 20):
+            keys, counts = merge(keys, counts)
+    keys, counts = merge(keys, counts)
+    keep = counts >= settings["min_abundance"]
+    return keys[keep], counts[keep], reads, bases
+
+
+def screen_sample(id, reads_file, settings, classify_settings):
+    ref_hashes, union, genomes = load_sketches(settings, classify_settings)
+    keys, counts, reads, bases = sketch_reads(reads_file, settings)
+
+    index = np.searchsorted(union, keys)
+    index[index == len(union)] = 0
+    on_target = float(counts[union[index] == keys].sum() / counts.sum()) if len(keys) else 0.0
+
+    # Containment of every genome at once: look each reference hash up in the sample sketch
+    found = np.searchsorted(keys, ref_hashes)
+    found[found == len(keys)] = 0
+    hit = keys[found] == ref_hashes if len(keys) else np.zeros(len(ref_hashes), dtype=bool)
+    abundance = np.where(hit, counts[found] if len(keys) else 0, 0)
+    starts = np.array([genome["start"] for genome in genomes])
+    sizes = np.array([genome["end"] - genome["start"] for genome in genomes])
+    shared = np.add.reduceat(hit.astype(np.int64), starts)
+    total_abundance = np.add.reduceat(abundance, starts)
+    containment = shared / sizes
+
+    rows = []
+    for i in np.argsort(-containment, kind="stable"):
+        if containment[i] < settings["min_containment"]:
+            break
+        rows.append((genomes[i], containment[i], shared[i], sizes[i], total_abundance[i] / max(shared[i], 1)))
+    output_dir = pathlib.Path(settings["output_dir"])
+    with open(output_dir / f"{id}_screen.tsv", "w") as out:
+        out.write("genome\tlineage\trole\tcontainment\tani\tshared\tsketch\tabundance\n")
+        for genome, contained, hits, size, depth in rows:
+            ani = contained ** (1 / settings["k"])
+            out.write(f"{genome['name']}\t{genome['lineage']}\t{genome['role']}\t{contained:.4f}\t{ani:.4f}"
+                      f"\t{hits}\t{size}\t{depth:.1f}\n")
+
+    best_by_role = {}
+    for genome, contained in zip(genomes, containment):
+        best_by_role[genome["role"]] = max(best_by_role.get(genome["role"], 0.0), float(contained))
+    top = int(np.argmax(containment)) if len(genomes) else None
+    summary = {
+        "ID": id, "reads": reads, "bases": bases, "sketch_hashes": len(keys), "on_target": f"{on_target:.4f}",
+        "top_genome": genomes[top]["name"] if top is not None else "",
+        "top_containment": f"{containment[top]:.4f}" if top is not None else "0",
+        "mycobiont_containment": f"{best_by_role.get('mycobiont', 0.0):.4f}",
+        "photobiont_containment": f"{best_by_role.get('photobiont', 0.0):.4f}",
+        "off_target": on_target < settings["off_target"],
+    }
+    record_screen(summary, output_dir)
+    logger.info(f"{id}: {on_target:.1%} of sketched k-mers on target"
+                f"{' (flagged off-target)' if summary['off_target'] else ''}; top genome {summary['top_genome']}")
+    return summary
+
+
+def record_screen(row, output_dir):
+    """Merge one sample's row into the summary table; other workers may be recording at the same time."""
+    table = pathlib.Path(output_dir) / SUMMARY_FILE
+    with file_lock(table.with_suffix(".lock")):
+        records = {}
+        if table.is_file():
+            with table.open(newline="") as f:
+                records = {record["ID"]: record for record in csv.DictReader(f, delimiter="\t")}
+        records[row["ID"]] = row
+        tmp_table = table.with_suffix(".tmp")
+        with tmp_table.open("w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_HEADER, delimiter="\t")
+            writer.writeheader()
+            for record in records.values():
+                writer.writerow(record)
+        os.replace(tmp_table, table)
+
+
+def main(seq_dir, config_file="config/config.yaml", max_workers=4):
+    settings = get_section("screen", SCREEN_DEFAULTS, config_file)
+    classify_settings = get_section("classify", CLASSIFY_DEFAULTS, config_file)
+    id_to_file = get_ids_and_files(seq_dir)
+    if not id_to_file:
+        logger.error("No input files found. Exiting.")
+        return
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    load_sketches(settings, classify_settings)
+
+    queue = get_work_queue("screen", config_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {id: executor.submit(queue.run, id, screen_sample, id, reads_file, settings, classify_settings)
+                   for id, reads_file in id_to_file.items()}
+        for id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error screening {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("sketch_screen.log")
+    main('./decontaminated_reads/')
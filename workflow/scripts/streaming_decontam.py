@@ -0,0 +1,181 @@
+import os
+import csv
+import shutil
+import tempfile
+import threading
+import itertools
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from compression import fq_suffix, open_output
+from decontam_bbduk_bwa import HUMAN_REF, bbduk_command, decontaminated_fastq, write_fastq_output
+from fastp_raw import fastp_command
+from pipeline_config import get_section, log_dir, reference_path, setup_logging, tool_path
+from reference_registry import prepare_bwa_index
+from work_queue import get_work_queue
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `streaming` section of config/config.yaml
+STREAMING_DEFAULTS = {
+    "keep_unmerged": True,   # metaSPAdes reads {id}_unmerged_1/2.fq from the fastp directory
+    "bwa_threads": 8,
+    "batch_reads": 4096,
+}
+
+
+def _pump(source, sink, lock, batch_reads, copy_path=None, config_file="config/config.yaml"):
+    """Copy whole FASTQ records from an open FIFO into the shared sink, optionally teeing to a file."""
+    copy = open_output(copy_path, config_file=config_file) if copy_path else None
+    sink_open = True
+    try:
+        with source:
+            while True:
+                block = b"".join(itertools.islice(source, 4 * batch_reads))
+                if not block:
+                    break
+                if sink_open:
+                    try:
+                        with lock:
+                            sink.write(block)
+                    except (BrokenPipeError, ValueError):
+                        # Keep draining so fastp can exit; the failed step is reported by _check
+                        sink_open = False
+                if copy:
+                    copy.write(block)
+    finally:
+        if copy:
+            copy.close()
+
+
+def _open_fifos(paths):
+    """Open the read end of each FIFO without waiting for a writer, plus a write end held by us.
+
+    Readers only see EOF once the held write ends are closed, so a FIFO that
+    fastp never opens (e.g. it fails early) cannot leave a reader blocked.
+    """
+    readers, holders = [], []
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        os.set_blocking(fd, True)
+        readers.append(os.fdopen(fd, "rb"))
+        holders.append(os.open(path, os.O_WRONLY))
+    return readers, holders
+
+
+def _check(process, name, id):
+    if process.wait() != 0:
+        logger.error(f"{name} failed for {id} with return code {process.returncode}. See log for details.")
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def run_streaming_sample(id, r1_path, r2_path, fastp_dir, output_dir, settings, config_file="config/config.yaml"):
+    """Run fastp -> merged/unmerged concatenation -> BBDuk -> bwa -> unmapped reads through pipes.
+
+    Only the fastp reports, BBDuk/flagstat stats and the decontaminated reads are
+    written to disk (plus the unmerged pairs when keep_unmerged is set).
+    """
+    os.makedirs(fastp_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    unmapped_fastq = decontaminated_fastq(id, output_dir, config_file)
+    stats_file = f"{output_dir}/{id}_human_mapping_flagtats.txt"
+
+    fifo_dir = tempfile.mkdtemp(prefix=f"{id}_stream_")
+    try:
+        fifos = {name: os.path.join(fifo_dir, f"{name}.fq") for name in ("merged", "unmerged_1", "unmerged_2")}
+        flagstat_fifo = os.path.join(fifo_dir, "flagstat.sam")
+        for path in [*fifos.values(), flagstat_fifo]:
+            os.mkfifo(path)
+
+        human_ref = reference_path("human", HUMAN_REF, config_file)
+        prepare_bwa_index(human_ref, config_file)  # shared-memory index, if enabled
+        logger.info(f"Starting streaming decontamination for {id}")
+        with open(f"{log_dir}/{id}_stream_error.log", "w") as err, open(stats_file, "w") as stats_out:
+            fastp = subprocess.Popen(
+                fastp_command(id, r1_path, r2_path, fastp_dir, merged_out=fifos["merged"],
+                              out1=fifos["unmerged_1"], out2=fifos["unmerged_2"], unpaired=False,
+                              config_file=config_file),
+                stdout=err, stderr=err
+            )
+            bbduk = subprocess.Popen(bbduk_command(id, "stdin.fq", "stdout.fq", output_dir, config_file),
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err)
+            bwa = subprocess.Popen(
+                [tool_path("bwa", config_file), "mem", "-M", "-t", str(settings["bwa_threads"]), human_ref, "-"],
+                stdin=bbduk.stdout, stdout=subprocess.PIPE, stderr=err
+            )
+            bbduk.stdout.close()
+            tee = subprocess.Popen(["tee", flagstat_fifo], stdin=bwa.stdout, stdout=subprocess.PIPE)
+            bwa.stdout.close()
+            flagstat = subprocess.Popen([tool_path("samtools", config_file), "flagstat", flagstat_fifo],
+                                        stdout=stats_out, stderr=err)
+            unmapped, fastq_out = write_fastq_output([tool_path("samtools", config_file), "fastq", "-f", "4", "-"],
+                                                     unmapped_fastq, stdin=tee.stdout, config_file=config_file)
+            tee.stdout.close()
+
+            # fastp writes its three outputs concurrently, so each FIFO needs its own reader
+            lock = threading.Lock()
+            readers, holders = _open_fifos(fifos.values())
+            pumps = [threading.Thread(
+                target=_pump,
+                args=(source, bbduk.stdin, lock, settings["batch_reads"],
+                      f"{fastp_dir}/{id}_{name}{fq_suffix(config_file)}" if settings["keep_unmerged"] and name != "merged" else None,
+                      config_file)
+            ) for name, source in zip(fifos, readers)]
+            for pump in pumps:
+                pump.start()
+            # Once fastp has exited (whether or not it opened every output), closing our
+            # write ends gives each reader EOF
+            fastp.wait()
+            for fd in holders:
+                os.close(fd)
+            for pump in pumps:
+                pump.join()
+            try:
+                bbduk.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            with fastq_out:
+                for process, name in [(fastp, "fastp"), (bbduk, "BBDuk"), (bwa, "BWA MEM"), (tee, "tee"),
+                                      (flagstat, "samtools flagstat"),
+                                      *zip(unmapped, ["samtools fastq", "compressor"])]:
+                    _check(process, name, id)
+
+        logger.info(f"Successfully processed {id} for PhiX and human decontamination")
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+
+
+def main(csv_file, fastp_dir, output_dir, max_workers=2, config_file="config/config.yaml"):
+    settings = get_section("streaming", STREAMING_DEFAULTS, config_file)
+
+    with open(csv_file, newline='') as csvfile:
+        samples = [(row['ID'].strip(), row['forward'].strip(), row['reverse'].strip())
+                   for row in csv.DictReader(csvfile)]
+    if not samples:
+        logger.error("No samples found. Exiting.")
+        return
+
+    queue = get_work_queue("stream", config_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(queue.run, id, run_streaming_sample, id, r1_path, r2_path, fastp_dir, output_dir,
+                                   settings, config_file): id
+                   for id, r1_path, r2_path in samples}
+
+        for future in as_completed(futures):
+            id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Streaming decontamination failed for {id}: {e}")
+
+
+if __name__ == "__main__":
+    setup_logging("streaming_decontam.log")
+
+    csv_file = 'samples_out.csv'
+    fastp_dir = './fastp_processed'
+    output_dir = './decontaminated_reads'
+
+    main(csv_file, fastp_dir, output_dir, max_workers=2)
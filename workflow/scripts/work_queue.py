@@ -0,0 +1,218 @@
+"""Shared work queue so several nodes can run the same stage over one batch.
+
+Claims live in an SQLite table in the project directory. A worker claims a
+sample before processing it, refreshes a heartbeat while it runs, and marks it
+done or failed at the end. Claims whose heartbeat is older than stale_after are
+taken over by the next worker that asks, so a crashed node's samples are rerun.
+
+Usage: python work_queue.py status [<stage>]
+       python work_queue.py reset <stage> [--failed]
+"""
+import os
+import time
+import fcntl
+import socket
+import sqlite3
+import argparse
+import threading
+import logging
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from pipeline_config import get_section
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the `queue` section of config/config.yaml
+QUEUE_DEFAULTS = {
+    "enabled": False,
+    "db": ".queue/claims.sqlite",
+    "stale_after": 900,   # seconds without a heartbeat before a claim can be taken over
+    "heartbeat": 60,      # seconds between heartbeats
+    "max_attempts": 2,    # failed samples are retried until they have run this many times
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS claims (
+    stage TEXT NOT NULL,
+    id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    heartbeat REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (stage, id)
+)
+"""
+
+
+class WorkQueue:
+    """Claims samples for one stage. With enabled=False every sample is run locally."""
+
+    def __init__(self, stage, db_path, stale_after=900, heartbeat=60, max_attempts=2, enabled=True):
+        self.stage = stage
+        self.db_path = Path(db_path)
+        self.stale_after = stale_after
+        self.heartbeat = heartbeat
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = set()
+        self.lock = threading.Lock()
+        self._thread = None
+        if enabled:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(self._connect()) as con:
+                con.execute(SCHEMA)
+
+    def _connect(self):
+        # Rollback journal rather than WAL: WAL needs shared memory, which network filesystems lack
+        return sqlite3.connect(str(self.db_path), timeout=120, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            yield con
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def claim(self, id):
+        """Try to claim a sample. Returns False if it is done, running elsewhere or out of attempts."""
+        now = time.time()
+        with self._transaction() as con:
+            row = con.execute("SELECT owner, status, heartbeat, attempts FROM claims WHERE stage = ? AND id = ?",
+                              (self.stage, id)).fetchone()
+            if row is None:
+                con.execute("INSERT INTO claims (stage, id, owner, status, heartbeat) VALUES (?, ?, ?, 'running', ?)",
+                            (self.stage, id, self.owner, now))
+            else:
+                owner, status, heartbeat, attempts = row
+                if status == "done":
+                    return False
+                if status == "running" and now - heartbeat < self.stale_after:
+                    return False
+                if attempts >= self.max_attempts:
+                    if status == "running":
+                        # Its last worker died: record it as failed so `reset --failed` picks it up
+                        logger.warning(f"{self.stage} {id} was abandoned by {owner} with no attempts left; "
+                                       "marking it failed")
+                        con.execute("UPDATE claims SET status = 'failed' WHERE stage = ? AND id = ?",
+                                    (self.stage, id))
+                    return False
+                if status == "running":
+                    logger.warning(f"Reclaiming {self.stage} {id} from {owner} (no heartbeat for {now - heartbeat:.0f}s)")
+                con.execute("UPDATE claims SET owner = ?, status = 'running', heartbeat = ?, attempts = attempts + 1 "
+                            "WHERE stage = ? AND id = ?", (self.owner, now, self.stage, id))
+
+        with self.lock:
+            self.held.add(id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._beat, daemon=True)
+                self._thread.start()
+        return True
+
+    def _beat(self):
+        while True:
+            time.sleep(self.heartbeat)
+            with self.lock:
+                if not self.held:
+                    self._thread = None
+                    return
+                ids = list(self.held)
+            try:
+                with self._transaction() as con:
+                    con.executemany("UPDATE claims SET heartbeat = ? WHERE stage = ? AND id = ? AND owner = ?",
+                                    [(time.time(), self.stage, id, self.owner) for id in ids])
+            except sqlite3.Error as e:
+                logger.warning(f"Heartbeat for {self.stage} failed: {e}")
+
+    def _finish(self, id, status):
+        with self.lock:
+            self.held.discard(id)
+        with self._transaction() as con:
+            con.execute("UPDATE claims SET status = ?, heartbeat = ? WHERE stage = ? AND id = ? AND owner = ?",
+                        (status, time.time(), self.stage, id, self.owner))
+
+    def complete(self, id):
+        self._finish(id, "done")
+
+    def fail(self, id):
+        self._finish(id, "failed")
+
+    def run(self, id, func, *args, **kwargs):
+        """Run func for one sample if this worker can claim it; returns None if it was skipped."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        if not self.claim(id):
+            logger.info(f"Skipping {id}: {self.stage} is done or claimed by another worker")
+            return None
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            self.fail(id)
+            raise
+        self.complete(id)
+        return result
+
+    def reset(self, failed_only=False):
+        """Forget claims for this stage so its samples run again."""
+        with self._transaction() as con:
+            query = "DELETE FROM claims WHERE stage = ?" + (" AND status = 'failed'" if failed_only else "")
+            return con.execute(query, (self.stage,)).rowcount
+
+
+def get_work_queue(stage, config_file="config/config.yaml"):
+    settings = get_section("queue", QUEUE_DEFAULTS, config_file)
+    return WorkQueue(stage, settings["db"], settings["stale_after"], settings["heartbeat"],
+                     settings["max_attempts"], enabled=bool(settings["enabled"]))
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive POSIX lock on path (created if missing) for read-modify-write of shared files."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or reset the shared work queue.")
+    parser.add_argument("--config", default="config/config.yaml")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status", help="List claims, optionally for one stage.")
+    status_parser.add_argument("stage", nargs="?")
+    reset_parser = subparsers.add_parser("reset", help="Clear claims for a stage so it runs again.")
+    reset_parser.add_argument("stage")
+    reset_parser.add_argument("--failed", action="store_true", help="Only clear failed samples.")
+    args = parser.parse_args(argv)
+
+    settings = get_section("queue", QUEUE_DEFAULTS, args.config)
+    if args.command == "reset":
+        removed = WorkQueue(args.stage, settings["db"]).reset(args.failed)
+        print(f"Cleared {removed} claims for {args.stage}")
+        return
+
+    if not Path(settings["db"]).is_file():
+        print("No claims recorded.")
+        return
+    with closing(sqlite3.connect(settings["db"])) as con:
+        query = "SELECT stage, id, owner, status, heartbeat, attempts FROM claims"
+        rows = con.execute(query + (" WHERE stage = ?" if args.stage else "") + " ORDER BY stage, id",
+                           (args.stage,) if args.stage else ()).fetchall()
+    print("stage\tID\towner\tstatus\tlast_heartbeat\tattempts")
+    for stage, id, owner, status, heartbeat, attempts in rows:
+        print(f"{stage}\t{id}\t{owner}\t{status}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(heartbeat))}\t{attempts}")
+
+
+if __name__ == "__main__":
+    main()